@@ -1,27 +1,85 @@
 import re
+import hashlib
+from calendar import timegm
+from cStringIO import StringIO
 
 from django.contrib.syndication.views import Feed
 from django.contrib.sites.models import get_current_site
-from django.core.urlresolvers import reverse
+from django.core.cache import cache
+from django.core.urlresolvers import reverse, get_urlconf
+from django.conf import settings
+from django.http import (HttpResponse, HttpResponseNotModified,
+    StreamingHttpResponse)
+from django.utils.feedgenerator import Rss201rev2Feed
+from django.utils.http import (http_date, parse_http_date_safe, parse_etags,
+    quote_etag)
+from django.utils import timezone
 from django.utils.translation import ugettext as _
+from django.utils.xmlutils import SimplerXMLGenerator
 
 from versionutils.versioning.constants import *
 
-from .utils import merge_changes
+from .models import ActivityEntry, get_activity_feed_version
+from .utils import load_changes
 from .views import IGNORE_TYPES
 from . import get_changes_classes
 
 MAX_CHANGES = 250
 
+# Bump this when the feed's output changes, so stale cached feeds
+# aren't used.
+ACTIVITY_FEED_VERSION = 1
+ACTIVITY_FEED_CACHE_TIMEOUT = 60 * 60 * 24
+
 region_routing_pattern = re.compile(
     '^/(?P<region>[^/]+?)/.*'
 )
 
 
+class StreamingRss201rev2Feed(Rss201rev2Feed):
+    """
+    An RSS feed that can be written out an item at a time.
+    """
+    def stream(self, encoding):
+        """
+        Yields the feed's XML in chunks, the same as write() would write it.
+        """
+        out = StringIO()
+
+        def _flush():
+            chunk = out.getvalue()
+            out.seek(0)
+            out.truncate()
+            return chunk
+
+        handler = SimplerXMLGenerator(out, encoding)
+        handler.startDocument()
+        handler.startElement(u"rss", self.rss_attributes())
+        handler.startElement(u"channel", self.root_attributes())
+        self.add_root_elements(handler)
+        yield _flush()
+
+        for item in self.items:
+            handler.startElement(u"item", self.item_attributes(item))
+            self.add_item_elements(handler, item)
+            handler.endElement(u"item")
+            yield _flush()
+
+        self.endChannelElement(handler)
+        handler.endElement(u"rss")
+        yield _flush()
+
+
 class ActivityFeedSyndication(Feed):
     """
     Activity feed (syndication) for the whole region.
+
+    The feed only changes when a change is added to or removed from the
+    region, so it's cached and validated by the region's most recent
+    change and its activity feed version.
     """
+    feed_type = StreamingRss201rev2Feed
+
     def __call__(self, request, *args, **kwargs):
         from regions.models import Region
         re_match = region_routing_pattern.match(request.get_full_path())
@@ -29,7 +87,57 @@ class ActivityFeedSyndication(Feed):
             region_slug = re_match.group('region')
             self.region = Region.objects.get(slug=region_slug)
 
-        return super(ActivityFeedSyndication, self).__call__(request, *args, **kwargs)
+        latest = self.changes().values_list('id', 'date')[:1]
+        latest_id, latest_date = latest[0] if latest else (None, None)
+        feed_version = get_activity_feed_version(self.region.id)
+
+        # The feed's links depend on the host it's served from.
+        etag = quote_etag(hashlib.md5('%s:%s:%s:%s:%s:%s' % (
+            ACTIVITY_FEED_VERSION, request.get_host(),
+            get_urlconf() or settings.ROOT_URLCONF, self.region.id,
+            latest_id, feed_version)).hexdigest())
+        last_modified = None
+        if latest_date:
+            if timezone.is_naive(latest_date):
+                latest_date = timezone.make_aware(
+                    latest_date, timezone.get_default_timezone())
+            last_modified = timegm(latest_date.utctimetuple())
+            # Removing a change doesn't make the latest one any later.
+            last_modified = max(last_modified, int(float(feed_version)))
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if if_none_match:
+            not_modified = etag in parse_etags(if_none_match)
+        else:
+            not_modified = (if_modified_since and last_modified and
+                            last_modified <= if_modified_since)
+
+        if not_modified:
+            response = HttpResponseNotModified()
+        else:
+            key = 'activity_feed:%s' % etag.strip('"')
+            content = cache.get(key)
+            if content is None:
+                feedgen = self.get_feed(self.get_object(request, *args, **kwargs), request)
+                response = StreamingHttpResponse(
+                    self._stream_and_cache(feedgen, key),
+                    content_type=feedgen.mime_type)
+            else:
+                response = HttpResponse(content, content_type=self.feed_type.mime_type)
+
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def _stream_and_cache(self, feedgen, key):
+        chunks = []
+        for chunk in feedgen.stream('utf-8'):
+            chunks.append(chunk)
+            yield chunk
+        cache.set(key, ''.join(chunks), ACTIVITY_FEED_CACHE_TIMEOUT)
 
     def site(self):
         if not hasattr(self, '_current_site'):
@@ -45,29 +153,27 @@ class ActivityFeedSyndication(Feed):
     def description(self):
         return _("Activity on %s") % self.site().name
 
-    def format_change_set(self, change_obj, change_set):
-        formatted_changes = []
-        for obj in change_set:
-            obj.classname = change_obj.classname
-            obj.page = change_obj.page(obj)
-            obj.title = change_obj.title(obj)
-            obj.slug = obj.page.slug
-            obj.diff_url = change_obj.diff_url(obj)
-            obj.as_of_url = change_obj.as_of_url(obj)
-            formatted_changes.append(obj)
-        return formatted_changes
+    def changes(self):
+        return ActivityEntry.objects.filter(region=self.region).\
+            exclude(history_type__in=IGNORE_TYPES)
 
-    def items(self):
-        change_sets = []
+    def format_change(self, change_obj, obj):
+        obj.classname = change_obj.classname
+        obj.page = change_obj.page(obj)
+        obj.title = change_obj.title(obj)
+        obj.slug = obj.page.slug
+        obj.diff_url = change_obj.diff_url(obj)
+        obj.as_of_url = change_obj.as_of_url(obj)
+        return obj
 
+    def items(self):
+        change_objs = {}
         for change_class in get_changes_classes():
-            change_obj = change_class(region=self.region)
-            change_set = change_obj.queryset()[:MAX_CHANGES].iterator()
-            change_sets.append(
-                self.format_change_set(change_obj, change_set))
+            change_objs[change_class.classname] = change_class(region=self.region)
 
-        changes = merge_changes(change_sets)[:MAX_CHANGES]
-        return skip_ignored_change_types(changes)
+        entries = self.changes()[:MAX_CHANGES]
+        return [self.format_change(change_objs[obj.classname], obj)
+                for obj in load_changes(list(entries))]
 
     def item_title(self, item):
         return item.title
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from activity import get_changes_classes
+from activity.models import ActivityEntry
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = ('Adds the ActivityEntry rows missing for existing historical '
+            'instances.  Run this once after installing the activity '
+            'table; new changes are recorded as they are saved')
+
+    def handle(self, *args, **options):
+        for change_class in get_changes_classes():
+            change_obj = change_class()
+            classname = change_class.classname
+            slug_lookup = change_obj.get_page_lookup_info()
+            existing = set(ActivityEntry.objects.filter(classname=classname).
+                values_list('history_id', flat=True))
+
+            num_added = 0
+            last_id = 0
+            while True:
+                batch = list(change_obj.queryset().filter(history_id__gt=last_id).
+                    order_by('history_id').
+                    values_list('history_id', 'region', slug_lookup,
+                                'history_type', 'history_date', 'history_user')
+                    [:BATCH_SIZE])
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+
+                entries = []
+                for (history_id, region_id, page_slug, history_type, date, user_id) in batch:
+                    if history_id in existing:
+                        continue
+                    entries.append(ActivityEntry(
+                        classname=classname,
+                        region_id=region_id,
+                        page_slug=page_slug or '',
+                        history_id=history_id,
+                        history_type=history_type,
+                        date=date,
+                        user_id=user_id,
+                    ))
+                ActivityEntry.objects.bulk_create(entries)
+                num_added += len(entries)
+
+            self.stdout.write('Added %d activity entries for %s changes\n'
+                              % (num_added, classname))
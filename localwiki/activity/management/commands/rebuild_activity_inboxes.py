@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from follow.models import Follow
+
+from activity.models import _rebuild_inbox
+
+
+class Command(BaseCommand):
+    help = ('Refills the followed-activity inbox of every user who follows '
+            'something.  Run this after build_activity_entries')
+    option_list = BaseCommand.option_list + (
+        make_option('--async',
+            action='store_true',
+            dest='async',
+            default=False,
+            help='Queue a task per user instead of rebuilding right away'),
+    )
+
+    def handle(self, *args, **options):
+        user_ids = Follow.objects.values_list('user', flat=True).distinct()
+        num_users = 0
+        for user_id in user_ids.order_by('user'):
+            if options['async']:
+                _rebuild_inbox.delay(user_id)
+            else:
+                _rebuild_inbox(user_id)
+            num_users += 1
+        if options['async']:
+            self.stdout.write('Queued inbox rebuilds for %d users\n' % num_users)
+        else:
+            self.stdout.write('Rebuilt the inboxes of %d users\n' % num_users)
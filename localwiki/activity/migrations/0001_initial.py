@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'ActivityEntry'
+        db.create_table(u'activity_activityentry', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('classname', self.gf('django.db.models.fields.CharField')(max_length=32)),
+            ('region', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['regions.Region'])),
+            ('page_slug', self.gf('django.db.models.fields.CharField')(max_length=255)),
+            ('history_id', self.gf('django.db.models.fields.PositiveIntegerField')()),
+            ('history_type', self.gf('django.db.models.fields.SmallIntegerField')()),
+            ('date', self.gf('django.db.models.fields.DateTimeField')(db_index=True)),
+            ('user', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['auth.User'], null=True, on_delete=models.SET_NULL)),
+        ))
+        db.send_create_signal(u'activity', ['ActivityEntry'])
+
+        # Adding unique constraint on 'ActivityEntry', fields ['classname', 'history_id']
+        db.create_unique(u'activity_activityentry', ['classname', 'history_id'])
+
+        # Adding index on 'ActivityEntry', fields ['region', 'date', 'id']
+        db.create_index(u'activity_activityentry', ['region_id', 'date', 'id'])
+
+        # Adding index on 'ActivityEntry', fields ['user', 'date', 'id']
+        db.create_index(u'activity_activityentry', ['user_id', 'date', 'id'])
+
+        # Adding index on 'ActivityEntry', fields ['region', 'page_slug']
+        db.create_index(u'activity_activityentry', ['region_id', 'page_slug'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'ActivityEntry', fields ['region', 'page_slug']
+        db.delete_index(u'activity_activityentry', ['region_id', 'page_slug'])
+
+        # Removing index on 'ActivityEntry', fields ['user', 'date', 'id']
+        db.delete_index(u'activity_activityentry', ['user_id', 'date', 'id'])
+
+        # Removing index on 'ActivityEntry', fields ['region', 'date', 'id']
+        db.delete_index(u'activity_activityentry', ['region_id', 'date', 'id'])
+
+        # Removing unique constraint on 'ActivityEntry', fields ['classname', 'history_id']
+        db.delete_unique(u'activity_activityentry', ['classname', 'history_id'])
+
+        # Deleting model 'ActivityEntry'
+        db.delete_table(u'activity_activityentry')
+
+
+    models = {
+        u'activity.activityentry': {
+            'Meta': {'ordering': "('-date', '-id')", 'unique_together': "(('classname', 'history_id'),)", 'object_name': 'ActivityEntry', 'index_together': "[('region', 'date', 'id'), ('user', 'date', 'id'), ('region', 'page_slug')]"},
+            'classname': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'date': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'history_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'history_type': ('django.db.models.fields.SmallIntegerField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'page_slug': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'region': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['regions.Region']"}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['auth.User']", 'null': 'True', 'on_delete': 'models.SET_NULL'})
+        },
+        u'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        u'auth.permission': {
+            'Meta': {'ordering': "(u'content_type__app_label', u'content_type__model', u'codename')", 'unique_together': "((u'content_type', u'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'unique': 'True', 'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Group']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Permission']"}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'regions.region': {
+            'Meta': {'object_name': 'Region'},
+            'full_name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'geom': ('django.contrib.gis.db.models.fields.MultiPolygonField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'db_index': 'True'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'unique': 'True', 'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['activity']
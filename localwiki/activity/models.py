@@ -1,4 +1,20 @@
+import time
+
+from celery import shared_task
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+
+from actstream.models import Action
+from follow.models import Follow
+
 from localwiki.utils.urlresolvers import reverse
+from localwiki.utils.tasks import debounce, debounce_started
 
 
 class ActivityForModel(object):
@@ -92,3 +108,312 @@ class ActivityForModel(object):
             'region': self.page(obj).region.slug,
             'date': obj.version_info.date,
         })
+
+
+class ActivityEntry(models.Model):
+    """
+    A single change shown on the Activity pages.
+
+    Every registered ActivityForModel keeps its changes in its own
+    historical table.  Rather than query each of those and merge the
+    results, the activity pages and feeds read this one table, which gets
+    a row for every historical instance as it's saved.  The historical
+    instances themselves are then loaded by id (see utils.load_changes).
+    """
+    classname = models.CharField(max_length=32)
+    region = models.ForeignKey('regions.Region')
+    page_slug = models.CharField(max_length=255)
+    history_id = models.PositiveIntegerField()
+    history_type = models.SmallIntegerField()
+    date = models.DateTimeField(db_index=True)
+    user = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        ordering = ('-date', '-id')
+        unique_together = ('classname', 'history_id')
+        index_together = [
+            ('region', 'date', 'id'),
+            ('user', 'date', 'id'),
+            ('region', 'page_slug'),
+        ]
+
+
+def changes_class_for_model(model):
+    """
+    Returns:
+        The registered ActivityForModel subclass whose changes are the
+        historical instances of `model`, or None.
+    """
+    from activity import get_changes_classes
+
+    for change_class in get_changes_classes():
+        hist_model = change_class().queryset().model
+        if model is hist_model or issubclass(model, hist_model):
+            return change_class
+    return None
+
+
+def get_entry_page_slug(change_obj, obj):
+    value = obj
+    for attr in change_obj.get_page_lookup_info().split('__'):
+        value = getattr(value, attr, None)
+        if value is None:
+            return ''
+    return value
+
+
+def _record_activity(sender, instance, created, raw, **kwargs):
+    if raw or not created:
+        return
+    if not sender._meta.object_name.endswith('_hist'):
+        return
+    change_class = changes_class_for_model(sender)
+    if change_class is None:
+        return
+
+    entry = ActivityEntry.objects.create(
+        classname=change_class.classname,
+        region_id=instance.region_id,
+        page_slug=get_entry_page_slug(change_class(), instance),
+        history_id=instance.history_id,
+        history_type=instance.history_type,
+        date=instance.history_date,
+        user_id=instance.history_user_id,
+    )
+    bump_activity_feed_version(instance.region_id)
+    # Saved inside the request's transaction, so give it time to commit.
+    _deliver_activity.apply_async(args=(entry.id,), countdown=DELIVERY_DELAY)
+
+
+def _remove_activity(sender, instance, **kwargs):
+    if not sender._meta.object_name.endswith('_hist'):
+        return
+    change_class = changes_class_for_model(sender)
+    if change_class is None:
+        return
+
+    entries = ActivityEntry.objects.filter(
+        classname=change_class.classname, history_id=instance.history_id)
+    for region_id in set(entries.values_list('region', flat=True)):
+        bump_activity_feed_version(region_id)
+    entries.delete()
+
+
+def _activity_feed_version_key(region_id):
+    return 'activity_feed_version:%s' % region_id
+
+def get_activity_feed_version(region_id):
+    """
+    Returns:
+        A token that changes whenever a change is added to or removed
+        from the region's activity, e.g. by an edit, a rename or a
+        deletion.  It's a timestamp, as a string, no earlier than the
+        last such change.
+    """
+    key = _activity_feed_version_key(region_id)
+    version = cache.get(key)
+    if version is None:
+        version = '%f' % time.time()
+        cache.add(key, version)
+    return version
+
+def bump_activity_feed_version(region_id):
+    cache.set(_activity_feed_version_key(region_id), '%f' % time.time())
+
+
+class InboxEntry(models.Model):
+    """
+    A change, or an actstream Action, in a user's followed activity.
+
+    Rows are added as changes land on the pages, regions and users the
+    user follows, so their followed activity can be read straight from
+    here no matter how many things they follow.  Each inbox is trimmed
+    down to the newest settings.ACTIVITY_INBOX_SIZE rows.
+    """
+    user = models.ForeignKey(User, related_name='activity_inbox')
+    activity = models.ForeignKey(ActivityEntry, null=True)
+    action = models.ForeignKey(Action, null=True)
+    date = models.DateTimeField()
+
+    class Meta:
+        ordering = ('-date', '-id')
+        index_together = [
+            ('user', 'date', 'id'),
+        ]
+        unique_together = [
+            ('user', 'activity'),
+            ('user', 'action'),
+        ]
+
+    @property
+    def change(self):
+        return self.activity or self.action
+
+
+# Seconds to wait before trimming an inbox that's had entries delivered,
+# or rebuilding one after its user's follows changed.
+INBOX_TRIM_DELAY = 60 * 10
+INBOX_REBUILD_DELAY = 10
+
+# Changes are delivered this many seconds after they're saved.  If the
+# change still isn't there (its transaction hasn't committed yet), the
+# delivery is retried every DELIVERY_RETRY_DELAY seconds, up to
+# DELIVERY_MAX_RETRIES times.
+DELIVERY_DELAY = 2
+DELIVERY_RETRY_DELAY = 10
+DELIVERY_MAX_RETRIES = 6
+
+
+def followed_activity(user_id):
+    """
+    Returns:
+        A queryset of the ActivityEntry objects for the regions and pages
+        the given user follows.
+    """
+    follows = Follow.objects.filter(user=user_id)
+
+    regions_followed = follows.exclude(target_region=None).\
+        values_list('target_region', flat=True)
+    followed = Q(region__in=list(regions_followed))
+
+    pages_followed = follows.exclude(target_page=None).\
+        values_list('target_page__region', 'target_page__slug')
+    slugs_by_region = {}
+    for region_id, slug in pages_followed:
+        slugs_by_region.setdefault(region_id, []).append(slug)
+    for region_id, slugs in slugs_by_region.iteritems():
+        followed |= Q(region=region_id, page_slug__in=slugs)
+
+    return ActivityEntry.objects.filter(followed)
+
+
+def followed_actions(user_id):
+    """
+    Returns:
+        A queryset of the actstream Actions of the users the given user
+        follows.
+    """
+    users_followed = Follow.objects.filter(user=user_id).\
+        exclude(target_user=None).exclude(target_user=user_id).\
+        values_list('target_user', flat=True)
+    return Action.objects.filter(
+        actor_content_type=ContentType.objects.get_for_model(User),
+        actor_object_id__in=[str(pk) for pk in users_followed],
+    )
+
+
+def _deliver(task, inbox_entries):
+    """
+    Adds `inbox_entries`.  If an inbox rebuild added some of them in the
+    meantime, `task` is retried, and skips those.
+    """
+    try:
+        with transaction.commit_on_success():
+            InboxEntry.objects.bulk_create(inbox_entries)
+    except IntegrityError as e:
+        raise task.retry(exc=e, countdown=DELIVERY_RETRY_DELAY)
+    for user_id in set(e.user_id for e in inbox_entries):
+        debounce(_trim_inbox, INBOX_TRIM_DELAY, user_id)
+
+
+@shared_task(bind=True, ignore_result=True, max_retries=DELIVERY_MAX_RETRIES)
+def _deliver_activity(self, entry_id):
+    entry = ActivityEntry.objects.filter(id=entry_id)
+    if not entry.exists():
+        # Not committed yet, or since removed.
+        raise self.retry(countdown=DELIVERY_RETRY_DELAY)
+    entry = entry[0]
+
+    followers = set(Follow.objects.filter(
+        Q(target_region=entry.region_id) |
+        Q(target_page__region=entry.region_id, target_page__slug=entry.page_slug)
+    ).values_list('user', flat=True))
+    # In case an inbox rebuild got to it first.
+    followers -= set(InboxEntry.objects.filter(activity=entry).
+        values_list('user', flat=True))
+
+    _deliver(self, [
+        InboxEntry(user_id=user_id, activity=entry, date=entry.date)
+        for user_id in followers
+    ])
+
+
+@shared_task(bind=True, ignore_result=True, max_retries=DELIVERY_MAX_RETRIES)
+def _deliver_action(self, action_id):
+    action = Action.objects.filter(id=action_id)
+    if not action.exists():
+        raise self.retry(countdown=DELIVERY_RETRY_DELAY)
+    action = action[0]
+    if action.actor_content_type != ContentType.objects.get_for_model(User):
+        return
+
+    followers = set(Follow.objects.filter(target_user=action.actor_object_id).\
+        exclude(user=action.actor_object_id).values_list('user', flat=True))
+    followers -= set(InboxEntry.objects.filter(action=action).
+        values_list('user', flat=True))
+
+    _deliver(self, [
+        InboxEntry(user_id=user_id, action=action, date=action.timestamp)
+        for user_id in followers
+    ])
+
+
+@shared_task(ignore_result=True)
+def _trim_inbox(user_id):
+    debounce_started(_trim_inbox, user_id)
+
+    inbox = InboxEntry.objects.filter(user=user_id)
+    size = settings.ACTIVITY_INBOX_SIZE
+    oldest_kept = inbox.order_by('-date', '-id').values_list('date', 'id')[size - 1:size]
+    if not oldest_kept:
+        return
+    date, pk = oldest_kept[0]
+    inbox.filter(Q(date__lt=date) | Q(date=date, id__lt=pk)).delete()
+
+
+@shared_task(bind=True, ignore_result=True, max_retries=DELIVERY_MAX_RETRIES)
+def _rebuild_inbox(self, user_id):
+    """
+    Refills the user's inbox from scratch, e.g. after they've followed or
+    unfollowed something.
+    """
+    debounce_started(_rebuild_inbox, user_id)
+
+    size = settings.ACTIVITY_INBOX_SIZE
+    entries = [
+        InboxEntry(user_id=user_id, activity_id=pk, date=date)
+        for (pk, date) in followed_activity(user_id).
+            order_by('-date', '-id').values_list('id', 'date')[:size]
+    ]
+    entries.extend([
+        InboxEntry(user_id=user_id, action_id=pk, date=date)
+        for (pk, date) in followed_actions(user_id).
+            order_by('-timestamp', '-id').values_list('id', 'timestamp')[:size]
+    ])
+    entries.sort(key=lambda e: e.date, reverse=True)
+
+    try:
+        with transaction.commit_on_success():
+            InboxEntry.objects.filter(user=user_id).delete()
+            InboxEntry.objects.bulk_create(entries[:size])
+    except IntegrityError as e:
+        # A delivery added one of the entries in the meantime.
+        raise self.retry(exc=e, countdown=DELIVERY_RETRY_DELAY)
+
+
+def _action_post_save(sender, instance, created, raw, **kwargs):
+    if raw or not created:
+        return
+    _deliver_action.apply_async(args=(instance.id,), countdown=DELIVERY_DELAY)
+
+
+def _follow_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    debounce(_rebuild_inbox, INBOX_REBUILD_DELAY, instance.user_id)
+
+post_save.connect(_record_activity)
+post_delete.connect(_remove_activity)
+post_save.connect(_action_post_save, sender=Action)
+post_save.connect(_follow_changed, sender=Follow)
+post_delete.connect(_follow_changed, sender=Follow)
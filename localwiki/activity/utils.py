@@ -1,15 +1,42 @@
-import itertools
+from collections import defaultdict
 
+from . import get_changes_classes
 
-def merge_changes(objs_lists):
+
+def load_changes(objs):
     """
-    Given a list of arguments (*objs_lists), each of which is an iterable
-    of historical objects, we return an iterable of the provided
-    objs_lists combined and sorted by edit date (most recent edits appearing
-    earlier in the list).
+    Args:
+        objs: A list of ActivityEntry objects, possibly mixed in with
+            other objects (e.g. actstream Actions).
+
+    Returns:
+        `objs`, with each ActivityEntry replaced by the historical instance
+        it points to (with its `classname` set).  The historical instances are loaded with one query
+        per type of change.  Entries whose historical instance is gone are
+        dropped.
     """
-    # In theory we could use the fact each obj_list is already sorted.
-    # This is fast enough for now.  heapq.merge does this, but it
-    # doesn't take a key parameter.
-    return sorted(itertools.chain(*objs_lists),
-                  key=lambda x: x.version_info.date, reverse=True)
+    from .models import ActivityEntry
+
+    change_classes = dict((c.classname, c) for c in get_changes_classes())
+    ids_by_classname = defaultdict(list)
+    for obj in objs:
+        if isinstance(obj, ActivityEntry):
+            ids_by_classname[obj.classname].append(obj.history_id)
+
+    loaded = {}
+    for classname, ids in ids_by_classname.iteritems():
+        if classname not in change_classes:
+            continue
+        qs = change_classes[classname]().queryset().filter(history_id__in=ids)
+        for change in qs.select_related('region'):
+            change.classname = classname
+            loaded[(classname, change.history_id)] = change
+
+    changes = []
+    for obj in objs:
+        if isinstance(obj, ActivityEntry):
+            obj = loaded.get((obj.classname, obj.history_id))
+            if obj is None:
+                continue
+        changes.append(obj)
+    return changes
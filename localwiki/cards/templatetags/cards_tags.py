@@ -121,10 +121,8 @@ def render_region_card(context, region):
 
     
 def _clear_page_card(sender, instance, *args, **kwargs):
-    cache = get_cache('long-living')
-    if instance.region.regionsettings.domain:
-        # Have to clear both urlconfs
-        cache.delete('card:main.urls_no_region,%s' % instance.id)
-    cache.delete('card:main.urls,%s' % instance.id)
+    from pages.invalidation import invalidate, PageCardTarget
+
+    invalidate([PageCardTarget(instance)])
 
 post_save.connect(_clear_page_card, sender=Page)
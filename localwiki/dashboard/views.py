@@ -2,7 +2,7 @@ from datetime import date, datetime, timedelta
 
 from django.core.cache import cache
 from django.contrib.auth.models import User
-from django.db.models import Max
+from django.db.models import Max, Sum
 from django.utils.translation import ugettext as _
 from django.views.generic import TemplateView
 from django.contrib.humanize.templatetags.humanize import intcomma
@@ -13,10 +13,11 @@ import qsstats
 from pages.models import Page, PageFile
 from regions.models import Region
 from maps.models import MapData
-from redirects.models import Redirect
+from region_scores.models import RegionCounts, get_region_counts
 from utils.views import JSONView
 
 from versionutils.versioning.constants import *
+from versionutils.versioning import delta
 
 import time
 
@@ -58,12 +59,29 @@ class DashboardRenderView(JSONView):
         prefix = self.cache_prefix()
         nums = cache.get('%s:dashboard_nums' % prefix)
         if nums is None:
+            if self.is_global_dashboard:
+                counts = RegionCounts.objects.aggregate(
+                    num_pages=Sum('num_pages'),
+                    num_files=Sum('num_files'),
+                    num_maps=Sum('num_maps'),
+                    num_redirects=Sum('num_redirects'),
+                )
+                # Regions that haven't been counted yet.
+                for region in Region.objects.filter(counts__isnull=True):
+                    region_counts = get_region_counts(region)
+                    for field in counts:
+                        counts[field] = ((counts[field] or 0) +
+                                         getattr(region_counts, field))
+            else:
+                region_counts = get_region_counts(filters['region'])
+                counts = dict((field, getattr(region_counts, field)) for field in
+                    ('num_pages', 'num_files', 'num_maps', 'num_redirects'))
             nums = {
                 'is_global_dashboard': self.is_global_dashboard,
-                'num_pages': humanize(Page.objects.filter(**filters).count()),
-                'num_files': humanize(PageFile.objects.filter(**filters).count()),
-                'num_maps': humanize(MapData.objects.filter(**filters).count()),
-                'num_redirects': humanize(Redirect.objects.filter(**filters).count()),
+                'num_pages': humanize(counts['num_pages'] or 0),
+                'num_files': humanize(counts['num_files'] or 0),
+                'num_maps': humanize(counts['num_maps'] or 0),
+                'num_redirects': humanize(counts['num_redirects'] or 0),
                 'num_users': humanize(User.objects.count())
             }
             cache.set('%s:dashboard_nums' % prefix, nums,
@@ -230,11 +248,15 @@ def edits_over_time(oldest_page, filters):
 
 
 def page_content_over_time(oldest_page, filters):
+    # Content stored as a delta (see versionutils.versioning.delta) is
+    # measured from the delta, as its length in SQL is the delta's.
     qs = Page.versions.filter(**filters).extra(
-        {'content_length': "length(content)",
-         'history_day': "date(history_date)"})
+        select={'content_length': "length(content)",
+                'history_day': "date(history_date)",
+                'content_delta': "CASE WHEN content LIKE %s THEN content END"},
+        select_params=(delta.DELTA_MARKER + '%',))
     qs = qs.order_by('history_day')
-    qs = qs.values('content_length', 'history_day', 'slug')
+    qs = qs.values('content_length', 'content_delta', 'history_day', 'slug')
 
     graph = pyflot.Flot()
     page_dict = {}
@@ -245,7 +267,10 @@ def page_content_over_time(oldest_page, filters):
         if page['history_day'] > current_day:
             page_contents.append((current_day, sum(page_dict.values())))
             current_day = page['history_day']
-        page_dict[page['slug']] = page['content_length']
+        if page['content_delta'] is not None:
+            page_dict[page['slug']] = delta.delta_length(page['content_delta'])
+        else:
+            page_dict[page['slug']] = page['content_length']
 
     if page_contents:
         graph.add_time_series(page_contents)
@@ -38,13 +38,16 @@ def _clear_frontpage(region):
 
 def _frontpage_post_save(sender, instance, created, raw, **kwargs):
     from pages.models import Page
+    from pages.cache import varnish_ban_batch
     from .models import FrontPage
 
     if sender is FrontPage:
-        _clear_frontpage(instance.region)
+        with varnish_ban_batch():
+            _clear_frontpage(instance.region)
     elif sender is Page:
         if instance.slug == 'front page':
-            _clear_frontpage(instance.region)
+            with varnish_ban_batch():
+                _clear_frontpage(instance.region)
     return
 
 
@@ -3,42 +3,70 @@ from django.db.models.signals import post_save, pre_delete, post_delete
 from pages.models import Page, slugify
 from tags.models import Tag
 
-from links import extract_internal_links, extract_included_pagenames, extract_included_tags
 from .models import Link, IncludedPage, IncludedTagList
 
 
 def record_page_links(page):
+    """
+    Brings the stored Links for `page` in line with the links in its
+    content, inserting, updating and deleting Links in bulk.
+    """
     region = page.region
-    links = extract_internal_links(page.content)
-    for pagename, count in links.iteritems():
-        qs = Link.objects.filter(source=page, region=region)
-        link_exists = qs.filter(destination_slug=slugify(pagename)) | qs.filter(destination__slug=slugify(pagename))
-        if link_exists:
-            link = link_exists[0]
-            if link.count == count:
-                # No new links with this name on this page, so skip updating.
-                continue
-            link.count = count
+    links = page.get_content_analysis().internal_links
+    wanted = dict((slugify(pagename), (pagename, count))
+                  for pagename, count in links.iteritems())
+
+    # Existing links are matched by the slug they were recorded with or,
+    # failing that, by the current slug of the page they point to.
+    stored = list(Link.objects.filter(source=page, region=region).values_list(
+        'id', 'destination_slug', 'destination__slug', 'destination', 'count'))
+    by_slug = {}
+    for link in stored:
+        if link[2]:
+            by_slug.setdefault(link[2], link)
+    for link in stored:
+        by_slug[link[1]] = link
+
+    kept = set()
+    to_update = {}
+    to_create = []
+    for slug, (pagename, count) in wanted.iteritems():
+        link = by_slug.get(slug)
+        if link and link[0] not in kept:
+            kept.add(link[0])
+            if link[4] != count:
+                to_update.setdefault(count, []).append(link[0])
         else:
-            page_exists = Page.objects.filter(slug=slugify(pagename), region=region)
-            if page_exists:
-                destination = page_exists[0]
-            else:
-                destination = None
+            to_create.append(slug)
 
-            # Exists for some reason already (probably running a script that's moving between regions?)
-            if destination and Link.objects.filter(source=page, destination=destination).exists():
-                continue
+    stale = [link[0] for link in stored if link[0] not in kept]
+    if stale:
+        Link.objects.filter(id__in=stale).delete()
 
-            link = Link(
-                source=page,
-                region=region,
-                destination=destination,
-                destination_name=pagename,
-                destination_slug=slugify(pagename),
-                count=count,
-            )
-        link.save()
+    for count, ids in to_update.iteritems():
+        Link.objects.filter(id__in=ids).update(count=count)
+
+    if not to_create:
+        return
+    destinations = dict(Page.objects.filter(
+        slug__in=to_create, region=region).values_list('slug', 'id'))
+    linked_to = set(link[3] for link in stored if link[0] in kept)
+    new_links = []
+    for slug in to_create:
+        destination_id = destinations.get(slug)
+        # Exists for some reason already (probably running a script that's moving between regions?)
+        if destination_id and destination_id in linked_to:
+            continue
+        pagename, count = wanted[slug]
+        new_links.append(Link(
+            source=page,
+            region=region,
+            destination_id=destination_id,
+            destination_name=pagename,
+            destination_slug=slug,
+            count=count,
+        ))
+    Link.objects.bulk_create(new_links)
 
 def _record_page_links(sender, instance, created, raw, **kws):
     # Don't create Links when importing via loaddata - they're already
@@ -71,7 +99,7 @@ def _check_destination_created(sender, instance, created, raw, **kws):
 
 def record_page_includes(page):
     region = page.region
-    included = extract_included_pagenames(page.content)
+    included = page.get_content_analysis().included_pagenames
     for pagename in included:
         included_pg_exists = IncludedPage.objects.filter(
             source=page, region=region,
@@ -126,7 +154,7 @@ def _check_included_page_created(sender, instance, created, raw, **kws):
 
 def record_tag_includes(page):
     region = page.region
-    included = extract_included_tags(page.content)
+    included = page.get_content_analysis().included_tags
     
     for tag_slug in included:
         included_tag_exists = IncludedTagList.objects.filter(
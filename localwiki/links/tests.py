@@ -1,6 +1,11 @@
 from django.test import TestCase
 
+from pages.models import Page
+from regions.models import Region
+
 from links import extract_internal_links, extract_included_pagenames, extract_included_tags
+from links.models import Link
+from links.signals import record_page_links
 
 
 class ExtractLinkTest(TestCase):
@@ -120,3 +125,37 @@ class ExtractIncludedTagsTest(TestCase):
         included_tags = extract_included_tags(html)
         self.assertFalse('parks' in included_tags)
         self.assertTrue(included_tags == [])
+
+
+class RecordPageLinksTest(TestCase):
+    def setUp(self):
+        self.region = Region(full_name='Test region', slug='test-region')
+        self.region.save()
+
+    def _links(self, page):
+        return dict((l.destination_slug, (l.destination_id, l.count))
+                    for l in Link.objects.filter(source=page))
+
+    def test_record_links(self):
+        parks = Page(name='Parks', region=self.region, content='<p>Parks</p>')
+        parks.save()
+        p = Page(name='Front Page', region=self.region)
+        p.content = ('<p><a href="Parks">a</a><a href="Parks">b</a>'
+                     '<a href="Cats%20and%20dogs">c</a></p>')
+        p.save()
+        self.assertEqual(self._links(p), {
+            'parks': (parks.id, 2),
+            'cats and dogs': (None, 1),
+        })
+
+        # Changed count, removed link and new link.
+        p.content = ('<p><a href="Parks">a</a><a href="Trees">c</a></p>')
+        record_page_links(p)
+        self.assertEqual(self._links(p), {
+            'parks': (parks.id, 1),
+            'trees': (None, 1),
+        })
+
+        # Nothing changed
+        with self.assertNumQueries(1):
+            record_page_links(p)
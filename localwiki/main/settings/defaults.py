@@ -1,6 +1,7 @@
 # Django settings for localwiki project.
 import sys
 import os
+from datetime import timedelta
 
 _ = lambda s: s
 
@@ -216,6 +217,8 @@ MIDDLEWARE_CLASSES = (
     'django_xsession.middleware.XSessionMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'utils.middleware.SubdomainLanguageMiddleware',
+    # Before anything that hits the database.
+    'pages.middleware.AnonymousPageCacheMiddleware',
     'regions.middleware.RedirectToLanguageSubdomainMiddleware',
     'utils.middleware.RequestURIMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -447,6 +450,26 @@ DAISYDIFF_MERGE_URL = 'http://localhost:8080/daisydiff/merge'
 
 IN_API_TEST = False
 
+# Seconds to wait before recalculating a page or region score after it's
+# changed.  Changes made in the meantime are picked up by the same run.
+SCORE_RECALCULATION_DELAY = 60
+
+# Run by the embedded celerybeat (celery worker -B).
+CELERYBEAT_SCHEDULE = {
+    'reconcile-region-counts': {
+        'task': 'region_scores.models.reconcile_all_region_counts',
+        'schedule': timedelta(days=1),
+    },
+}
+
+# Number of changes kept in each user's followed-activity inbox.
+ACTIVITY_INBOX_SIZE = 1000
+
+# Historical fields stored as deltas against a periodic full copy.  See
+# versionutils.versioning.delta.
+VERSIONUTILS_DELTA_FIELDS = {'pages.Page': ['content']}
+VERSIONUTILS_DELTA_SNAPSHOT_INTERVAL = 20
+
 # list of regular expressions for white listing embedded URLs
 EMBED_ALLOWED_SRC = ['.*']
 
@@ -0,0 +1,36 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from regions.models import Region
+from page_scores.models import calculate_region_page_scores, _calculate_region_page_scores
+
+
+class Command(BaseCommand):
+    args = '[region_slug ...]'
+    help = ('Recomputes the page scores of the given regions, or of all '
+            'regions if none are given')
+    option_list = BaseCommand.option_list + (
+        make_option('--async',
+            action='store_true',
+            dest='async',
+            default=False,
+            help='Queue a task per region instead of scoring right away'),
+    )
+
+    def handle(self, *args, **options):
+        regions = Region.objects.all()
+        if args:
+            regions = regions.filter(slug__in=args)
+            missing = set(args) - set(regions.values_list('slug', flat=True))
+            if missing:
+                raise CommandError('Unknown region(s): %s' % ', '.join(sorted(missing)))
+
+        for region in regions.order_by('slug'):
+            if options['async']:
+                _calculate_region_page_scores.delay(region.id)
+                self.stdout.write('Queued page scores for "%s"\n' % region.slug)
+            else:
+                num_changed = calculate_region_page_scores(region)
+                self.stdout.write('Updated %d page scores for "%s"\n'
+                                  % (num_changed, region.slug))
@@ -1,19 +1,21 @@
 from celery import shared_task
-from lxml.html import fragments_fromstring
-import urllib
-import urlparse
 
 from django.utils.translation import ugettext as _
 from django.utils.encoding import smart_str
-from django.db import models
-from django.db.models import Avg
+from django.db import models, transaction
+from django.db.models import Avg, Count
 from django.core.cache import cache
+from django.conf import settings
 from django.db.models.signals import post_save
 
 from pages.models import Page, slugify
+from pages.cache import existing_page_slugs
 from links.models import Link
+from regions.models import Region
+from localwiki.utils.tasks import debounce, debounce_started
 
 SKIP_USER_PAGES_FOR_PAGESCORE = True
+BULK_BATCH_SIZE = 500
 
 
 class PageScore(models.Model):
@@ -29,13 +31,6 @@ class PageScore(models.Model):
         return (_("Page score %s: %s") % (self.page, self.score))
 
 
-def is_internal(url):
-    return (not urlparse.urlparse(url).netloc)
-
-def is_plugin(elem):
-    classes = elem.attrib.get('class', '')
-    return ('plugin' in classes.split())
-
 def avg_incoming_links_for_region(region):    
     avg = cache.get('avg_incoming_links:%s' % region.slug)
     if avg is not None:
@@ -73,39 +68,43 @@ def avg_page_length(region):
     cache.set('avg_page_length:%s' % region.slug, avg, 60 * 15)
     return avg
 
-def _compute_score(page):
-    from maps.models import MapData
+def _score(slug, content_length, analysis, has_map, existing_slugs,
+        num_links_to_here, avg_page_length, avg_links_to):
+    """
+    Scores a page from facts gathered about it and its region ahead of
+    time, so that many pages can be scored without querying per page.
+
+    Args:
+        slug: The page's slug.
+        content_length: The length of the page's content.
+        analysis: The ContentAnalysis of the page's content.
+        has_map: True if the page has a map.
+        existing_slugs: A set containing the slugs of the pages that exist
+            in the region (or at least of those the page links to).
+        num_links_to_here: The number of pages linking to the page.
+        avg_page_length: The region's average page length.
+        avg_links_to: The region's average number of incoming links.
+    """
     from pages.plugins import _files_url
 
     score = 0
-    num_images = 0
-    link_num = 0
 
     # XXX TODO remove this once all
     # /User/ pages are moved to a single global namespace
     if SKIP_USER_PAGES_FOR_PAGESCORE:
-        if page.slug.startswith('users/'):
+        if slug.startswith('users/'):
             return 0
 
     # 1 point for having a map
-    if MapData.objects.filter(page=page).exists():
+    if has_map:
         score += 1
 
-    # Parse the page HTML and look for good stuff
-    for e in fragments_fromstring(page.content):
-        if isinstance(e, basestring):
-            continue
-        for i in e.iter('img'):
-            src = i.attrib.get('src', '')
-            if src.startswith(_files_url):
-                num_images += 1
-        for i in e.iter('a'):
-            src = i.attrib.get('href', '')
-            if is_internal(src) and not is_plugin(i):
-                slug = slugify(unicode(urllib.unquote(src), 'utf-8', errors='ignore'))
-                # Only count links to pages that exist
-                if Page.objects.filter(slug=slug, region=page.region).exists():
-                    link_num += 1
+    # Look for good stuff in the page HTML
+    num_images = len([src for src in analysis.images if src.startswith(_files_url)])
+
+    # Only count links to pages that exist
+    link_num = sum([count for name, count in analysis.internal_links.iteritems()
+                    if slugify(name) in existing_slugs])
 
     # One point for each image, up to three points
     score += min(num_images, 3)
@@ -118,14 +117,10 @@ def _compute_score(page):
         score += 1
 
     # 1 point for a page length >= average page length
-    avg_page_length = Page.objects.filter(region=page.region).aggregate(
-        avg=Avg('score__page_content_length'))
-    if len(page.content) >= avg_page_length:
-        score += min(int((len(page.content) * 1.0) / avg_page_length), 3)
+    if avg_page_length and content_length >= avg_page_length:
+        score += min(int((content_length * 1.0) / avg_page_length), 3)
 
     # Use # of incoming links in the page score
-    avg_links_to = avg_incoming_links_for_region(page.region)
-    num_links_to_here = page.links_to_here.count()
     if num_links_to_here >= avg_links_to:
         if avg_links_to > 0:
             score += min(int((num_links_to_here * 1.0) / avg_links_to), 5)
@@ -135,8 +130,34 @@ def _compute_score(page):
 
     return score
 
+def _compute_score(page):
+    from maps.models import MapData
+
+    # XXX TODO remove this once all
+    # /User/ pages are moved to a single global namespace
+    if SKIP_USER_PAGES_FOR_PAGESCORE:
+        if page.slug.startswith('users/'):
+            return 0
+
+    analysis = page.get_content_analysis()
+    existing_slugs = existing_page_slugs(
+        [slugify(name) for name in analysis.internal_links], page.region)
+
+    return _score(
+        page.slug,
+        len(page.content),
+        analysis,
+        MapData.objects.filter(page=page).exists(),
+        existing_slugs,
+        page.links_to_here.count(),
+        avg_page_length(page.region),
+        avg_incoming_links_for_region(page.region),
+    )
+
 @shared_task(ignore_result=True)
 def _calculate_page_score(page_id):
+    debounce_started(_calculate_page_score, page_id)
+
     page = Page.objects.filter(id=page_id)
     if page.exists():
         page = page[0]
@@ -154,6 +175,67 @@ def _calculate_page_score(page_id):
     score_obj.page_content_length = len(page.content)
     score_obj.save()
 
+def calculate_region_page_scores(region):
+    """
+    Recomputes the scores of all the pages in `region`.
+
+    Rather than querying per page, everything the scores depend on (maps,
+    incoming links, existing slugs, region averages) is fetched for the
+    whole region up front, and only the scores that changed are written,
+    in bulk.
+
+    Returns:
+        The number of page scores that changed.
+    """
+    from maps.models import MapData
+
+    pages = Page.objects.filter(region=region)
+    existing_slugs = set(pages.values_list('slug', flat=True))
+    with_maps = set(MapData.objects.filter(region=region).values_list('page', flat=True))
+    links_to = dict(Link.objects.filter(region=region, destination__isnull=False).
+        values_list('destination').annotate(Count('id')))
+    avg_length = avg_page_length(region)
+    avg_links_to = avg_incoming_links_for_region(region)
+
+    stored = dict((page_id, (score_id, score, length)) for page_id, score_id, score, length in
+        PageScore.objects.filter(page__region=region).values_list(
+            'page', 'id', 'score', 'page_content_length'))
+
+    changed = []
+    for page in pages.only('id', 'slug', 'content').iterator():
+        content_length = len(page.content)
+        score = _score(
+            page.slug,
+            content_length,
+            page.get_content_analysis(),
+            page.id in with_maps,
+            existing_slugs,
+            links_to.get(page.id, 0),
+            avg_length,
+            avg_links_to,
+        )
+        if stored.get(page.id, (None, None, None))[1:] == (score, content_length):
+            continue
+        changed.append(PageScore(page_id=page.id, score=score,
+                                 page_content_length=content_length))
+
+    outdated = [stored[s.page_id][0] for s in changed if s.page_id in stored]
+    with transaction.commit_on_success():
+        for i in range(0, len(outdated), BULK_BATCH_SIZE):
+            PageScore.objects.filter(id__in=outdated[i:i + BULK_BATCH_SIZE]).delete()
+        PageScore.objects.bulk_create(changed, batch_size=BULK_BATCH_SIZE)
+    return len(changed)
+
+@shared_task(ignore_result=True)
+def _calculate_region_page_scores(region_id):
+    region = Region.objects.filter(id=region_id)
+    if region.exists():
+        region = region[0]
+    else:
+        return
+
+    calculate_region_page_scores(region)
+
 def _handle_page_score(sender, instance, created, raw, **kws):
     from maps.models import MapData
 
@@ -163,9 +245,9 @@ def _handle_page_score(sender, instance, created, raw, **kws):
         if getattr(instance, '_in_rename', False):
             return
 
-        _calculate_page_score.delay(instance.id)
+        debounce(_calculate_page_score, settings.SCORE_RECALCULATION_DELAY, instance.id)
     elif sender == MapData:
-        _calculate_page_score.delay(instance.page.id)
+        debounce(_calculate_page_score, settings.SCORE_RECALCULATION_DELAY, instance.page.id)
 
 
 post_save.connect(_handle_page_score)
@@ -0,0 +1,124 @@
+import hashlib
+import urlparse
+
+import html5lib
+
+from django.core.cache import cache
+from django.utils.encoding import smart_str
+
+from .models import slugify, url_to_name
+
+# Bump this when ContentAnalysis changes, so stale cached analyses
+# aren't used.
+CONTENT_ANALYSIS_VERSION = 1
+CONTENT_ANALYSIS_CACHE_TIMEOUT = 60 * 60
+
+TAGS_PATH_LEN = len('tags/')
+
+
+def _is_absolute(href):
+    return bool(urlparse.urlparse(href).scheme)
+
+def _is_anchor_link(href):
+    return href.startswith('#')
+
+def _is_plugin(a):
+    if 'class' in a.attrib:
+        return 'plugin' in a.attrib['class']
+    return False
+
+def _invalid(href):
+    return len(href) > 255
+
+def _is_included_page(a):
+    classes = a.attrib.get('class', '').split()
+    return ('includepage' in classes and 'plugin' in classes)
+
+def _is_included_tag(a):
+    classes = a.attrib.get('class', '').split()
+    return ('includetag' in classes and 'plugin' in classes)
+
+
+class ContentAnalysis(object):
+    """
+    What we need to know about a piece of page content, gathered by
+    parsing it once.
+
+    Only plain data is kept, so an analysis can be pickled (to be cached
+    or handed to a celery task).
+
+    Attributes:
+        internal_links: A dictionary of the linked-to page names and the
+            number of times that link has been made, e.g.
+            {'Downtown Park': 3, 'Rollercoaster': 1}
+        included_pagenames: A list of the included page names.
+        included_tags: A list of the included tag slugs (lowercased).
+        images: A list of the image sources.
+    """
+    def __init__(self, html):
+        from tags.models import slugify as tag_slugify
+
+        parser = html5lib.HTMLParser(
+            tree=html5lib.treebuilders.getTreeBuilder("lxml"),
+            namespaceHTMLElements=False)
+        # Wrap to make the tree lookup easier
+        tree = parser.parseFragment('<div>%s</div>' % html)[0]
+
+        links = {}
+        self.included_pagenames = []
+        self.included_tags = []
+        for a in tree.iter('a'):
+            if 'href' not in a.attrib:
+                continue
+            href = a.attrib['href']
+            if _is_included_page(a):
+                self.included_pagenames.append(url_to_name(href))
+            elif _is_included_tag(a):
+                try:
+                    item = tag_slugify(url_to_name(href)[TAGS_PATH_LEN:].lower())
+                except UnicodeDecodeError:
+                    continue
+                self.included_tags.append(item)
+            elif (not _is_absolute(href) and not _is_anchor_link(href) and
+                  not _is_plugin(a) and not _invalid(href)):
+                # Grab the links if they're not anchors or external.
+                try:
+                    slug = slugify(href)
+                    if not slug in links:
+                        links[slug] = (url_to_name(href), 1)
+                    else:
+                        name, count = links[slug]
+                        links[slug] = (name, count + 1)
+                except UnicodeDecodeError:
+                    pass
+        self.internal_links = dict(links.itervalues())
+
+        self.images = [img.attrib.get('src', '') for img in tree.iter('img')]
+
+
+def get_content_analysis(html, instance=None):
+    """
+    Args:
+        html: A string containing an HTML5 fragment.
+        instance: Optional object (e.g. the Page the HTML belongs to) to
+            memoize the analysis on.
+
+    Returns:
+        A ContentAnalysis of `html`.  Analyses are memoized on `instance`
+        and cached by content, so the handlers and tasks that run after a
+        page is saved share a single parse.
+    """
+    digest = hashlib.md5(smart_str(html)).hexdigest()
+    memo = getattr(instance, '_content_analysis', None)
+    if memo and memo[0] == digest:
+        return memo[1]
+
+    key = 'content_analysis:%s:%s' % (CONTENT_ANALYSIS_VERSION, digest)
+    analysis = cache.get(key)
+    if analysis is None:
+        analysis = ContentAnalysis(html)
+        cache.set(key, analysis, CONTENT_ANALYSIS_CACHE_TIMEOUT)
+
+    if instance is not None:
+        instance._content_analysis = (digest, analysis)
+    return analysis
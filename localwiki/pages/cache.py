@@ -1,33 +1,146 @@
+import time
 import urllib
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 
 from django.conf import settings
 from django.core.urlresolvers import set_urlconf, get_urlconf
 from django.core.cache import cache
+from django.utils.encoding import smart_str
 
 from celery import shared_task
-from varnish import VarnishManager
+from varnish import VarnishHandler
 
-from regions.models import Region
 
 rfc_3986_reserved = """!*'();:@&=+$,/?#[]"""
 rfc_3986_unreserved = """ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_.~"""
 VARNISH_SAFE = rfc_3986_reserved + rfc_3986_unreserved
 
 
+VARNISH_BAN_PATH = r'obj.http.x-url ~ ^(?i)(%(url)s(/*)(\\?.*)?)$ && obj.http.x-host ~ ^((?i)(.*\\.)?%(host)s(:[0-9]*)?)$'
+
+# URLs banned on the same host are combined into a single ban, up to
+# this many characters of URL pattern per ban.
+VARNISH_BAN_MAX_URLS_LENGTH = 4096
+
+_varnish_bans = threading.local()
+
+# Management connections are kept open and reused across bans.
+_varnish_connections = {}
+_varnish_connections_lock = threading.Lock()
+
+
+def _varnish_connection(server):
+    handler = _varnish_connections.get(server)
+    if handler is None:
+        handler = VarnishHandler(server, secret=settings.VARNISH_SECRET)
+        _varnish_connections[server] = handler
+    return handler
+
+def _drop_varnish_connection(server):
+    handler = _varnish_connections.pop(server, None)
+    if handler is None:
+        return
+    try:
+        handler.close()
+    except EnvironmentError:
+        pass
+
+def _varnish_ban(ban_cmd):
+    with _varnish_connections_lock:
+        for server in settings.VARNISH_MANAGEMENT_SERVERS:
+            for attempt in (1, 2):
+                try:
+                    _varnish_connection(server).ban(ban_cmd)
+                    break
+                except (EnvironmentError, EOFError, AssertionError):
+                    # The connection may have gone stale, so reconnect
+                    # and try once more.
+                    _drop_varnish_connection(server)
+                    if attempt == 2:
+                        raise
+
+def _varnish_ban_expression(hostname, urls):
+    if len(urls) == 1:
+        url = urls[0]
+    else:
+        url = '(%s)' % '|'.join(urls)
+    return (VARNISH_BAN_PATH % {'url': url, 'host': hostname}).encode('utf-8')
+
+def _varnish_ban_groups(bans):
+    """
+    Args:
+        bans: An iterable of (hostname, url) tuples.
+
+    Returns:
+        A list of (hostname, urls) tuples, with duplicate bans removed and
+        the URLs for each host grouped so they can be banned together.
+    """
+    by_host = OrderedDict()
+    for hostname, url in bans:
+        urls = by_host.setdefault(hostname, [])
+        if url not in urls:
+            urls.append(url)
+
+    groups = []
+    for hostname, urls in by_host.iteritems():
+        group, length = [], 0
+        for url in urls:
+            if group and length + len(url) > VARNISH_BAN_MAX_URLS_LENGTH:
+                groups.append((hostname, group))
+                group, length = [], 0
+            group.append(url)
+            length += len(url) + 1
+        groups.append((hostname, group))
+    return groups
+
+def _flush_varnish_bans(bans):
+    for hostname, urls in _varnish_ban_groups(bans):
+        try:
+            _varnish_ban(_varnish_ban_expression(hostname, urls))
+        except AssertionError:
+            if len(urls) == 1:
+                raise
+            # Varnish rejected the combined ban (e.g. a URL with
+            # unbalanced parentheses), so ban the URLs one at a time.
+            for url in urls:
+                _varnish_ban(_varnish_ban_expression(hostname, [url]))
+
+@contextmanager
+def varnish_ban_batch():
+    """
+    Queues up the Varnish bans issued inside the block and sends them
+    when the (outermost) block is exited.  Duplicate bans are dropped and
+    URLs on the same host are banned together.
+    """
+    depth = getattr(_varnish_bans, 'depth', 0)
+    if not depth:
+        _varnish_bans.queue = []
+    _varnish_bans.depth = depth + 1
+    try:
+        yield
+    finally:
+        _varnish_bans.depth = depth
+        if not depth:
+            queue, _varnish_bans.queue = _varnish_bans.queue, []
+            _flush_varnish_bans(queue)
+
 def varnish_invalidate_url(url, hostname=None):
     if not hostname:
         hostname = settings.MAIN_HOSTNAME
 
-    ban_path = r'obj.http.x-url ~ ^(?i)(%(url)s(/*)(\\?.*)?)$ && obj.http.x-host ~ ^((?i)(.*\\.)?%(host)s(:[0-9]*)?)$'
-
     # Varnish needs it quoted, but has a wonky way of encoding URLs :/
     url = urllib.unquote(url)
     url = urllib.quote(url, safe=VARNISH_SAFE)
     if type(url) != unicode:
         url = url.decode('utf-8')
-    ban_cmd = (ban_path % {'url': url, 'host': hostname}).encode('utf-8')
-    manager = VarnishManager(settings.VARNISH_MANAGEMENT_SERVERS)
-    manager.run('ban', ban_cmd, secret=settings.VARNISH_SECRET)
+
+    if getattr(_varnish_bans, 'depth', 0):
+        _varnish_bans.queue.append((hostname, url))
+    else:
+        _flush_varnish_bans([(hostname, url)])
 
 def varnish_invalidate_page(p):
     current_urlconf = get_urlconf() or settings.ROOT_URLCONF
@@ -66,89 +179,218 @@ def django_invalidate_page(p):
 
     set_urlconf(current_urlconf)
 
-def invalidate_region_tag_views(slug, region):
-    from tags.cache import django_invalidate_tag_view, varnish_invalidate_tag_view
-
-    # Clear on the region itself
-    varnish_invalidate_tag_view(slug, region)
-    django_invalidate_tag_view(slug, region)
-
-    # Clear on nearby regions
-    center = region.regionsettings.region_center
-    if not center:
-        return
-    nearby_regions = Region.objects.filter(regionsettings__region_center__dwithin=(center, 0.5))
-    for region in nearby_regions:
-        varnish_invalidate_tag_view(slug, region)
-        django_invalidate_tag_view(slug, region)
+def _page_files_version_key(slug, region_id):
+    # Slugs can contain whitespace and non-ASCII characters, neither of
+    # which are allowed in memcached keys.
+    return 'page_files_version:%s:%s' % (
+        region_id, hashlib.md5(slug.encode('utf-8')).hexdigest())
+
+def get_page_files_version(slug, region_id):
+    """
+    Returns:
+        A token that changes whenever a file attached to the page with
+        `slug` in the region with id `region_id` is added, changed or
+        removed.
+    """
+    key = _page_files_version_key(slug, region_id)
+    version = cache.get(key)
+    if version is None:
+        version = '%f' % time.time()
+        cache.add(key, version)
+    return version
+
+def _page_files_post_edit(sender, instance, **kwargs):
+    key = _page_files_version_key(instance.slug, instance.region_id)
+    cache.set(key, '%f' % time.time())
+
+def _page_render_version_key(slug, region_id):
+    return 'page_render_version:%s:%s' % (
+        region_id, hashlib.md5(slug.encode('utf-8')).hexdigest())
+
+def get_page_render_version(slug, region_id):
+    """
+    Returns:
+        A token that changes whenever the rendered page with `slug` in the
+        region with id `region_id` is invalidated (see
+        pages.invalidation.PageTarget), e.g. because it was edited or a
+        page it links to or includes changed.
+    """
+    key = _page_render_version_key(slug, region_id)
+    version = cache.get(key)
+    if version is None:
+        version = '%f' % time.time()
+        cache.add(key, version)
+    return version
+
+def bump_page_render_version(slug, region_id):
+    key = _page_render_version_key(slug, region_id)
+    cache.set(key, '%f' % time.time())
+
+PAGE_FILES_TIMEOUT = 60 * 60 * 24
+
+def get_page_files(page):
+    """
+    Returns:
+        A dictionary mapping the names of the files attached to `page` to
+        their PageFiles.  The files are looked up with a single query and
+        cached until one of them is added, changed or removed, and are
+        memoized on `page` so that rendering it only fetches them once.
+    """
+    from pages.models import PageFile
+
+    if not page.slug or not page.region_id:
+        return {}
+
+    version = get_page_files_version(page.slug, page.region_id)
+    memo = getattr(page, '_page_files', None)
+    if memo and memo[0] == version:
+        return memo[1]
+
+    key = 'page_files:%s:%s:%s' % (page.region_id,
+        hashlib.md5(page.slug.encode('utf-8')).hexdigest(), version)
+    rows = cache.get(key)
+    if rows is None:
+        rows = list(PageFile.objects.filter(
+            slug=page.slug, region=page.region_id
+        ).values_list('id', 'name', 'file'))
+        cache.set(key, rows, PAGE_FILES_TIMEOUT)
+
+    files = {}
+    for (id, name, file_name) in rows:
+        files[name] = PageFile(id=id, name=name, file=file_name,
+            slug=page.slug, region_id=page.region_id)
+    page._page_files = (version, files)
+    return files
+
+# The slugs of the pages in a region are spread over a fixed number of
+# cache keys so that no single value grows past the backend's size limit.
+PAGE_SLUG_INDEX_BUCKETS = 16
+PAGE_SLUG_INDEX_TIMEOUT = 60 * 60 * 24
+
+def _page_slug_bucket(slug):
+    return int(hashlib.md5(smart_str(slug)).hexdigest()[:4], 16) % PAGE_SLUG_INDEX_BUCKETS
+
+def _page_slug_index_key(region_id, bucket):
+    return 'page_slugs:%s:%s' % (region_id, bucket)
+
+def _build_page_slug_index(region_id):
+    from pages.models import Page
 
-def invalidate_global_tag_view(slug):
-    from tags.cache import django_invalidate_global_tag_view, varnish_invalidate_global_tag_view
+    buckets = dict((n, set()) for n in range(PAGE_SLUG_INDEX_BUCKETS))
+    slugs = Page.objects.filter(region=region_id).values_list('slug', flat=True)
+    for slug in slugs.iterator():
+        buckets[_page_slug_bucket(slug)].add(slug)
+    cache.set_many(
+        dict((_page_slug_index_key(region_id, n), bucket_slugs)
+             for n, bucket_slugs in buckets.iteritems()),
+        PAGE_SLUG_INDEX_TIMEOUT
+    )
+    return buckets
+
+def existing_page_slugs(slugs, region):
+    """
+    Args:
+        slugs: An iterable of page slugs.
+        region: A Region or a region id.
+
+    Returns:
+        The set of `slugs` that belong to pages that exist in `region`.
+        The slugs are looked up in a per-region index kept in the cache,
+        which is rebuilt with a single query when it's missing.
+    """
+    region_id = getattr(region, 'id', region)
+    slugs = set(slugs)
+    if not slugs:
+        return set()
+
+    keys = dict((_page_slug_index_key(region_id, n), n)
+                for n in set(_page_slug_bucket(slug) for slug in slugs))
+    found = cache.get_many(keys.keys())
+    if len(found) < len(keys):
+        buckets = _build_page_slug_index(region_id)
+    else:
+        buckets = dict((keys[key], bucket_slugs)
+                       for key, bucket_slugs in found.iteritems())
+    return set(slug for slug in slugs
+               if slug in buckets[_page_slug_bucket(slug)])
+
+def page_slug_exists(slug, region):
+    """
+    Returns:
+        True if a page with `slug` exists in `region`.
+    """
+    return bool(existing_page_slugs([slug], region))
+
+# Index keys dropped while handling the current request.
+_page_slug_index_pending = threading.local()
+
+def _invalidate_page_slug_index(slug, region_id):
+    # The bucket is dropped rather than updated in place, as a
+    # get-and-set could race with another change to the same bucket.  It's
+    # rebuilt from the database the next time it's needed.
+    key = _page_slug_index_key(region_id, _page_slug_bucket(slug))
+    cache.delete(key)
+    if not hasattr(_page_slug_index_pending, 'keys'):
+        _page_slug_index_pending.keys = set()
+    _page_slug_index_pending.keys.add(key)
+
+def add_to_page_slug_index(slug, region):
+    _invalidate_page_slug_index(slug, getattr(region, 'id', region))
+
+def remove_from_page_slug_index(slug, region):
+    _invalidate_page_slug_index(slug, getattr(region, 'id', region))
+
+def page_slug_index_request_finished(sender, **kwargs):
+    """
+    Drops the index buckets changed during the request again, now that
+    TransactionMiddleware has committed, as another request may have
+    rebuilt them from the database before the change was visible.
+    """
+    keys = getattr(_page_slug_index_pending, 'keys', None)
+    if keys:
+        _page_slug_index_pending.keys = set()
+        cache.delete_many(list(keys))
+
+def _page_slug_index_post_save(sender, instance, **kwargs):
+    add_to_page_slug_index(instance.slug, instance.region_id)
+
+def _page_slug_index_post_delete(sender, instance, **kwargs):
+    remove_from_page_slug_index(instance.slug, instance.region_id)
+
+def _changed_tag_slugs(pagetagset):
+    from versionutils.diff import diff
 
-    varnish_invalidate_global_tag_view(slug)
-    django_invalidate_global_tag_view(slug)
+    if pagetagset.versions.all().count() == 1:
+        return [t.slug for t in pagetagset.tags.all()]
+    # Most recent two versions
+    v2, v1 = pagetagset.versions.all()[:2]
+    items = diff(v1, v2).get_diff()['tags'].get_diff()
+    return [t.slug for t in set.union(items['added'], items['deleted'])]
 
 @shared_task(ignore_result=True)
 def _async_cache_post_edit(instance, created=False, deleted=False, raw=False):
     from pages.models import Page
     from maps.models import MapData
     from tags.models import PageTagSet
-    from links.models import Link, IncludedPage, IncludedTagList
-    from tags.cache import django_invalidate_tag_view, varnish_invalidate_tag_view
-    from versionutils.diff import diff
+    from .invalidation import invalidate, PageTarget, TagTarget
 
     if isinstance(instance, Page):
-        # First, let's clear out the Varnish cache for this page
-        varnish_invalidate_page(instance)
-
-        # Then we clear the cache for pages that depend on this page
-        if created or deleted:
-            # Clear the cache for pages that link to this page, as the
-            # link dashed-underline-status has changed.
-
-            # First, make sure and get all the page links, whether or not the
-            # destination page exists:
-            links_to_here = set([l.source for l in instance.links_to_here.all()])
-            other_links = Link.objects.filter(destination_name__iexact=instance.slug)
-            other_links = [Page(name=l.source.name, slug=l.source.slug, region=instance.region) for l in other_links]
-            links_to_here = set.union(links_to_here, other_links)
-
-            for p in links_to_here:
-                varnish_invalidate_page(p)
-                django_invalidate_page(p)
-
-        # Clear out the cache for pages that include this page
-        for p in instance.pages_that_include_this.all():
-            varnish_invalidate_page(p.source)
-            django_invalidate_page(p.source)
+        # Pages that link to this page need clearing if it was created or
+        # deleted, as the link dashed-underline-status has changed.
+        invalidate([PageTarget(instance,
+            existence_changed=(created or deleted), content_changed=True)])
 
     elif isinstance(instance, MapData):
-        varnish_invalidate_page(instance.page)
+        invalidate([PageTarget(instance.page)])
 
     # Only ever deal with PageTagSet if deleted (otherwise we deal with m2m_changed)
     elif isinstance(instance, PageTagSet) and deleted:
-        varnish_invalidate_page(instance.page)
-        django_invalidate_page(instance.page)
-
-        if instance.versions.all().count() == 1:
-            changed = [t.slug for t in instance.tags.all()]
-        else:
-            # Most recent two versions
-            v2, v1 = instance.versions.all()[:2]
-            items = diff(v1, v2).get_diff()['tags'].get_diff()
-            changed = [t.slug for t in set.union(items['added'], items['deleted'])]
-
-        # Clear tag list views
-        for slug in changed:
-            invalidate_region_tag_views(slug, instance.region)
-            invalidate_global_tag_view(slug)
-
-        # Clear out the pages that include a 'list of tagged pages' of the deleted
-        # tags:
-        slugs_before_delete = [t.slug for t in instance.versions.all()[1].tags.all()]
-        for tl in IncludedTagList.objects.filter(included_tag__slug__in=slugs_before_delete):
-            varnish_invalidate_page(tl.source)
-            django_invalidate_page(tl.source)
+        changed = set(_changed_tag_slugs(instance))
+        # Also clear the pages that include a 'list of tagged pages' of the
+        # deleted tags:
+        changed.update([t.slug for t in instance.versions.all()[1].tags.all()])
+        invalidate([PageTarget(instance.page)] +
+                   [TagTarget(slug, instance.region) for slug in changed])
 
 def _page_cache_post_edit(sender, instance, created=False, deleted=False, raw=False, **kwargs):
     # We want to syncronously clear the page cache when it's been edited directly, or an
@@ -172,35 +414,17 @@ def _page_cache_post_edit(sender, instance, created=False, deleted=False, raw=Fa
 
 @shared_task(ignore_result=True)
 def _async_pagetagset_m2m_changed(instance):
-    from links.models import IncludedTagList
-    from versionutils.diff import diff
-
-    varnish_invalidate_page(instance.page)
-    django_invalidate_page(instance.page)
+    from .invalidation import invalidate, PageTarget, TagTarget
 
     # This seems roundabout because it is. We clear() out the tag set each time
     # the PageTagSet is changed[1], so we have to check what's changed in this
     # roundabout manner.
     #
     # 1. Not sure why, but may be worth looking into.
+    changed = _changed_tag_slugs(instance)
 
-    if instance.versions.all().count() == 1:
-        changed = [t.slug for t in instance.tags.all()]
-    else:
-        # Most recent two versions
-        v2, v1 = instance.versions.all()[:2]
-        items = diff(v1, v2).get_diff()['tags'].get_diff()
-        changed = [t.slug for t in set.union(items['added'], items['deleted'])]
-
-    # Clear tag list views
-    for slug in changed:
-        invalidate_region_tag_views(slug, instance.region)
-        invalidate_global_tag_view(slug)
-
-    # Clear caches of pages that include these tags as "list of tagged pages"
-    for tl in IncludedTagList.objects.filter(included_tag__slug__in=changed):
-        varnish_invalidate_page(tl.source)
-        django_invalidate_page(tl.source)
+    invalidate([PageTarget(instance.page)] +
+               [TagTarget(slug, instance.region) for slug in changed])
 
 def _page_cache_post_save(sender, instance, created, raw, **kwargs):
     _page_cache_post_edit(sender, instance, created=created, deleted=False, raw=raw, **kwargs)
@@ -0,0 +1,272 @@
+"""
+Cache invalidation driven by a dependency graph.
+
+Everything we cache -- rendered pages, tag lists, region maps, cards -- is
+represented here by a *target*.  Each kind of target knows how to clear
+itself (from both the Django cache and Varnish) and which other targets
+depend on it, e.g. a page's dependents are the pages that include it.
+
+To invalidate, hand the targets for whatever changed to invalidate().  It
+walks the graph from there, clears each distinct target exactly once and
+sends all the resulting Varnish bans as a single batch.
+"""
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.urlresolvers import set_urlconf, get_urlconf
+
+from .cache import (varnish_ban_batch, varnish_invalidate_page,
+    django_invalidate_page, bump_page_render_version)
+
+logger = logging.getLogger(__name__)
+
+
+class Target(object):
+    """
+    Something cached that may need to be invalidated.
+
+    Subclass and set `kind`, then override key(), clear() and, if other
+    cached things are built from this one, dependents().
+    """
+    kind = None
+
+    def key(self):
+        """ Returns a hashable value identifying what's cached. """
+        raise NotImplementedError
+
+    def clear(self):
+        """ Removes the cached thing from the Django cache and Varnish. """
+        raise NotImplementedError
+
+    def dependents(self):
+        """ Returns the Targets that must be cleared along with this one. """
+        return []
+
+
+class PageTarget(Target):
+    """
+    A rendered page.
+
+    Args:
+        page: The Page.  It doesn't need to exist (or still exist) in the
+            database.
+        existence_changed: True if the page was just created or deleted,
+            which changes how links to it are rendered.
+        content_changed: True if the page itself was edited.
+    """
+    kind = 'page'
+
+    def __init__(self, page, existence_changed=False, content_changed=False):
+        self.page = page
+        self.existence_changed = existence_changed
+        self.content_changed = content_changed
+
+    def key(self):
+        return (self.kind, self.page.region_id, self.page.slug)
+
+    def clear(self):
+        varnish_invalidate_page(self.page)
+        django_invalidate_page(self.page)
+        # Drops the page's fragment when it's included elsewhere.
+        bump_page_render_version(self.page.slug, self.page.region_id)
+
+    def dependents(self):
+        from links.models import Link, IncludedPage
+
+        region = self.page.region
+        if self.existence_changed:
+            # Links to this page are shown differently depending on
+            # whether or not it exists.
+            links = Link.objects.filter(
+                destination_slug=self.page.slug, region=region)
+            for name, slug in links.values_list('source__name', 'source__slug'):
+                yield PageTarget(_page_stub(name, slug, region))
+
+        # Pages that include this page.  Looked up by slug so that
+        # includes of pages that don't exist yet are found, too.
+        includes = IncludedPage.objects.filter(
+            included_page_slug=self.page.slug, region=region)
+        for name, slug in includes.values_list('source__name', 'source__slug'):
+            yield PageTarget(_page_stub(name, slug, region))
+
+        if self.content_changed and self.page.pk:
+            yield PageCardTarget(self.page)
+
+
+class PageCardTarget(Target):
+    """
+    The card shown for a page in lists of pages.
+    """
+    kind = 'page_card'
+
+    def __init__(self, page):
+        self.page = page
+
+    def key(self):
+        return (self.kind, self.page.pk)
+
+    def clear(self):
+        cache = get_cache('long-living')
+        if self.page.region.regionsettings.domain:
+            # Have to clear both urlconfs
+            cache.delete('card:main.urls_no_region,%s' % self.page.pk)
+        cache.delete('card:main.urls,%s' % self.page.pk)
+
+
+class TagTarget(Target):
+    """
+    A tag in a region.  Nothing is cached for the tag itself, but the
+    lists of pages with the tag are.
+    """
+    kind = 'tag'
+
+    def __init__(self, slug, region):
+        self.slug = slug
+        self.region = region
+
+    def key(self):
+        return (self.kind, self.region.id, self.slug)
+
+    def clear(self):
+        pass
+
+    def dependents(self):
+        from regions.models import Region
+        from links.models import IncludedTagList
+
+        yield TagViewTarget(self.slug, self.region)
+
+        # Tag lists also show pages from nearby regions.
+        center = self.region.regionsettings.region_center
+        if center:
+            nearby_regions = Region.objects.filter(
+                regionsettings__region_center__dwithin=(center, 0.5)
+            ).select_related('regionsettings')
+            for region in nearby_regions:
+                yield TagViewTarget(self.slug, region)
+
+        yield GlobalTagViewTarget(self.slug)
+
+        # Pages that include a "list of tagged pages" of this tag.
+        tag_lists = IncludedTagList.objects.filter(
+            included_tag__slug=self.slug, region=self.region)
+        for name, slug in tag_lists.values_list('source__name', 'source__slug'):
+            yield PageTarget(_page_stub(name, slug, self.region))
+
+
+class TagViewTarget(Target):
+    """
+    The list of pages with a given tag in a region.
+    """
+    kind = 'tag_view'
+
+    def __init__(self, slug, region):
+        self.slug = slug
+        self.region = region
+
+    def key(self):
+        return (self.kind, self.region.id, self.slug)
+
+    def clear(self):
+        from tags.cache import django_invalidate_tag_view, varnish_invalidate_tag_view
+
+        varnish_invalidate_tag_view(self.slug, self.region)
+        django_invalidate_tag_view(self.slug, self.region)
+
+
+class GlobalTagViewTarget(Target):
+    """
+    The list of pages with a given tag across all regions.
+    """
+    kind = 'global_tag_view'
+
+    def __init__(self, slug):
+        self.slug = slug
+
+    def key(self):
+        return (self.kind, self.slug)
+
+    def clear(self):
+        from tags.cache import django_invalidate_global_tag_view, varnish_invalidate_global_tag_view
+
+        varnish_invalidate_global_tag_view(self.slug)
+        django_invalidate_global_tag_view(self.slug)
+
+
+class RegionMapTarget(Target):
+    """
+    The full map of a region.
+    """
+    kind = 'region_map'
+
+    def __init__(self, region):
+        self.region = region
+
+    def key(self):
+        return (self.kind, self.region.id)
+
+    def clear(self):
+        from django.core.cache import cache
+        from maps.views import MapFullRegionView
+
+        def _do_invalidate():
+            key = MapFullRegionView.get_cache_key(region=self.region.slug)
+            cache.delete(key)
+
+        current_urlconf = get_urlconf() or settings.ROOT_URLCONF
+
+        if self.region.regionsettings.domain:
+            # Has a domain, ugh. Need to clear two URLs on two hosts, in this case
+            set_urlconf('main.urls_no_region')
+
+            _do_invalidate()
+
+            # Now invalidate main path on LocalWiki hub
+            set_urlconf('main.urls')
+        _do_invalidate()
+
+        set_urlconf(current_urlconf)
+
+
+def _page_stub(name, slug, region):
+    from pages.models import Page
+
+    return Page(name=name, slug=slug, region=region)
+
+
+def invalidate(targets):
+    """
+    Clears `targets` and everything that depends on them.
+
+    Each target is cleared once, no matter how many paths lead to it, and
+    the Varnish bans are sent together at the end.
+
+    Returns:
+        A dictionary mapping each kind of target to the number of targets
+        of that kind that were cleared.
+    """
+    targets = list(targets)
+    to_clear = OrderedDict()
+    pending = list(targets)
+    while pending:
+        target = pending.pop(0)
+        key = target.key()
+        if key in to_clear:
+            continue
+        to_clear[key] = target
+        pending.extend(target.dependents())
+
+    fan_out = {}
+    with varnish_ban_batch():
+        for target in to_clear.itervalues():
+            target.clear()
+            fan_out[target.kind] = fan_out.get(target.kind, 0) + 1
+
+    logger.info('Invalidated %d cached items for %s: %s',
+        len(to_clear),
+        ', '.join(['%s %s' % (t.kind, t.key()[1:]) for t in targets]),
+        ', '.join(['%s=%d' % (kind, n) for kind, n in sorted(fan_out.items())])
+    )
+    return fan_out
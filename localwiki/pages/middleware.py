@@ -0,0 +1,97 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import resolve, get_urlconf, Resolver404
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils import translation
+
+from utils.middleware import RequestURIMiddleware
+
+
+class FastPathStats(object):
+    """
+    Counts the page views AnonymousPageCacheMiddleware served from the
+    cache (hits) and the ones it passed on to the view (misses).  The
+    counts are per-process.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+
+stats = FastPathStats()
+
+
+class AnonymousPageCacheMiddleware(object):
+    """
+    Serves anonymous GET and HEAD requests for pages straight from the
+    cache PageDetailView fills, before the middleware that looks up the
+    region (and so hits the database) runs.
+
+    Goes right after SubdomainLanguageMiddleware.  The cached response is
+    only used if it was rendered in the request's language; otherwise the
+    request carries on as usual, e.g. to be redirected to the region's
+    language subdomain.
+    """
+    def process_request(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return
+        # Someone with a session may be logged in.
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return
+
+        key = self.get_cache_key(request)
+        if key is None:
+            return
+
+        response = cache.get(key)
+        if (response is None or
+                response.get('Content-Language') != translation.get_language()):
+            stats.miss()
+            return
+        stats.hit()
+
+        # Do the part of the skipped middleware that the response's
+        # second-phase (phased) rendering relies on.
+        RequestURIMiddleware().process_request(request)
+        CsrfViewMiddleware().process_view(request, None, (), {})
+
+        from pages.views import PageDetailView
+        return PageDetailView().patch_cached_response(request, response)
+
+    def get_cache_key(self, request):
+        """
+        Returns:
+            The key PageDetailView caches the requested page under, or None
+            if this isn't a request for a page or the region isn't in the
+            URL.
+        """
+        from pages.models import slugify
+        from pages.views import PageDetailView
+
+        urlconf = (getattr(request, 'urlconf', None) or get_urlconf() or
+                   settings.ROOT_URLCONF)
+        try:
+            match = resolve(request.path_info, urlconf)
+        except Resolver404:
+            return None
+        if match.namespace != 'pages' or match.url_name != 'show':
+            return None
+        # Custom domains need a RegionSettings lookup to find the region.
+        if not match.kwargs.get('region'):
+            return None
+        return PageDetailView.get_cache_key(
+            region=match.kwargs['region'], slug=slugify(match.kwargs['slug']))
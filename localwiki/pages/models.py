@@ -3,7 +3,6 @@ from urllib import unquote_plus
 import mimetypes
 import re
 from urlparse import urljoin
-from lxml.html import fragments_fromstring
 from copy import copy
 
 from django.contrib.gis.db import models
@@ -71,12 +70,34 @@ class Page(models.Model):
         if not slugify(self.name):
             raise ValidationError(_('Page name is invalid.'))
 
-    def exists(self):
+    def exists(self, exact=False):
         """
+        Args:
+            exact: If True, ask the database.  Otherwise the answer comes
+                from the cached index of the region's page slugs, which
+                can briefly disagree with the database, e.g. while the
+                transaction that created a page is still in progress.
+                Checks that guard writes should pass True.
+
         Returns:
             True if the Page currently exists in the database.
         """
-        return Page.objects.filter(slug=self.slug, region=self.region).exists()
+        from .cache import page_slug_exists
+
+        if exact:
+            return Page.objects.filter(
+                slug=self.slug, region=self.region_id).exists()
+        return page_slug_exists(self.slug, self.region_id)
+
+    def get_content_analysis(self):
+        """
+        Returns:
+            A ContentAnalysis of the page's content, parsed once and
+            shared by everything that looks at the content after a save.
+        """
+        from .analysis import get_content_analysis
+
+        return get_content_analysis(self.content, instance=self)
 
     def is_front_page(self):
         return self.name.lower() == 'front page'
@@ -145,7 +166,7 @@ class Page(models.Model):
         from redirects.models import Redirect
         from redirects.exceptions import RedirectToSelf
 
-        if Page(slug=slugify(pagename), region=self.region).exists():
+        if Page(slug=slugify(pagename), region=self.region).exists(exact=True):
             if slugify(pagename) == self.slug:
                 # The slug is the same but we're changing the name.
                 old_name = self.name
@@ -246,24 +267,19 @@ class Page(models.Model):
         doesn't contain any images (inside the content).
         """
         from .plugins import _files_url, file_url_to_name
+        from .analysis import get_content_analysis
+        from .cache import get_page_files
 
-        if not PageFile.objects.filter(slug=self.slug, region=self.region).exists():
+        files = get_page_files(self)
+        if not files:
             return None
 
-        # Parse the page HTML and look for the first local image
-        for e in fragments_fromstring(self.content):
-            if isinstance(e, basestring):
-                continue
-            for i in e.iter('img'):
-                src = i.attrib.get('src', '')
-                if src.startswith(_files_url):
-                    _file = PageFile.objects.filter(
-                        slug__exact=self.slug,
-                        name__exact=file_url_to_name(src),
-                        region=self.region
-                    )
-                    if _file:
-                        return _file[0]
+        # Look for the first local image in the page HTML
+        for src in get_content_analysis(self.content, self).images:
+            if src.startswith(_files_url):
+                _file = files.get(file_url_to_name(src).decode('utf-8'))
+                if _file:
+                    return _file
 
 
 class PageDiff(diff.BaseModelDiff):
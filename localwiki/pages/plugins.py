@@ -41,6 +41,7 @@ handler a chance to do something with an element, such as replace it with a
 template tag.
 """
 import re
+import hashlib
 from lxml import etree
 from lxml.html import fragments_fromstring
 from xml.sax.saxutils import escape
@@ -51,17 +52,32 @@ from copy import copy
 
 from django.template import Node, Variable
 from django.utils.text import unescape_entities
+from django.utils.encoding import smart_str
 from django.utils.translation import  ugettext as _
 from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import get_urlconf
 
 from ckeditor.models import parse_style, sanitize_html_fragment
 from redirects.models import Redirect
 from localwiki.utils.urlresolvers import reverse
 
 from .fields import WikiHTMLField
-from .models import Page, name_to_url, url_to_name, PageFile
+from .models import Page, name_to_url, url_to_name
 from .models import slugify
 from .exceptions import IFrameSrcNotApproved
+from .cache import get_page_files_version, get_page_files
+
+# Bump this whenever the output of the tag or plugin handlers changes, so
+# that template text cached by cached_html_to_template_text() is discarded.
+TEMPLATE_TEXT_CACHE_VERSION = 1
+# 29 days.  See utils.views.DEFAULT_MEMCACHED_TIMEOUT.
+TEMPLATE_TEXT_CACHE_TIMEOUT = 60 * 60 * 24 * 29
+
+# Bump this whenever EmbedCodeNode's sanitizing changes, so that cached
+# embed output is discarded.
+EMBED_CACHE_VERSION = 1
+EMBED_CACHE_TIMEOUT = TEMPLATE_TEXT_CACHE_TIMEOUT
 
 
 def sanitize_intermediate(html):
@@ -214,13 +230,8 @@ def handle_image(elem, context=None):
         return
 
     page = context['page']
-    try:
-        file = PageFile.objects.get(
-            slug__exact=page.slug,
-            name__exact=file_url_to_name(src),
-            region=page.region
-            )
-    except PageFile.DoesNotExist:
+    file = get_page_files(page).get(file_url_to_name(src).decode('utf-8'))
+    if file is None:
         return
 
     if do_thumbnail:
@@ -280,7 +291,33 @@ def register(cls_name, handler):
                   as a custom plugin class name.
         handler: The callable to run when encountering this class.
     """
+    global _registry_version
+
     plugin_handlers[cls_name] = handler
+    _registry_version = None
+
+
+_registry_version = None
+
+
+def plugin_registry_version():
+    """
+    Returns:
+        A short string identifying the set of registered tag and plugin
+        handlers.  Changes whenever a handler is registered via register().
+    """
+    global _registry_version
+
+    if _registry_version is None:
+        parts = [str(TEMPLATE_TEXT_CACHE_VERSION)] + tag_imports
+        for cls_name, handler in sorted(plugin_handlers.items()):
+            parts.append('%s:%s.%s' % (
+                cls_name, handler.__module__, handler.__name__))
+        for tag, handlers in sorted(tag_handlers.items()):
+            parts.append('%s:%s' % (tag, ','.join(
+                '%s.%s' % (h.__module__, h.__name__) for h in handlers)))
+        _registry_version = hashlib.md5('|'.join(parts)).hexdigest()[:12]
+    return _registry_version
 
 
 def html_to_template_text(unsafe_html, context=None, render_plugins=True):
@@ -332,6 +369,53 @@ def html_to_template_text(unsafe_html, context=None, render_plugins=True):
     return template_text.decode('utf-8')
 
 
+def template_text_cache_key(unsafe_html, context=None, render_plugins=True):
+    """
+    Returns:
+        The cache key for the template text of `unsafe_html` when rendered
+        in `context`.
+    """
+    page = None
+    if context and 'page' in context:
+        page = context['page']
+    urlconf = get_urlconf() or settings.ROOT_URLCONF
+
+    h = hashlib.md5()
+    h.update('%s|%s|' % (urlconf, render_plugins))
+    files_version = ''
+    if page is not None:
+        # The tag handlers look up the page's files (see handle_image) and
+        # link to them using the page's name and region.
+        h.update(smart_str(u'%s|%s|%s|' % (page.pk, page.name,
+            page.region.slug if page.region_id else '')))
+        if page.slug and page.region_id:
+            files_version = get_page_files_version(page.slug, page.region_id)
+    h.update(smart_str(unsafe_html))
+
+    return 'template_text:%s:%s:%s' % (plugin_registry_version(),
+        files_version, h.hexdigest())
+
+
+def cached_html_to_template_text(unsafe_html, context=None,
+                                 render_plugins=True):
+    """
+    Like html_to_template_text, but caches the resulting template text.
+
+    The template text only depends on the HTML, the page being rendered and
+    its files, and the registered handlers -- the context-dependent bits
+    (link styling, search boxes, included pages) are template tags that are
+    evaluated when the template text is rendered.  So we can skip the
+    sanitize / parse / walk / serialize steps on most renders.
+    """
+    key = template_text_cache_key(unsafe_html, context, render_plugins)
+    template_text = cache.get(key)
+    if template_text is None:
+        template_text = html_to_template_text(
+            unsafe_html, context, render_plugins)
+        cache.set(key, template_text, TEMPLATE_TEXT_CACHE_TIMEOUT)
+    return template_text
+
+
 class LinkNode(Node):
     def __init__(self, href, nodelist):
         self.href = href
@@ -355,33 +439,29 @@ class LinkNode(Node):
                                 'slug': page.pretty_slug,
                                 'file': filename}
                     )
-                    try:
-                        file = PageFile.objects.get(
-                            slug__exact=page.slug, region=region, name__exact=filename)
+                    file = get_page_files(page).get(filename.decode('utf-8'))
+                    if file is not None:
                         cls = ' class="file_%s"' % file.rough_type
-                    except PageFile.DoesNotExist:
+                    else:
                         cls = ' class="missing_link"'
                 elif unquote_plus(url).startswith('tags/'):
                     cls = ' class="tag_link"'
                     url = unquote_plus(url)
                 else:
-                    # Convert to proper URL: My%20page -> My_page
-                    url = name_to_url(url_to_name(url))
-
-                    # Handle relative page links with anchors
-                    url_parts = urlparse(url)
-                    path = url_parts.path
-                    fragment = '#%s' % url_parts.fragment if url_parts.fragment else ''
-
+                    path, fragment = page_link_parts(url)
                     if fragment and not path.strip():
                         url = fragment
                     else:
-                        try:
-                            page = Page.objects.get(slug__exact=slugify(path), region=region)
-                            url = reverse('pages:show', kwargs={'region': region.slug, 'slug': page.pretty_slug}) + fragment
-                        except Page.DoesNotExist:
-                            # Check if Redirect exists.
-                            if not Redirect.objects.filter(source=slugify(path), region=region):
+                        destinations = context.get('_link_destinations', {})
+                        key = (region.id, slugify(path))
+                        if key not in destinations:
+                            destinations.update(
+                                resolve_page_links([path], region))
+                        name, redirect_exists = destinations[key]
+                        if name is not None:
+                            url = reverse('pages:show', kwargs={'region': region.slug, 'slug': name_to_url(name)}) + fragment
+                        else:
+                            if not redirect_exists:
                                 cls = ' class="missing_link"'
                             url = reverse('pages:show', kwargs={'region': region.slug, 'slug': path}) + fragment
             # External links + nofollow flag (e.g. on User pages) => render as nofollow:
@@ -398,6 +478,69 @@ class LinkNode(Node):
         return (not url_parts.scheme and not url_parts.netloc)
 
 
+def page_link_parts(url):
+    """
+    Returns (path, fragment) for a relative link to a page, e.g.
+    'My%20page#Section' -> ('My_page', '#Section').
+    """
+    # Convert to proper URL: My%20page -> My_page
+    url = name_to_url(url_to_name(url))
+
+    # Handle relative page links with anchors
+    url_parts = urlparse(url)
+    fragment = '#%s' % url_parts.fragment if url_parts.fragment else ''
+    return url_parts.path, fragment
+
+
+def resolve_page_links(paths, region):
+    """
+    Looks up the destinations of the given page link paths in one go.
+
+    Returns a dictionary mapping (region id, slug) to a (page name,
+    redirect exists) tuple.  The page name is None if the page doesn't
+    exist.
+    """
+    slugs = set(slugify(path) for path in paths)
+    destinations = dict(((region.id, slug), (None, False)) for slug in slugs)
+    pages = Page.objects.filter(region=region, slug__in=slugs)
+    for slug, name in pages.values_list('slug', 'name'):
+        destinations[(region.id, slug)] = (name, False)
+        slugs.discard(slug)
+    if slugs:
+        redirects = Redirect.objects.filter(region=region, source__in=slugs)
+        for source in redirects.values_list('source', flat=True):
+            destinations[(region.id, source)] = (None, True)
+    return destinations
+
+
+def prefetch_page_links(nodelist, context):
+    """
+    Resolves the destinations of all the page links in `nodelist` at
+    once and stores them in the context, so that each LinkNode doesn't
+    have to look up its own destination when rendered.
+    """
+    region = context.get('region', None)
+    if region is None:
+        return
+    destinations = context.get('_link_destinations', None)
+    if destinations is None:
+        return
+    paths = []
+    for node in nodelist.get_nodes_by_type(LinkNode):
+        url = node.href
+        if isinstance(url, Variable) or not node.is_relative_link(url):
+            continue
+        if url.startswith('_files/') or unquote_plus(url).startswith('tags/'):
+            continue
+        path, fragment = page_link_parts(url)
+        if not path.strip():
+            continue
+        if (region.id, slugify(path)) not in destinations:
+            paths.append(path)
+    if paths:
+        destinations.update(resolve_page_links(paths, region))
+
+
 class EmbedCodeNode(Node):
     allowed_tags = copy(WikiHTMLField.allowed_elements)
     allowed_attributes = copy(WikiHTMLField.allowed_attributes_map)
@@ -409,6 +552,12 @@ class EmbedCodeNode(Node):
         'allowfullscreen', 'width', 'height', 'src', 'style']
     allowed_styles_map['iframe'] = ['width', 'height']
 
+    # Results of embed(), cached by cache_key().
+    EMBED_OK, EMBED_NOT_APPROVED, EMBED_INVALID = range(3)
+
+    # (EMBED_ALLOWED_SRC, the compiled regexes)
+    _allowed_src = (None, [])
+
     def __init__(self, nodelist):
         self.nodelist = nodelist
 
@@ -416,20 +565,36 @@ class EmbedCodeNode(Node):
         return sanitize_html_fragment(html, self.allowed_tags,
             self.allowed_attributes, self.allowed_styles_map)
 
+    @classmethod
+    def allowed_src_regexes(cls):
+        """
+        Returns:
+            The compiled EMBED_ALLOWED_SRC regexes.  They're recompiled
+            only when the setting changes.
+        """
+        allowed_src = tuple(getattr(settings, 'EMBED_ALLOWED_SRC', ['.*']))
+        if cls._allowed_src[0] != allowed_src:
+            cls._allowed_src = (allowed_src,
+                                [re.compile(regex) for regex in allowed_src])
+        return cls._allowed_src[1]
+
     def _process_iframe(self, iframe):
         src = iframe.attrib.get('src', '')
-        allowed_src = getattr(settings, 'EMBED_ALLOWED_SRC', ['.*'])
         # We don't want a self-closing iframe tag.
         if iframe.text is None:
             iframe.text = ''
-        if any(re.match(regex, src) for regex in allowed_src):
+        if any(regex.match(src) for regex in self.allowed_src_regexes()):
             return iframe
         else:
             raise IFrameSrcNotApproved
 
-    def render(self, context):
+    def embed(self, html):
+        """
+        Returns:
+            A tuple (result, safe_html), where result is one of
+            EMBED_OK, EMBED_NOT_APPROVED or EMBED_INVALID.
+        """
         try:
-            html = unescape_entities(self.nodelist.render(context))
             safe_html = self.sanitize(html)
             top_level_elements = fragments_fromstring(safe_html)
             # TODO: We need to remember to patch in whatever pre-save
@@ -441,16 +606,46 @@ class EmbedCodeNode(Node):
                     elem = self._process_iframe(elem)
                 out.append(etree.tostring(elem, method='html',
                                           encoding='UTF-8'))
-            return ''.join(out)
-
+            return (self.EMBED_OK, ''.join(out))
         except IFrameSrcNotApproved:
+            return (self.EMBED_NOT_APPROVED, None)
+        except:
+            return (self.EMBED_INVALID, None)
+
+    def cache_key(self, html):
+        """
+        Returns:
+            The cache key for the result of embed(html).  The sanitized
+            output only depends on the embed code and the allow-list.
+        """
+        allowed_src = getattr(settings, 'EMBED_ALLOWED_SRC', ['.*'])
+        h = hashlib.md5()
+        h.update(smart_str(u'%r|' % (tuple(allowed_src),)))
+        h.update(smart_str(html))
+        return 'embed_code:%s:%s' % (EMBED_CACHE_VERSION, h.hexdigest())
+
+    def render(self, context):
+        try:
+            html = unescape_entities(self.nodelist.render(context))
+        except:
+            return '<span class="plugin embed">' + _('Invalid embed code') + '</span>'
+
+        key = self.cache_key(html)
+        result = cache.get(key)
+        if result is None:
+            result = self.embed(html)
+            cache.set(key, result, EMBED_CACHE_TIMEOUT)
+
+        status, safe_html = result
+        if status == self.EMBED_OK:
+            return safe_html
+        if status == self.EMBED_NOT_APPROVED:
             return (
                 '<span class="plugin embed">' +
                 _('The embedded URL is not on the list of approved providers.  '
                 'Contact the site administrator to add it.') +
                 '</span>')
-        except:
-            return '<span class="plugin embed">' + _('Invalid embed code') + '</span>'
+        return '<span class="plugin embed">' + _('Invalid embed code') + '</span>'
 
 
 class SearchBoxNode(Node):
@@ -1,4 +1,5 @@
-from django.db.models.signals import pre_save, post_save, pre_delete, m2m_changed
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.core.signals import request_finished
 from django.utils.translation import ugettext as _
 from django.conf import settings
 
@@ -9,8 +10,11 @@ from redirects.models import Redirect
 from tags.models import PageTagSet
 from maps.models import MapData
 
-from .models import Page
+from .models import Page, PageFile
 from .cache import _page_cache_post_save, _page_cache_pre_delete, _pagetagset_m2m_changed
+from .cache import _page_files_post_edit
+from .cache import _page_slug_index_post_save, _page_slug_index_post_delete
+from .cache import page_slug_index_request_finished
 
 
 def _delete_page(sender, instance, raw, **kws):
@@ -110,3 +114,12 @@ m2m_changed.connect(_pagetagset_m2m_changed, sender=PageTagSet.tags.through)
 
 post_save.connect(_page_cache_post_save, sender=MapData)
 pre_delete.connect(_page_cache_pre_delete, sender=MapData)
+
+# Cached template text for a page depends on the files attached to it.
+post_save.connect(_page_files_post_edit, sender=PageFile)
+post_delete.connect(_page_files_post_edit, sender=PageFile)
+
+# Keep the per-region index of existing page slugs up to date.
+post_save.connect(_page_slug_index_post_save, sender=Page)
+post_delete.connect(_page_slug_index_post_delete, sender=Page)
+request_finished.connect(page_slug_index_request_finished)
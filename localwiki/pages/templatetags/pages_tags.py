@@ -1,14 +1,20 @@
+import hashlib
+
 from django import template
 from django.template.loader_tags import BaseIncludeNode
 from django.template import Template
-from django.utils.translation import ugettext as _
+from django.utils.translation import ugettext as _, get_language
+from django.utils.encoding import smart_str
 from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import get_urlconf
 from django.utils.text import unescape_string_literal
 
 from localwiki.utils.urlresolvers import reverse
 
-from pages.plugins import html_to_template_text, SearchBoxNode
-from pages.plugins import LinkNode, EmbedCodeNode
+from pages.plugins import cached_html_to_template_text, SearchBoxNode
+from pages.plugins import LinkNode, EmbedCodeNode, prefetch_page_links
+from pages.cache import get_page_render_version, get_page_files_version
 from pages import models
 from pages.models import Page, slugify
 
@@ -28,21 +34,43 @@ class PageContentNode(BaseIncludeNode):
         self.render_plugins = render_plugins
 
     def render(self, context):
+        owns_link_destinations = False
+        owns_include_state = False
         try:
             html = unicode(self.html_var.resolve(context))
             render_context = context
             if self.nofollow:
                 context['_render_nofollow'] = True
-            t = Template(html_to_template_text(html, context, self.render_plugins))
+            # Page link destinations and included pages are resolved in
+            # bulk, once per top-level render, and shared with any
+            # included content.
+            owns_link_destinations = '_link_destinations' not in context
+            if owns_link_destinations:
+                context['_link_destinations'] = {}
+            owns_include_state = '_include_state' not in context
+            if owns_include_state:
+                context['_include_state'] = new_include_state()
+            t = Template(cached_html_to_template_text(
+                html, context, self.render_plugins))
+            prefetch_page_links(t.nodelist, context)
+            prefetch_included_pages(t.nodelist, context)
             html = self.render_template(t, context)
             if self.nofollow:
                 del context['_render_nofollow']
+            if owns_link_destinations:
+                del context['_link_destinations']
+            if owns_include_state:
+                del context['_include_state']
             return html
         except:
             if settings.TEMPLATE_DEBUG:
                 raise
             if self.nofollow and '_render_nofollow' in context:
                 del context['_render_nofollow']
+            if owns_link_destinations and '_link_destinations' in context:
+                del context['_link_destinations']
+            if owns_include_state and '_include_state' in context:
+                del context['_include_state']
 
 
 class IncludeContentNode(BaseIncludeNode):
@@ -80,33 +108,159 @@ class IncludeContentNode(BaseIncludeNode):
     def render(self, context):
         self.process_context(context)
         try:
-            template_text = ''
-            if 'showtitle' in self.args:
-                title = self.get_title(context)
-                if title:
-                    template_text += '<h2>%s</h2>' % title
-            template_text += self.get_content(context)
-            template = Template(template_text)
-            return self.render_template(template, context)
+            return self.render_included(context)
         except:
             if settings.TEMPLATE_DEBUG:
                 raise
             return ''
 
+    def render_included(self, context):
+        template_text = ''
+        if 'showtitle' in self.args:
+            title = self.get_title(context)
+            if title:
+                template_text += '<h2>%s</h2>' % title
+        template_text += self.get_content(context)
+        template = Template(template_text)
+        prefetch_page_links(template.nodelist, context)
+        prefetch_included_pages(template.nodelist, context)
+        return self.render_template(template, context)
+
+
+INCLUDE_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def new_include_state():
+    """
+    Returns:
+        The state shared by the page includes of a single top-level
+        render.  'pages' maps (region id, slug) to the Page to include,
+        or None if it doesn't exist.  'stack' holds the ids of the pages
+        being included, outermost first.  'loops' counts the endless
+        include loops found so far.
+    """
+    return {'pages': {}, 'stack': [], 'loops': 0}
+
+
+def prefetch_included_pages(nodelist, context):
+    """
+    Looks up all the pages included in `nodelist` at once, so that each
+    IncludePageNode doesn't have to look up its own page when rendered.
+    """
+    region = context.get('region', None)
+    state = context.get('_include_state', None)
+    if region is None or state is None:
+        return
+    slugs = set()
+    for node in nodelist.get_nodes_by_type(IncludePageNode):
+        slug = slugify(node.name)
+        if (region.id, slug) not in state['pages']:
+            slugs.add(slug)
+    if not slugs:
+        return
+    found = Page.objects.filter(slug__in=slugs, region=region)
+    for page in found.select_related('region'):
+        state['pages'][(region.id, page.slug)] = page
+    for slug in slugs:
+        state['pages'].setdefault((region.id, slug), None)
+
 
 class IncludePageNode(IncludeContentNode):
     def process_context(self, context):
         super(IncludePageNode, self).process_context(context)
-        try:
-            self.page = Page.objects.get(
-                slug__exact=slugify(self.name), region=self.region)
+        self.page = None
+        if self.region is None:
+            return
+        pages = context.get('_include_state', {}).get('pages', {})
+        key = (self.region.id, slugify(self.name))
+        if key in pages:
+            self.page = pages[key]
+        else:
+            try:
+                self.page = Page.objects.get(slug__exact=key[1],
+                                             region=self.region)
+            except Page.DoesNotExist:
+                pass
+        if self.page is not None:
             # Keep track of the fact this page was included (for caching purposes)
             if 'request' in context:
                 _depends_on = getattr(context['request'], '_depends_on_header', [])
                 _depends_on.append(self.page.id)
                 context['request']._depends_on = _depends_on
-        except Page.DoesNotExist:
-            self.page = None
+
+    def _include_state(self, context):
+        state = context.get('_include_state', None)
+        if state is None:
+            state = new_include_state()
+            context['_include_state'] = state
+        return state
+
+    def is_endless_loop(self, context):
+        stack = self._include_state(context)['stack']
+        context_page = context.get('page', None)
+        return (self.page.id in stack or
+                (context_page is not None and context_page.id == self.page.id))
+
+    def render_included(self, context):
+        if self.page is None or self.is_endless_loop(context):
+            return super(IncludePageNode, self).render_included(context)
+        html = ''
+        if 'showtitle' in self.args:
+            html += '<h2>%s</h2>' % self.get_title(context)
+        return html + self.render_fragment(context)
+
+    def fragment_cache_key(self, context):
+        """
+        Returns:
+            The cache key for the included page's rendered content.  It
+            changes whenever the page is edited or invalidated (which
+            also happens when a page it includes changes, via
+            IncludedPage), or its files change.
+        """
+        page = self.page
+        h = hashlib.md5()
+        h.update(smart_str(u'%s|%s|%s|%s|%s|%s|' % (
+            page.id,
+            get_page_render_version(page.slug, page.region_id),
+            get_page_files_version(page.slug, page.region_id),
+            get_urlconf() or settings.ROOT_URLCONF,
+            bool(context.get('_render_nofollow', False)),
+            get_language(),
+        )))
+        h.update(smart_str(page.content))
+        return 'include_fragment:%s' % h.hexdigest()
+
+    def render_fragment(self, context):
+        key = self.fragment_cache_key(context)
+        html = cache.get(key)
+        if html is not None:
+            return html
+
+        state = self._include_state(context)
+        loops = state['loops']
+        context_page = context.get('page', None)
+        if context_page is not None and context_page.id:
+            state['stack'].append(context_page.id)
+        state['stack'].append(self.page.id)
+        context['page'] = self.page
+        try:
+            template = Template(cached_html_to_template_text(
+                self.page.content, context))
+            prefetch_page_links(template.nodelist, context)
+            prefetch_included_pages(template.nodelist, context)
+            html = self.render_template(template, context)
+        finally:
+            # restore context
+            context['page'] = context_page
+            state['stack'].pop()
+            if context_page is not None and context_page.id:
+                state['stack'].pop()
+
+        # What an include loop renders depends on where the including
+        # started, so fragments that ran into one aren't shared.
+        if state['loops'] == loops:
+            cache.set(key, html, INCLUDE_FRAGMENT_CACHE_TIMEOUT)
+        return html
 
     def get_title(self, context):
         if not self.page:
@@ -126,21 +280,11 @@ class IncludePageNode(IncludeContentNode):
             return (('<p class="plugin includepage">' + _('Unable to include '
                     '<a href="%(page_url)s" class="missing_link">%(page_name)s</a>') + '</p>')
                     % {'page_url': self.get_page_url(), 'page_name': self.name})
-        # prevent endless loops
-        context_page = context['page']
-        include_stack = context.get('_include_stack', [])
-        include_stack.append(context_page.name)
-        if self.page.name in include_stack:
-            return (('<p class="plugin includepage">' + _('Unable to'
-                    ' include <a href="%(page_url)s">%(page_name)s</a>: endless include'
-                    ' loop.') + '</p>') % {'page_url': self.get_page_url(), 'page_name': self.page.name})
-        context['_include_stack'] = include_stack
-        context['page'] = self.page
-        template_text = html_to_template_text(self.page.content, context)
-        # restore context
-        context['_include_stack'].pop()
-        context['page'] = context_page
-        return template_text
+        # Only reached for endless loops, see render_included().
+        self._include_state(context)['loops'] += 1
+        return (('<p class="plugin includepage">' + _('Unable to'
+                ' include <a href="%(page_url)s">%(page_name)s</a>: endless include'
+                ' loop.') + '</p>') % {'page_url': self.get_page_url(), 'page_name': self.page.name})
 
 
 @register.tag(name='render_plugins')
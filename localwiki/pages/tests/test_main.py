@@ -6,11 +6,15 @@ from lxml.html import fragments_fromstring
 from django.test import TestCase
 from django.db import models
 from django.test.client import RequestFactory
+from django.http import HttpResponse
+from django.utils import translation
 from django import forms
 from django.template.base import Template
 from django.template.context import Context
 from django.conf import settings
 from django.core.files.base import ContentFile
+from django.core.cache import get_cache
+from django.core.signals import request_finished
 from django.contrib.gis.geos import GEOSGeometry
 
 from versionutils.merging.forms import MergeMixin
@@ -22,8 +26,17 @@ from tags.models import PageTagSet, Tag
 from .. forms import PageForm
 from ..models import (Page, PageFile, slugify,
     url_to_name, clean_name, name_to_url)
-from ..plugins import html_to_template_text
-from ..plugins import tag_imports
+from ..plugins import html_to_template_text, cached_html_to_template_text
+from ..plugins import tag_imports, plugin_registry_version
+from .. import plugins
+from ..cache import page_slug_exists, existing_page_slugs
+from .. import cache as page_cache
+from ..templatetags import pages_tags
+from .. import middleware as page_middleware
+from ..views import PageDetailView
+from ..cache import _varnish_ban_groups, _varnish_ban_expression
+from ..invalidation import invalidate, Target, PageTarget
+from ..analysis import ContentAnalysis
 from .. import exceptions
 
 from .xsstests import xss_exploits
@@ -89,6 +102,51 @@ class PageTest(TestCase):
         self.assertEqual(slugify(a), 'ая !@$%&*()- /"\'.,'.decode('utf-8'))
         self.assertEqual(slugify(a), slugify(slugify(a)))
 
+    def test_page_slug_index(self):
+        other_region = Region(full_name='Other region', slug='other-region')
+        other_region.save()
+        p = Page(name='Front Page', region=self.region, content='<p>hi</p>')
+        p.save()
+        Page(name='Explore', region=other_region, content='<p>hi</p>').save()
+
+        self.assertTrue(p.exists())
+        self.assertTrue(p.exists(exact=True))
+        self.assertTrue(page_slug_exists('front page', self.region))
+        self.assertFalse(page_slug_exists('explore', self.region))
+        self.assertEqual(
+            existing_page_slugs(['front page', 'explore', 'missing'], self.region),
+            set(['front page']))
+        self.assertEqual(
+            existing_page_slugs(['front page', 'explore'], other_region.id),
+            set(['explore']))
+
+        p.delete()
+        self.assertFalse(p.exists())
+        self.assertFalse(p.exists(exact=True))
+        self.assertFalse(page_slug_exists('front page', self.region))
+
+    def test_page_slug_index_rebuilt_after_request(self):
+        old_cache = page_cache.cache
+        page_cache.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        try:
+            p = Page(name='Front Page', region=self.region, content='<p>hi</p>')
+            p.save()
+            self.assertTrue(page_slug_exists('front page', self.region))
+
+            p.delete()
+            self.assertFalse(page_slug_exists('front page', self.region))
+
+            # Another request rebuilds the index before the delete commits.
+            key = page_cache._page_slug_index_key(
+                self.region.id, page_cache._page_slug_bucket('front page'))
+            page_cache.cache.set(key, set(['front page']))
+            self.assertTrue(page_slug_exists('front page', self.region))
+
+            request_finished.send(sender=self.__class__)
+            self.assertFalse(page_slug_exists('front page', self.region))
+        finally:
+            page_cache.cache = old_cache
+
     def test_pretty_slug(self):
         a = Page(name='Front Page', region=self.region)
         self.assertEqual(a.pretty_slug, 'Front_Page')
@@ -586,6 +644,31 @@ class HTMLToTemplateTextTest(TestCase):
         template_text = html_to_template_text(html, context=self.context)
         self.assertEqual(template_text, imports + '<p><a name="blah"></a></p>')
 
+    def test_cached_template_text(self):
+        a = Page(name='Front Page', region=self.region)
+        a.content = (u'<p><a href="Explore">explore</a> and '
+                     u'<a href="http://example.org">elsewhere</a></p>')
+        a.save()
+
+        context = Context({'page': a, 'region': self.region})
+        self.assertEqual(cached_html_to_template_text(a.content, context),
+                         html_to_template_text(a.content, context))
+        # Twice, in case the first call populated a cache.
+        self.assertEqual(cached_html_to_template_text(a.content, context),
+                         html_to_template_text(a.content, context))
+
+    def test_registry_version_changes(self):
+        version = plugin_registry_version()
+        self.assertEqual(version, plugin_registry_version())
+
+        plugins.register('testplugin', plugins.embed_code)
+        try:
+            self.assertNotEqual(version, plugin_registry_version())
+        finally:
+            del plugins.plugin_handlers['testplugin']
+            plugins._registry_version = None
+        self.assertEqual(version, plugin_registry_version())
+
         
 class PluginTest(TestCase):
     def setUp(self):
@@ -736,6 +819,60 @@ class PluginTest(TestCase):
             ('<div class="included_page_wrapper"><p>Some text</p></div>'
              '<div class="included_page_wrapper"><p>Some text</p></div>'))
 
+    def test_includes_prefetched(self):
+        for name in ('One', 'Two', 'Three'):
+            Page(name=name, region=self.region, content='<p>%s</p>' % name).save()
+        page = Page(name='Hub', region=self.region)
+        content = ''.join(['<a class="plugin includepage" href="%s">dummy</a>' % name
+                           for name in ('One', 'Two', 'Three', 'Missing')])
+        template = Template("""
+{% load pages_tags %}
+{% render_plugins content %}
+        """)
+        context = Context({'region': self.region, 'content': content, 'page': page})
+        # One query for all the included pages.
+        with self.assertNumQueries(1):
+            rendered = template.render(context)
+        for name in ('One', 'Two', 'Three'):
+            self.assertTrue('<p>%s</p>' % name in rendered)
+        self.assertTrue('class="missing_link">Missing</a>' in rendered)
+        self.assertFalse('_include_state' in context)
+
+    def test_include_fragments_cached(self):
+        old_caches = (page_cache.cache, pages_tags.cache)
+        page_cache.cache = pages_tags.cache = get_cache(
+            'django.core.cache.backends.locmem.LocMemCache')
+        try:
+            c = Page(name='Nested', region=self.region, content='<p>Old</p>')
+            c.save()
+            b = Page(name='Explore', region=self.region,
+                     content='<a class="plugin includepage" href="Nested">dummy</a>')
+            b.save()
+            a = Page(name='Front Page', region=self.region,
+                     content='<a class="plugin includepage" href="Explore">dummy</a>')
+            a.save()
+            template = Template("""
+{% load pages_tags %}
+{% render_plugins content %}
+            """)
+
+            def render():
+                return template.render(Context(
+                    {'region': self.region, 'content': a.content, 'page': a}))
+
+            self.assertTrue('<p>Old</p>' in render())
+            # The fragment for Explore, which includes Nested, is reused.
+            Page.objects.filter(pk=c.pk).update(content='<p>New</p>')
+            with self.assertNumQueries(1):
+                self.assertTrue('<p>Old</p>' in render())
+
+            # Invalidating Explore (PageTarget.clear(), as happens when a
+            # page it includes changes) drops its fragment.
+            page_cache.bump_page_render_version(b.slug, self.region.id)
+            self.assertTrue('<p>New</p>' in render())
+        finally:
+            page_cache.cache, pages_tags.cache = old_caches
+
     def test_embed_tag(self):
         html = ('<span class="plugin embed">&lt;strong&gt;Hello&lt;/strong&gt;'
                 '</span>')
@@ -763,6 +900,38 @@ class PluginTest(TestCase):
             '<iframe src="http://www.youtube.com/embed/JVRsWAjvQSg"></iframe>'
             in rendered)
 
+    def test_embed_cached(self):
+        old_cache = plugins.cache
+        old_embed = plugins.EmbedCodeNode.__dict__['embed']
+        plugins.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        calls = []
+
+        def embed(node, html):
+            calls.append(html)
+            return old_embed(node, html)
+
+        try:
+            plugins.EmbedCodeNode.embed = embed
+            html = ('<span class="plugin embed">&lt;iframe '
+                    'src="http://www.youtube.com/embed/JVRsWAjvQSg"'
+                    '&gt;&lt;/iframe&gt;</span>')
+            template = Template(html_to_template_text(html))
+            for i in range(3):
+                rendered = template.render(Context())
+                self.failUnless('<iframe src="http://www.youtube.com/embed/'
+                                'JVRsWAjvQSg"></iframe>' in rendered)
+            self.assertEqual(len(calls), 1)
+
+            # Changing the allow-list means sanitizing again.
+            settings.EMBED_ALLOWED_SRC = ['http://player.vimeo.com/video/.*']
+            rendered = template.render(Context())
+            self.failUnless(('The embedded URL is not on the list of approved '
+                             'providers') in rendered)
+            self.assertEqual(len(calls), 2)
+        finally:
+            plugins.cache = old_cache
+            plugins.EmbedCodeNode.embed = old_embed
+
     def test_amp_in_link_with_class(self):
         page = Page(name='Explore', region=self.region)
         html = ('<p><a class="external something" '
@@ -799,6 +968,226 @@ class PluginTest(TestCase):
         self.assertTrue('nofollow' in rendered)
 
 
+    def test_link_destinations_prefetched(self):
+        Page(name='Explore', region=self.region, content='<p>hi</p>').save()
+        Page(name='Front Page', region=self.region, content='<p>hi</p>').save()
+        Redirect(source='old page', destination=Page.objects.get(
+            slug='explore', region=self.region), region=self.region).save()
+        page = Page(name='Links', region=self.region)
+        content = ('<p><a href="Explore">a</a><a href="Front%20Page#top">b</a>'
+                   '<a href="Old%20page">c</a><a href="Missing">d</a>'
+                   '<a href="explore">e</a></p>')
+        template = Template("""
+{% load pages_tags %}
+{% render_plugins content %}
+        """)
+        context = Context({'region': self.region, 'content': content, 'page': page})
+        # One query for the pages, one for the redirects.
+        with self.assertNumQueries(2):
+            rendered = template.render(context)
+        self.assertTrue('<a href="/test-region/Explore">a</a>' in rendered)
+        self.assertTrue('<a href="/test-region/Front_Page#top">b</a>' in rendered)
+        self.assertTrue('<a href="/test-region/Old_page">c</a>' in rendered)
+        self.assertTrue('<a href="/test-region/Missing" class="missing_link">d</a>'
+                        in rendered)
+        self.assertTrue('<a href="/test-region/Explore">e</a>' in rendered)
+        self.assertFalse('_link_destinations' in context)
+
+    def test_page_files_loaded_once(self):
+        old_cache = page_cache.cache
+        page_cache.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        try:
+            page = Page(name='Photos', region=self.region, content='<p>hi</p>')
+            page.save()
+            for name in ('a.jpg', 'b.jpg', 'doc.pdf', u'café.jpg'):
+                PageFile(file=ContentFile('x'), name=name, slug=page.slug,
+                         region=self.region).save()
+            html = ('<p><img src="_files/a.jpg"><img src="_files/b.jpg">'
+                    '<img src="_files/caf%C3%A9.jpg">'
+                    '<img src="_files/missing.jpg"></p>')
+            context = {'region': self.region, 'page': page}
+            with self.assertNumQueries(1):
+                template_text = html_to_template_text(html, context=context)
+            a = PageFile.objects.get(slug=page.slug, region=self.region, name='a.jpg')
+            self.assertTrue(a.file.url in template_text)
+            cafe = PageFile.objects.get(slug=page.slug, region=self.region,
+                                        name=u'café.jpg')
+            self.assertTrue(cafe.file.url in template_text)
+
+            template = Template("""
+{% load pages_tags %}
+{% render_plugins content %}
+            """)
+            rendered = template.render(Context({'region': self.region,
+                'request': RequestFactory().get('/'), 'page': page,
+                'content': '<p><a href="_files/caf%C3%A9.jpg">cafe</a></p>'}))
+            self.assertTrue('class="file_image"' in rendered)
+
+            page.content = html
+            with self.assertNumQueries(0):
+                self.assertEqual(page.get_highlight_image().name, 'a.jpg')
+            page.content = '<p><img src="_files/caf%C3%A9.jpg"></p>'
+            with self.assertNumQueries(0):
+                self.assertEqual(page.get_highlight_image().name, u'café.jpg')
+        finally:
+            page_cache.cache = old_cache
+
+
+class AnonymousPageCacheMiddlewareTest(TestCase):
+    def setUp(self):
+        self.old_cache = page_middleware.cache
+        page_middleware.cache = get_cache(
+            'django.core.cache.backends.locmem.LocMemCache')
+        page_middleware.cache.clear()
+        page_middleware.stats.reset()
+        self.middleware = page_middleware.AnonymousPageCacheMiddleware()
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        page_middleware.cache = self.old_cache
+
+    def cache_response(self, language):
+        response = HttpResponse('Cached parks')
+        response['Content-Language'] = language
+        key = PageDetailView.get_cache_key(region='test-region', slug='parks')
+        page_middleware.cache.set(key, response)
+
+    def test_serves_cached_page(self):
+        self.cache_response(translation.get_language())
+        request = self.factory.get('/test-region/Parks')
+        with self.assertNumQueries(0):
+            response = self.middleware.process_request(request)
+        self.assertEqual(response.content, 'Cached parks')
+        self.assertEqual(page_middleware.stats.hits, 1)
+
+    def test_passes_on(self):
+        # Not cached
+        request = self.factory.get('/test-region/Parks')
+        self.assertEqual(self.middleware.process_request(request), None)
+        self.assertEqual(page_middleware.stats.misses, 1)
+
+        # Cached in another language
+        self.cache_response('xx')
+        self.assertEqual(self.middleware.process_request(request), None)
+        self.assertEqual(page_middleware.stats.misses, 2)
+
+        self.cache_response(translation.get_language())
+        # Maybe logged in
+        request = self.factory.get('/test-region/Parks')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = 'abc'
+        self.assertEqual(self.middleware.process_request(request), None)
+        # Not a page view
+        request = self.factory.post('/test-region/Parks')
+        self.assertEqual(self.middleware.process_request(request), None)
+        request = self.factory.get('/test-region/Parks/_files/')
+        self.assertEqual(self.middleware.process_request(request), None)
+
+        self.assertEqual(page_middleware.stats.hits, 0)
+        self.assertEqual(page_middleware.stats.misses, 2)
+
+
+class VarnishBanTest(TestCase):
+    def test_ban_groups(self):
+        bans = [
+            ('localwiki.org', u'/oakland/Front_Page'),
+            ('localwiki.org', u'/oakland/Explore'),
+            ('oaklandwiki.org', u'/Front_Page'),
+            ('localwiki.org', u'/oakland/Front_Page'),
+        ]
+        self.assertEqual(_varnish_ban_groups(bans), [
+            ('localwiki.org', [u'/oakland/Front_Page', u'/oakland/Explore']),
+            ('oaklandwiki.org', [u'/Front_Page']),
+        ])
+
+    def test_ban_groups_split_long(self):
+        url = u'/oakland/' + 'a' * 1000
+        bans = [('localwiki.org', '%s%s' % (url, n)) for n in range(10)]
+        groups = _varnish_ban_groups(bans)
+        self.assertTrue(len(groups) > 1)
+        self.assertEqual(sum([urls for host, urls in groups], []),
+                         [url for host, url in bans])
+
+    def test_ban_expression(self):
+        self.assertEqual(
+            _varnish_ban_expression('localwiki.org', [u'/a', u'/b']),
+            (r'obj.http.x-url ~ ^(?i)((/a|/b)(/*)(\\?.*)?)$ && '
+             r'obj.http.x-host ~ ^((?i)(.*\\.)?localwiki.org(:[0-9]*)?)$'))
+
+
+class InvalidationTest(TestCase):
+    def setUp(self):
+        self.region = Region(full_name='Test region', slug='test-region')
+        self.region.save()
+
+    def test_page_dependents(self):
+        a = Page(name='Front Page', region=self.region,
+                 content='<a class="plugin includepage" href="Explore">dummy</a>')
+        a.save()
+        b = Page(name='Links', region=self.region,
+                 content='<p><a href="Explore">Explore</a></p>')
+        b.save()
+        c = Page(name='Explore', region=self.region, content='<p>hi</p>')
+
+        keys = [t.key() for t in PageTarget(c).dependents()]
+        self.assertEqual(keys, [('page', self.region.id, 'front page')])
+
+        c.save()
+        keys = [t.key() for t in PageTarget(
+            c, existence_changed=True, content_changed=True).dependents()]
+        self.assertEqual(keys, [
+            ('page', self.region.id, 'links'),
+            ('page', self.region.id, 'front page'),
+            ('page_card', c.pk),
+        ])
+
+    def test_invalidate_deduplicates(self):
+        cleared = []
+
+        class Node(Target):
+            kind = 'node'
+
+            def __init__(self, name, children=()):
+                self.name = name
+                self.children = children
+
+            def key(self):
+                return (self.kind, self.name)
+
+            def clear(self):
+                cleared.append(self.name)
+
+            def dependents(self):
+                return [Node(child, graph.get(child, ())) for child in self.children]
+
+        # a -> b -> c -> a, and a -> c
+        graph = {'a': ('b', 'c'), 'b': ('c',), 'c': ('a',)}
+        fan_out = invalidate([Node('a', graph['a']), Node('b', graph['b'])])
+        self.assertEqual(cleared, ['a', 'b', 'c'])
+        self.assertEqual(fan_out, {'node': 3})
+
+
+class ContentAnalysisTest(TestCase):
+    def test_analysis(self):
+        html = ('<p>Hi <a href="Parks">parks</a> <a href="Parks">again</a>'
+                '<a href="http://example.org/">out</a></p>'
+                '<p><img src="_files/park.jpg"/></p>'
+                '<a class="plugin includepage" href="Front_Page">Front Page</a>'
+                '<a class="plugin includetag" href="tags/park">List of pages'
+                ' tagged &quot;park&quot;</a>')
+        analysis = ContentAnalysis(html)
+        self.assertEqual(analysis.internal_links, {'Parks': 2})
+        self.assertEqual(analysis.included_pagenames, ['Front Page'])
+        self.assertEqual(analysis.included_tags, ['park'])
+        self.assertEqual(analysis.images, ['_files/park.jpg'])
+
+    def test_memoized_on_page(self):
+        p = Page(name='Front Page', content='<p><a href="Parks">parks</a></p>')
+        analysis = p.get_content_analysis()
+        self.assertTrue(p.get_content_analysis() is analysis)
+        p.content = '<p><a href="Trees">trees</a></p>'
+        self.assertEqual(p.get_content_analysis().internal_links, {'Trees': 1})
+
+
 class XSSTest(TestCase):
     """ Test for tricky attempts to inject scripts into a page
     Exploits adapted from http://ha.ckers.org/xss.html
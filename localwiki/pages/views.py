@@ -20,6 +20,7 @@ from django.utils.html import escape
 from django.utils.http import urlquote
 from django.utils.translation import ugettext as _
 from django.utils.translation import ugettext_lazy
+from django.utils.translation import get_language
 
 from follow.models import Follow
 
@@ -111,6 +112,14 @@ class PageDetailView(CacheMixin, BasePageDetailView):
         # Control characters and whitespace not allowed in memcached keys
         return '%s/%s/%s' % (urlconf, name_to_url(region), slugify(slug).replace(' ', '_'))
 
+    def render_to_response(self, context, **response_kwargs):
+        response = super(PageDetailView, self).render_to_response(
+            context, **response_kwargs)
+        # Lets AnonymousPageCacheMiddleware tell whether a cached response
+        # suits the language of a later request.
+        response['Content-Language'] = get_language()
+        return response
+
 
 class PageVersionDetailView(BasePageDetailView):
     template_name = 'pages/page_version_detail.html'
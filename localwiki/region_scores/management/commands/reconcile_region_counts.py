@@ -0,0 +1,36 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from regions.models import Region
+from region_scores.models import _reconcile_region_counts
+
+
+class Command(BaseCommand):
+    args = '[region_slug ...]'
+    help = ('Recounts the pages, files, maps and redirects of the given '
+            'regions, or of all regions if none are given.  All regions '
+            'are also recounted daily, by celerybeat')
+    option_list = BaseCommand.option_list + (
+        make_option('--async',
+            action='store_true',
+            dest='async',
+            default=False,
+            help='Queue a task per region instead of counting right away'),
+    )
+
+    def handle(self, *args, **options):
+        regions = Region.objects.all()
+        if args:
+            regions = regions.filter(slug__in=args)
+            missing = set(args) - set(regions.values_list('slug', flat=True))
+            if missing:
+                raise CommandError('Unknown region(s): %s' % ', '.join(sorted(missing)))
+
+        for region in regions.order_by('slug'):
+            if options['async']:
+                _reconcile_region_counts.delay(region.id)
+                self.stdout.write('Queued recount of "%s"\n' % region.slug)
+            else:
+                _reconcile_region_counts(region.id)
+                self.stdout.write('Recounted "%s"\n' % region.slug)
@@ -11,10 +11,20 @@ class Migration(DataMigration):
         # Note: Don't use "from appname.models import ModelName". 
         # Use orm.ModelName to refer to models in this application,
         # and orm['appname.ModelName'] for models in other applications.
-        from region_scores.models import _calculate_region_score
+        #
+        # The region counts table doesn't exist yet at this point, so we
+        # count here rather than using _calculate_region_score().
+        from pages.models import Page, PageFile
+        from maps.models import MapData
+        from region_scores.models import normalize_score
         for region in orm['regions.Region'].objects.all():
             print 'Calculating region score for', region.slug
-            _calculate_region_score(region.id)
+            num_pages = Page.objects.filter(region=region.id).count()
+            num_files = PageFile.objects.filter(region=region.id).count()
+            num_maps = MapData.objects.filter(region=region.id).count()
+            score = normalize_score(int(num_pages*1.5 + num_files*1.3 + num_maps))
+            orm.RegionScore.objects.filter(region=region).delete()
+            orm.RegionScore(region=region, score=score).save()
 
     def backwards(self, orm):
         "Write your backwards methods here."
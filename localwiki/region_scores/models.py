@@ -1,10 +1,16 @@
 from celery import shared_task
 
 from django.utils.translation import ugettext as _
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import post_init, post_save, post_delete
+from django.conf import settings
 
 from regions.models import Region
+from pages.models import Page, PageFile
+from maps.models import MapData
+from redirects.models import Redirect
+from localwiki.utils.tasks import debounce, debounce_started
 
 
 class RegionScore(models.Model):
@@ -19,6 +25,21 @@ class RegionScore(models.Model):
         return _("Region score %s: %s" % (self.region, self.score))
 
 
+class RegionCounts(models.Model):
+    """
+    Running counts of the things in a region, kept up to date as things are
+    created and deleted so that they don't need to be counted.
+    """
+    region = models.OneToOneField(Region, related_name='counts')
+    num_pages = models.IntegerField(default=0)
+    num_files = models.IntegerField(default=0)
+    num_maps = models.IntegerField(default=0)
+    num_redirects = models.IntegerField(default=0)
+
+    def __unicode__(self):
+        return _("Region counts %s") % self.region
+
+
 def normalize_score(score):
     if score > 10000:
        score = 10000
@@ -37,10 +58,100 @@ def normalize_score(score):
     return score
 
 
+COUNTED_MODELS = {
+    Page: 'num_pages',
+    PageFile: 'num_files',
+    MapData: 'num_maps',
+    Redirect: 'num_redirects',
+}
+
+def _counted_models():
+    return COUNTED_MODELS
+
+def count_region(region):
+    """
+    Returns:
+        An unsaved RegionCounts for `region`, counted from scratch.
+    """
+    counts = RegionCounts(region=region)
+    for model, field in _counted_models().iteritems():
+        setattr(counts, field, model.objects.filter(region=region).count())
+    return counts
+
+def get_region_counts(region):
+    """
+    Returns:
+        The RegionCounts for `region`.  If the region hasn't been counted
+        yet, it's counted on the spot and the counts are saved in the
+        background.
+    """
+    try:
+        return RegionCounts.objects.get(region=region)
+    except RegionCounts.DoesNotExist:
+        _reconcile_region_counts.delay(region.id)
+        return count_region(region)
+
+@shared_task(ignore_result=True)
+def _reconcile_region_counts(region_id):
+    """
+    Recounts the region from scratch, fixing any drift in its counts.
+    """
+    region = Region.objects.filter(id=region_id)
+    if region.exists():
+        region = region[0]
+    else:
+        return
+
+    RegionCounts.objects.get_or_create(region=region)
+    with transaction.commit_on_success():
+        # The row is locked while counting, so increments made in the
+        # meantime wait and are applied on top of the recount rather than
+        # being overwritten by it.
+        counts = RegionCounts.objects.select_for_update().filter(region=region)
+        list(counts)
+        fresh = count_region(region)
+        counts.update(**dict((field, getattr(fresh, field))
+                             for field in _counted_models().itervalues()))
+
+@shared_task(ignore_result=True)
+def reconcile_all_region_counts():
+    """
+    Queues a recount of every region.  Run periodically (see
+    CELERYBEAT_SCHEDULE) to correct any drift in the running counts.
+    """
+    for region_id in Region.objects.values_list('id', flat=True):
+        _reconcile_region_counts.delay(region_id)
+
+def _update_region_counts(sender, region_id, delta):
+    field = _counted_models().get(sender)
+    if not field or not region_id:
+        return
+    updated = RegionCounts.objects.filter(region=region_id).update(
+        **{field: F(field) + delta})
+    if not updated:
+        # Not counted yet.
+        _reconcile_region_counts.delay(region_id)
+
+def _region_counts_post_init(sender, instance, **kws):
+    # Remembered so that moves to another region can be counted.
+    instance._counted_region_id = instance.__dict__.get('region_id')
+
+def _region_counts_post_save(sender, instance, created, raw, **kws):
+    old_region_id = getattr(instance, '_counted_region_id', None)
+    instance._counted_region_id = instance.region_id
+    if created:
+        _update_region_counts(sender, instance.region_id, 1)
+    elif old_region_id and old_region_id != instance.region_id:
+        # Moved, e.g. by regions.utils.move_to_region().
+        _update_region_counts(sender, old_region_id, -1)
+        _update_region_counts(sender, instance.region_id, 1)
+
+def _region_counts_post_delete(sender, instance, **kws):
+    _update_region_counts(sender, instance.region_id, -1)
+
 @shared_task(ignore_result=True)
 def _calculate_region_score(region_id):
-    from maps.models import MapData
-    from pages.models import Page, PageFile
+    debounce_started(_calculate_region_score, region_id)
 
     region = Region.objects.filter(id=region_id)
     if region.exists():
@@ -48,11 +159,8 @@ def _calculate_region_score(region_id):
     else:
         return
 
-    num_pages = Page.objects.filter(region=region).count()
-    num_files = PageFile.objects.filter(region=region).count()
-    num_maps = MapData.objects.filter(region=region).count()
-
-    score = int(num_pages*1.5 + num_files*1.3 + num_maps)
+    counts = get_region_counts(region)
+    score = int(counts.num_pages*1.5 + counts.num_files*1.3 + counts.num_maps)
     score = normalize_score(score)
 
     score_obj = RegionScore.objects.filter(region=region)
@@ -64,11 +172,13 @@ def _calculate_region_score(region_id):
     score_obj.save()
 
 def _handle_region_score(sender, instance, created, raw, **kws):
-    from pages.models import Page, PageFile
-    from maps.models import MapData
     if raw:
         return
-    if sender in [Page, MapData, PageFile]:
-        _calculate_region_score.delay(instance.region.id)
+    debounce(_calculate_region_score, settings.SCORE_RECALCULATION_DELAY, instance.region_id)
 
-post_save.connect(_handle_region_score)
+for model in (Page, MapData, PageFile):
+    post_save.connect(_handle_region_score, sender=model)
+for model in COUNTED_MODELS:
+    post_init.connect(_region_counts_post_init, sender=model)
+    post_save.connect(_region_counts_post_save, sender=model)
+    post_delete.connect(_region_counts_post_delete, sender=model)
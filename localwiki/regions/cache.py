@@ -0,0 +1,109 @@
+import copy
+import time
+import threading
+
+from django.core.cache import cache
+
+from .models import Region
+
+REGIONS_VERSION_KEY = 'regions_version'
+
+# Unknown slugs and hosts are remembered too, so the registry is emptied
+# if it grows past this many entries.
+REGION_REGISTRY_MAX_ENTRIES = 5000
+
+# Seconds a lookup is kept in the registry.  The version is bumped before
+# the change commits, so a lookup made in between can still see the old
+# data under the new version; these bound how long that sticks.  Regions
+# that weren't found are kept for less time, as a region that was being
+# created would otherwise keep 404ing.
+REGION_REGISTRY_TIMEOUT = 60
+REGION_REGISTRY_MISSING_TIMEOUT = 5
+
+_registry = {'version': None, 'entries': {}}
+_registry_lock = threading.Lock()
+
+
+def get_regions_version():
+    """
+    Returns:
+        A token that changes whenever a Region or RegionSettings is saved
+        or deleted.
+    """
+    version = cache.get(REGIONS_VERSION_KEY)
+    if version is None:
+        version = '%f' % time.time()
+        cache.add(REGIONS_VERSION_KEY, version)
+    return version
+
+
+def bump_regions_version():
+    cache.set(REGIONS_VERSION_KEY, '%f' % time.time())
+    with _registry_lock:
+        _registry['version'] = None
+        _registry['entries'] = {}
+
+
+def _current_entries():
+    version = get_regions_version()
+    with _registry_lock:
+        if (_registry['version'] != version or
+                len(_registry['entries']) > REGION_REGISTRY_MAX_ENTRIES):
+            _registry['version'] = version
+            # Replaced rather than cleared, as requests in progress may
+            # still hold the old one.
+            _registry['entries'] = {}
+        return _registry['entries']
+
+
+def _request_memo(request):
+    """
+    Returns:
+        The regions looked up so far while handling `request`.  The
+        registry version is only checked once per request.
+    """
+    if request is None:
+        return {'entries': _current_entries(), 'found': {}}
+    memo = getattr(request, '_regions', None)
+    if memo is None:
+        memo = {'entries': _current_entries(), 'found': {}}
+        request._regions = memo
+    return memo
+
+
+def _lookup(key, request, **filters):
+    memo = _request_memo(request)
+    if key in memo['found']:
+        return memo['found'][key]
+
+    entries = memo['entries']
+    now = time.time()
+    if key not in entries or entries[key][1] < now:
+        regions = Region.objects.filter(**filters).select_related('regionsettings')
+        if regions:
+            entries[key] = (regions[0], now + REGION_REGISTRY_TIMEOUT)
+        else:
+            entries[key] = (None, now + REGION_REGISTRY_MISSING_TIMEOUT)
+    # Each request gets its own copy, settings included, so that nothing
+    # it sets on the region leaks into other requests.
+    region = copy.deepcopy(entries[key][0])
+    memo['found'][key] = region
+    return region
+
+
+def get_region_by_slug(slug, request=None):
+    """
+    Returns:
+        The Region with `slug`, with its RegionSettings, or None.  Looked
+        up in a per-process registry, and memoized on `request` if given.
+    """
+    return _lookup(('slug', slug), request, slug=slug)
+
+
+def get_region_by_domain(domain, request=None):
+    """
+    Returns:
+        The Region whose RegionSettings has `domain`, or None.  Looked up
+        like get_region_by_slug().
+    """
+    return _lookup(('domain', domain), request, regionsettings__domain=domain)
@@ -78,10 +78,10 @@ class Region(models.Model):
 
     @property
     def is_empty(self):
-        from pages.models import Page
+        from region_scores.models import get_region_counts
         from initial_data import NUM_DEFAULT_PAGES
 
-        if Page.objects.filter(region=self).count() == NUM_DEFAULT_PAGES:
+        if get_region_counts(self).num_pages == NUM_DEFAULT_PAGES:
             return True
         return False
 
@@ -1,9 +1,11 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 
 from frontpage.models import FrontPage
+from users.signals import permissions_changed
 
-from .models import Region, RegionSettings
+from .models import Region, RegionSettings, BannedFromRegion
 from .map_utils import get_zoom_for_extent
+from .cache import bump_regions_version
 
 
 def setup_region_settings(sender, instance, created, raw, **kwargs):
@@ -37,3 +39,16 @@ def create_front_page(sender, instance, created, raw, **kwargs):
 
 post_save.connect(setup_region_settings, sender=Region)
 post_save.connect(create_front_page, sender=Region)
+
+
+def clear_region_registry(sender, instance, **kwargs):
+    bump_regions_version()
+
+for model in (Region, RegionSettings):
+    post_save.connect(clear_region_registry, sender=model)
+    post_delete.connect(clear_region_registry, sender=model)
+
+# Region admins and bans decide permissions within the region.
+m2m_changed.connect(permissions_changed, sender=RegionSettings.admins.through)
+m2m_changed.connect(permissions_changed, sender=BannedFromRegion.users.through)
+post_delete.connect(permissions_changed, sender=BannedFromRegion)
@@ -2,14 +2,18 @@ from django.test import TestCase
 from django.core.files.base import ContentFile
 from django.contrib.gis.geos import GEOSGeometry
 from django.contrib.auth.models import User
+from django.core.cache import get_cache
+from django.test.client import RequestFactory
 
 from regions.models import Region, RegionSettings, BannedFromRegion
 from pages.models import Page, PageFile
 from maps.models import MapData
 from redirects.models import Redirect
 from tags.models import Tag, PageTagSet
+from region_scores.models import RegionCounts, _reconcile_region_counts
 
 from .. utils import move_to_region
+from .. import cache as region_cache
 
 
 class MoveRegionTests(TestCase):
@@ -42,6 +46,19 @@ class MoveRegionTests(TestCase):
         p = Page.objects.filter(region=self.sf, name="Page A")[0]
         self.assertEqual(p.content, "<p>Hello, world in SF.</p>")
 
+    def test_move_updates_counts(self):
+        p = Page(region=self.sf, name="Counted", content="<p>Counted.</p>")
+        p.save()
+        for region in (self.sf, self.oak):
+            _reconcile_region_counts(region.id)
+
+        move_to_region(self.oak, pages=[p])
+
+        self.assertEqual(RegionCounts.objects.get(region=self.sf).num_pages,
+            Page.objects.filter(region=self.sf).count())
+        self.assertEqual(RegionCounts.objects.get(region=self.oak).num_pages,
+            Page.objects.filter(region=self.oak).count())
+
     def test_move_with_fks(self):
         ###########################################################
         # Moving should carry along files and FK'ed items that
@@ -207,3 +224,69 @@ class RegionPermissionTests(TestCase):
 
         redirect = Redirect(source="testsource", destination=p, region=self.sf)
         self.assertFalse(self.marina.has_perm('redirects.change_redirect', redirect))
+
+
+class RegionCacheTest(TestCase):
+    def setUp(self):
+        self.old_cache = region_cache.cache
+        region_cache.cache = get_cache(
+            'django.core.cache.backends.locmem.LocMemCache')
+        region_cache.cache.clear()
+
+        self.sf = Region(full_name="San Francisco", slug="sf")
+        self.sf.save()
+        self.sf.regionsettings.domain = 'sf.example.org'
+        self.sf.regionsettings.save()
+
+    def tearDown(self):
+        region_cache.cache = self.old_cache
+
+    def test_registry(self):
+        self.assertEqual(region_cache.get_region_by_slug('sf').pk, self.sf.pk)
+        with self.assertNumQueries(0):
+            region = region_cache.get_region_by_slug('sf')
+            self.assertEqual(region.regionsettings.domain, 'sf.example.org')
+        self.assertEqual(
+            region_cache.get_region_by_domain('sf.example.org').pk, self.sf.pk)
+        self.assertEqual(region_cache.get_region_by_slug('oak'), None)
+
+        # Saving a region empties the registry.
+        oak = Region(full_name="Oakland", slug="oak")
+        oak.save()
+        self.assertEqual(region_cache.get_region_by_slug('oak').pk, oak.pk)
+        self.sf.regionsettings.domain = 'sanfrancisco.example.org'
+        self.sf.regionsettings.save()
+        self.assertEqual(region_cache.get_region_by_domain('sf.example.org'), None)
+
+    def test_entries_expire(self):
+        old_timeout = region_cache.REGION_REGISTRY_MISSING_TIMEOUT
+        region_cache.REGION_REGISTRY_MISSING_TIMEOUT = -1
+        try:
+            region_cache.get_region_by_slug('sf')
+            self.assertEqual(region_cache.get_region_by_slug('oak'), None)
+            # Looked up again, as a region being created might have been
+            # missed.
+            with self.assertNumQueries(1):
+                self.assertEqual(region_cache.get_region_by_slug('oak'), None)
+            with self.assertNumQueries(0):
+                region_cache.get_region_by_slug('sf')
+        finally:
+            region_cache.REGION_REGISTRY_MISSING_TIMEOUT = old_timeout
+
+    def test_copies_not_shared(self):
+        first = region_cache.get_region_by_slug('sf')
+        first.regionsettings.domain = 'changed.example.org'
+        second = region_cache.get_region_by_slug('sf')
+        self.assertEqual(second.regionsettings.domain, 'sf.example.org')
+
+    def test_memoized_per_request(self):
+        request = RequestFactory().get('/sf/')
+        region = region_cache.get_region_by_slug('sf', request)
+        self.sf.full_name = "San Francisco, CA"
+        self.sf.save()
+        # The request keeps seeing the region it started with.
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                region_cache.get_region_by_slug('sf', request) is region)
+        self.assertEqual(region_cache.get_region_by_slug('sf').full_name,
+                         "San Francisco, CA")
@@ -5,6 +5,7 @@ from pages.models import Page, PageFile
 from redirects.models import Redirect
 from tags.models import PageTagSet
 from maps.models import MapData
+from pages.cache import remove_from_page_slug_index
 
 
 def update_region_for_instance(m, region):
@@ -57,7 +58,7 @@ def move_to_region(region, pages=None, redirects=None):
     redirects = redirects or []
 
     for p in pages:
-        if Page(slug=p.slug, region=region).exists():
+        if Page(slug=p.slug, region=region).exists(exact=True):
             # Page already exists in the new region, so let's
             # skip moving it.
             continue
@@ -72,6 +73,7 @@ def move_to_region(region, pages=None, redirects=None):
 
         old_region = p.region
         update_region_for_instance(p, region)
+        remove_from_page_slug_index(p.slug, old_region)
 
         for _, rel_obj in rel_objs:
             if isinstance(rel_obj, list):
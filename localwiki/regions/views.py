@@ -14,7 +14,7 @@ from django.http import Http404, HttpResponseNotFound, HttpResponseRedirect
 from django.views.generic.edit import CreateView, FormView, UpdateView
 from django.http import HttpResponseForbidden, HttpResponse
 from django.contrib import messages
-from django.shortcuts import get_object_or_404, render
+from django.shortcuts import render
 from django.contrib.gis.geos import GEOSGeometry, Polygon, MultiPolygon
 from django.template.loader import render_to_string
 from django.template.context import RequestContext
@@ -30,6 +30,7 @@ from localwiki.utils.urlresolvers import reverse
 
 from .models import Region, RegionSettings, BannedFromRegion, slugify
 from .forms import RegionForm, RegionSettingsForm, AdminSetForm, BannedSetForm
+from .cache import get_region_by_slug, get_region_by_domain
 
 
 def region_404_response(request, slug):
@@ -106,21 +107,18 @@ class RegionMixin(object):
         if kwargs is None:
             kwargs = self.kwargs
         if request is None:
-            request = self.request
+            request = getattr(self, 'request', None)
 
+        # Looked up once per request (see regions.cache).
         if kwargs.get('region'):
             region_slug = kwargs.get('region')
-            r = get_object_or_404(Region, slug=slugify(region_slug))
+            r = get_region_by_slug(slugify(region_slug), request)
+            if r is None:
+                raise Http404(_("No region matches the given query."))
         else:
-            if self.region_required:
-                rs = get_object_or_404(RegionSettings, domain=request.META['HTTP_HOST'])
-                r = rs.region
-            else:
-                if RegionSettings.objects.filter(domain=request.META['HTTP_HOST']).exists():
-                    rs = get_object_or_404(RegionSettings, domain=request.META['HTTP_HOST'])
-                    r = rs.region
-                else:
-                    r = None
+            r = get_region_by_domain(request.META['HTTP_HOST'], request)
+            if r is None and self.region_required:
+                raise Http404(_("No region matches the given query."))
 
         if self.region_required and not r.is_active:
             raise Http404(_("Region '%s' was deleted." % r.slug))
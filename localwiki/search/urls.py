@@ -9,6 +9,7 @@ from haystack.views import SearchView
 from haystack.forms import SearchForm as DefaultSearchForm
 
 from pages.models import Page, slugify
+from pages.cache import page_slug_exists
 from maps.models import MapData
 from maps.widgets import InfoMap, map_options_for_region
 from regions.views import RegionMixin
@@ -67,8 +68,8 @@ class CreatePageSearchView(WithMapSearchView, RegionMixin):
 
     def extra_context(self):
         context = super(CreatePageSearchView, self).extra_context()
-        context['allow_page_creation'] = not Page.objects.filter(
-            slug=slugify(self.query), region=self.region).exists()
+        context['allow_page_creation'] = not page_slug_exists(
+            slugify(self.query), self.region)
         context['region'] = self.region
         return context
 
@@ -1,9 +1,90 @@
+import time
+import hashlib
+import threading
+
 from django.contrib.auth.models import User
 from guardian.backends import ObjectPermissionBackend
 from django.contrib.auth.backends import ModelBackend
 from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import smart_str
 from guardian.models import UserObjectPermission, GroupObjectPermission
 
+PERMISSION_CACHE_TIMEOUT = 60 * 60 * 24
+_PERMISSIONS_VERSION_KEY = 'permissions_version'
+
+# Bumped whenever permissions change in this process, so that decisions
+# memoized on a user during a request don't outlive the change.
+_local_permissions_version = 0
+
+# Set when permissions changed while handling the current request.
+_pending = threading.local()
+
+
+def get_permissions_version():
+    """
+    Returns:
+        A token that changes whenever object permissions, group
+        memberships, ban lists or region admins change.  Cached permission
+        decisions are stored under it.
+    """
+    version = cache.get(_PERMISSIONS_VERSION_KEY)
+    if version is None:
+        version = '%f' % time.time()
+        cache.add(_PERMISSIONS_VERSION_KEY, version)
+    return version
+
+
+def invalidate_permissions():
+    """
+    Throws away every cached permission decision.
+
+    Changes are usually made inside the request's transaction, so other
+    requests can still see the old permissions -- and cache decisions
+    based on them under the new version -- until it commits.  So the
+    version is bumped again once the request has finished (see
+    invalidate_permissions_after_request()).
+    """
+    global _local_permissions_version
+    _local_permissions_version += 1
+    cache.set(_PERMISSIONS_VERSION_KEY, '%f' % time.time())
+    _pending.changed = True
+
+
+def invalidate_permissions_after_request(sender, **kwargs):
+    """
+    Connected to request_finished, which is sent after the response
+    middleware, and so TransactionMiddleware's commit, has run.
+    """
+    if getattr(_pending, 'changed', False):
+        _pending.changed = False
+        cache.set(_PERMISSIONS_VERSION_KEY, '%f' % time.time())
+
+
+def _decision_key(user_obj, perm, obj):
+    if user_obj.is_authenticated():
+        user_key = '%s:%d:%d' % (user_obj.pk, user_obj.is_active, user_obj.is_superuser)
+    else:
+        user_key = 'anonymous'
+    obj_key = ''
+    if obj is not None:
+        obj_key = '%s.%s:%s:%s' % (obj._meta.app_label, obj._meta.object_name,
+            obj.pk, getattr(obj, 'region_id', ''))
+    return '%s:%s:%s' % (user_key, perm, obj_key)
+
+
+def _request_decisions(user_obj):
+    """
+    Returns:
+        The permission decisions memoized on `user_obj`, which lives as
+        long as the request does.
+    """
+    memo = getattr(user_obj, '_permission_decisions', None)
+    if memo is None or memo[0] != _local_permissions_version:
+        memo = (_local_permissions_version, {})
+        user_obj._permission_decisions = memo
+    return memo[1]
+
 
 class CaseInsensitiveModelBackend(object):
     supports_object_permissions = True
@@ -83,15 +164,42 @@ class RestrictiveBackend(object):
         if name in settings.USER_REGION_ADMIN_CAN_MANAGE:
             region = obj.region
             if hasattr(region, 'bannedfromregion'):
-                return user_obj in region.bannedfromregion.users.all()
+                return region.bannedfromregion.users.filter(pk=user_obj.pk).exists()
         return False
 
     def has_perm(self, user_obj, perm, obj=None):
+        """
+        Decisions are memoized on `user_obj` for the rest of the request
+        and cached across requests until permissions next change.
+        """
+        if obj is not None and obj.pk is None:
+            # Nothing to key an unsaved object's decisions on.
+            return self._has_perm(user_obj, perm, obj)
+
+        key = _decision_key(user_obj, perm, obj)
+        decisions = _request_decisions(user_obj)
+        if key in decisions:
+            return decisions[key]
+
+        cache_key = 'permission:%s:%s' % (get_permissions_version(),
+            hashlib.md5(smart_str(key)).hexdigest())
+        decision = cache.get(cache_key)
+        if decision is None:
+            decision = self._has_perm(user_obj, perm, obj)
+            cache.set(cache_key, decision, PERMISSION_CACHE_TIMEOUT)
+        decisions[key] = decision
+        return decision
+
+    def _has_perm(self, user_obj, perm, obj=None):
         default_has_perm = False
         if user_obj.is_authenticated():
             default_has_perm = LOGGED_IN_HAS_PERM
         else:
-            user_obj = User.objects.get(pk=ANONYMOUS_USER_ID)
+            anonymous_user = getattr(user_obj, '_anonymous_user', None)
+            if anonymous_user is None:
+                anonymous_user = User.objects.get(pk=ANONYMOUS_USER_ID)
+                user_obj._anonymous_user = anonymous_user
+            user_obj = anonymous_user
         if not user_obj.is_active:
             return False
         if user_obj.is_superuser:
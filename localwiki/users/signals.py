@@ -1,10 +1,13 @@
-from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_delete
+from django.contrib.auth.models import User, Group
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.core.signals import request_finished
 from django.conf import settings
 
+from guardian.models import UserObjectPermission, GroupObjectPermission
 from south.models import MigrationHistory
 
 from models import UserProfile
+from backends import invalidate_permissions, invalidate_permissions_after_request
 
 
 def create_user_profile(sender, instance, created, raw, **kwargs):
@@ -31,4 +34,21 @@ def delete_user_profile(sender, instance, **kwargs):
 
 # Delete UserProfile when User is deleted.  We need to do this explicitly
 # because we're monkeypatching the User model (for now).
-pre_delete.connect(delete_user_profile, sender=User) 
+pre_delete.connect(delete_user_profile, sender=User)
+
+
+def permissions_changed(sender, **kwargs):
+    if kwargs.get('raw'):
+        return
+    if 'action' in kwargs and not kwargs['action'].startswith('post_'):
+        # Only once the m2m change has been made.
+        return
+    invalidate_permissions()
+
+for model in (UserObjectPermission, GroupObjectPermission, Group):
+    post_save.connect(permissions_changed, sender=model)
+    post_delete.connect(permissions_changed, sender=model)
+m2m_changed.connect(permissions_changed, sender=User.groups.through)
+m2m_changed.connect(permissions_changed, sender=User.user_permissions.through)
+m2m_changed.connect(permissions_changed, sender=Group.permissions.through)
+request_finished.connect(invalidate_permissions_after_request)
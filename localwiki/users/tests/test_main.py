@@ -1,11 +1,15 @@
 from django.test import TestCase
 from django.conf import settings
+from django.core.cache import get_cache
+from django.core.signals import request_finished
 
 from utils import TestSettingsManager
 from models import *
 from django.contrib.auth.models import User, Permission, Group
 from guardian.shortcuts import assign_perm
 
+from users import backends
+
 mgr = TestSettingsManager()
 INSTALLED_APPS = list(settings.INSTALLED_APPS)
 INSTALLED_APPS.append('users.tests')
@@ -110,3 +114,42 @@ class RestrictiveBackendTest(TestCase):
         self.assertTrue(self.user.has_perm('tests.change_thing', t))
         self.assertFalse(self.user.has_perm('tests.add_thing', t))
         self.assertFalse(self.user.has_perm('tests.delete_thing', t))
+
+    def test_decisions_memoized(self):
+        t = Thing(name='Test thing')
+        t.save()
+        assign_perm('change_thing', self.user, t)
+
+        self.assertTrue(self.user.has_perm('tests.change_thing', t))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.user.has_perm('tests.change_thing', t))
+
+        # Changing the object's permissions is noticed right away
+        assign_perm('delete_thing', self.user, t)
+        self.assertTrue(self.user.has_perm('tests.delete_thing', t))
+        self.assertFalse(self.user.has_perm('tests.add_thing', t))
+
+    def test_decision_made_before_commit(self):
+        old_cache = backends.cache
+        backends.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        try:
+            banned = Group.objects.get(name=settings.USERS_BANNED_GROUP)
+            t = Thing(name='Test thing')
+            t.save()
+            assign_perm('change_thing', self.user, t)
+
+            # The ban's signal has bumped the version, but another request
+            # can't see the uncommitted ban yet and caches its decision.
+            backends.invalidate_permissions()
+            other_request_user = User.objects.get(pk=self.user.pk)
+            self.assertTrue(other_request_user.has_perm('tests.change_thing', t))
+
+            # The ban commits (without another signal) as the banning
+            # request finishes.
+            User.groups.through.objects.create(user=self.user, group=banned)
+            request_finished.send(sender=self.__class__)
+
+            later_request_user = User.objects.get(pk=self.user.pk)
+            self.assertFalse(later_request_user.has_perm('tests.change_thing', t))
+        finally:
+            backends.cache = old_cache
@@ -1,3 +1,4 @@
+import heapq
 import itertools
 import threading
 from collections import Counter, defaultdict
@@ -79,6 +80,68 @@ def take_n_from(lists_with_indexes, n, merge_key=None):
     return (items, indexes, has_more_left)
 
 
+class _Descending(object):
+    """
+    Wraps a sort key so that larger keys sort first.
+    """
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __ne__(self, other):
+        return self.key != other.key
+
+    def __lt__(self, other):
+        return self.key > other.key
+
+
+def take_n_after(lists, n, merge_keys):
+    """
+    Keyset counterpart to take_n_from().  Rather than slicing each list at
+    an offset, each list is expected to hold only the items after its
+    cursor, already sorted newest-first -- e.g. a queryset filtered on its
+    cursor, ordered and sliced to `n + 1` -- so that every list is fetched
+    exactly once, however deep we are into the results.
+
+    Args:
+        lists: The sorted (descending) lists to merge.
+
+        n: Number of items to take from the merged lists.
+
+        merge_keys: One callable per list, returning the key the list is
+            sorted by, e.g. lambda x: (x.history_date, x.history_id).
+
+    Returns:
+        A tuple, (items, cursors, has_more_left), where `items` is the n
+        largest elements across the input lists, in descending order, and
+        `cursors` holds, for each input list, the key of the last item
+        taken from it (or None if no items were taken from it).
+        `has_more_left` indicates whether there are more elements left to
+        grab beyond those returned.
+    """
+    lists = [list(l) for l in lists]
+    has_more_left = sum(len(l) for l in lists) > n
+
+    def _stream(list_num, l, merge_key):
+        for item in l:
+            yield (_Descending(merge_key(item)), list_num, item)
+
+    streams = [_stream(list_num, l, merge_keys[list_num])
+               for (list_num, l) in enumerate(lists)]
+
+    items = []
+    cursors = [None] * len(lists)
+    for (key, list_num, item) in itertools.islice(heapq.merge(*streams), n):
+        items.append(item)
+        cursors[list_num] = key.key
+
+    return (items, cursors, has_more_left)
+
+
 def get_base_uri():
     from .middleware import _threadlocal
     return getattr(_threadlocal, 'base_uri', '')
@@ -0,0 +1,28 @@
+from django.core.cache import cache
+
+# How long past its countdown a queued run still counts as pending.  Covers
+# the time a busy worker may take to get to the task.
+DEBOUNCE_GRACE_PERIOD = 60 * 5
+
+
+def _pending_key(task, args):
+    return 'debounce:%s:%s' % (task.name, ':'.join([unicode(a) for a in args]))
+
+def debounce(task, delay, *args):
+    """
+    Queues `task` to run with `args` in `delay` seconds, unless a run with
+    the same arguments is already queued and hasn't started yet -- in
+    which case that run will see whatever changed, so nothing is queued.
+
+    The task must call debounce_started() with the same arguments when it
+    starts running.
+    """
+    if cache.add(_pending_key(task, args), True, delay + DEBOUNCE_GRACE_PERIOD):
+        task.apply_async(args=args, countdown=delay)
+
+def debounce_started(task, *args):
+    """
+    Marks the queued run of `task` with `args` as started, so changes from
+    here on queue a new run.
+    """
+    cache.delete(_pending_key(task, args))
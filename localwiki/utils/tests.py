@@ -8,10 +8,12 @@ from django.test import TestCase
 from django.test.client import RequestFactory
 from django.test.utils import override_settings
 from django.contrib.auth.models import User
+from django.core.cache import get_cache
 
 from users.models import UserProfile
 
-from . import take_n_from
+from . import take_n_from, take_n_after
+from . import tasks
 
 
 class TakeNFromTests(TestCase):
@@ -50,6 +52,45 @@ class TakeNFromTests(TestCase):
         self.assertEqual(len(items), len(all_sorted))
 
 
+class TakeNAfterTests(TestCase):
+    def setUp(self):
+        self.pages = sorted([(3, 1), (5, 2), (5, 7), (9, 4), (1, 9)], reverse=True)
+        self.maps = sorted([(5, 3), (8, 1), (2, 2)], reverse=True)
+        self.files = []
+        self.all_sorted = sorted(self.pages + self.maps + self.files, reverse=True)
+        self.keys = [(lambda x: x)] * 3
+
+    def _after(self, l, cursor):
+        return [x for x in l if cursor is None or x < cursor]
+
+    def test_basic_take(self):
+        ls = (self.pages, self.maps, self.files)
+        items, cursors, more_left = take_n_after(ls, 3, self.keys)
+        self.assertEqual(items, self.all_sorted[:3])
+        self.assertEqual(cursors, [(5, 7), (8, 1), None])
+        self.assertTrue(more_left)
+
+    def test_take_pages(self):
+        # Walking the cursors visits each item exactly once, in order.
+        for n in range(1, len(self.all_sorted) + 1):
+            cursors = [None, None, None]
+            seen = []
+            more_left = True
+            while more_left:
+                ls = [self._after(l, c)[:n + 1] for (l, c) in
+                      zip((self.pages, self.maps, self.files), cursors)]
+                items, new_cursors, more_left = take_n_after(ls, n, self.keys)
+                cursors = [new or old for (new, old) in zip(new_cursors, cursors)]
+                seen.extend(items)
+            self.assertEqual(seen, self.all_sorted)
+
+    def test_take_more_than_left(self):
+        ls = (self.pages, self.maps, self.files)
+        items, cursors, more_left = take_n_after(ls, len(self.all_sorted) + 1, self.keys)
+        self.assertEqual(items, self.all_sorted)
+        self.assertFalse(more_left)
+
+
 class CanonicalURLTests(TestCase):
     def has_canonical_url(self, url, request, response):
         from phased.middleware import PhasedRenderMiddleware
@@ -525,3 +566,33 @@ class CanonicalURLTests(TestCase):
             response.render()
             # No canonical URL emitted
             self.assertFalse(self.has_canonical_url(canonical_url, request, response))
+
+
+class DebounceTests(TestCase):
+    class FakeTask(object):
+        name = 'fake_task'
+
+        def __init__(self):
+            self.queued = []
+
+        def apply_async(self, args=None, countdown=None):
+            self.queued.append((args, countdown))
+
+    def setUp(self):
+        self.old_cache = tasks.cache
+        tasks.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+
+    def tearDown(self):
+        tasks.cache = self.old_cache
+
+    def test_coalesces_until_started(self):
+        task = self.FakeTask()
+        tasks.debounce(task, 30, 1)
+        tasks.debounce(task, 30, 1)
+        tasks.debounce(task, 30, 2)
+        self.assertEqual(task.queued, [((1,), 30), ((2,), 30)])
+
+        tasks.debounce_started(task, 1)
+        tasks.debounce(task, 30, 1)
+        tasks.debounce(task, 30, 2)
+        self.assertEqual(task.queued, [((1,), 30), ((2,), 30), ((1,), 30)])
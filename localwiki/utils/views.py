@@ -1,4 +1,5 @@
 import time
+from datetime import datetime
 
 from django.utils.decorators import classonlymethod
 from django.conf import settings
@@ -18,10 +19,11 @@ from django.utils.cache import get_max_age
 from django.http import HttpRequest
 from django.template.loader import render_to_string
 from django.template.context import RequestContext
+from django.db.models import Q
 
 from versionutils.versioning.views import RevertView, DeleteView
 
-from . import take_n_from
+from . import take_n_from, take_n_after
 
 # 29 days, effectively infinite in cache years
 # XXX NOTE: For some reason, the memcached client we're using
@@ -77,6 +79,13 @@ class CacheMixin(object):
             else:
                 cache.set(key, response, self.cache_timeout)
 
+        return self.patch_cached_response(request, response)
+
+    def patch_cached_response(self, request, response):
+        """
+        Sets the caching headers on a response, whether it was just
+        rendered or came out of the cache.
+        """
         if self._should_cache(request, response):
             # Mark to keep around in Varnish and other cache layers
             if self.cache_keep_forever:
@@ -94,6 +103,7 @@ class CacheMixin(object):
     @classmethod
     def get_region_slug_param(*args, **kwargs):
         from regions.models import RegionSettings
+        from regions.cache import get_region_by_domain
 
         if kwargs.get('region'):
             return kwargs.get('region')
@@ -102,7 +112,10 @@ class CacheMixin(object):
             raise KeyError("Need either `request` or a `region` parameter.")
 
         request = kwargs.get('request')
-        return RegionSettings.objects.get(domain=request.META['HTTP_HOST']).region.slug
+        region = get_region_by_domain(request.META['HTTP_HOST'], request)
+        if region is None:
+            raise RegionSettings.DoesNotExist
+        return region.slug
 
 
 class Custom404Mixin(object):
@@ -258,6 +271,33 @@ class GetCSRFCookieView(TemplateView):
     template_name = 'utils/get_csrf_cookie.html'
 
 
+CURSOR_DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def _cursor_merge_key(date_field, id_field):
+    return (lambda x: (getattr(x, date_field), getattr(x, id_field)))
+
+
+def _format_cursor(cursor):
+    date, pk = cursor
+    return '%s.%s' % (date.strftime(CURSOR_DATE_FORMAT), pk)
+
+
+def _parse_cursor(value):
+    """
+    Returns:
+        The (date, id) tuple encoded in `value` by _format_cursor(), or
+        None if `value` is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        date, pk = value.split('.')
+        return (datetime.strptime(date, CURSOR_DATE_FORMAT), int(pk))
+    except ValueError:
+        return None
+
+
 class MultipleTypesPaginatedView(TemplateView):
     items_per_page = 50
     context_object_name = 'objects'
@@ -283,10 +323,29 @@ class MultipleTypesPaginatedView(TemplateView):
         """
         return None
 
+    def get_pagination_cursor_fields(self, qs):
+        """
+        Args:
+            qs: The queryset we want to page through.
+
+        Returns:
+            A tuple of (date field, id field) to page through `qs` by,
+            newest first, using a cursor rather than an offset, e.g.
+            ('history_date', 'history_id').  Each page then costs a single
+            query per queryset, however far along we are.  Default: None,
+            which pages by offset using the merge key.
+        """
+        return None
+
     def get_pagination_objects(self):
+        object_lists = self.get_object_lists()
+        cursor_fields = [self.get_pagination_cursor_fields(qs) for qs in object_lists]
+        if object_lists and all(cursor_fields):
+            return self.get_cursor_pagination_objects(object_lists, cursor_fields)
+
         items_with_indexes = []
         id_to_page_key = {}
-        for (_id, qs) in enumerate(self.get_object_lists()):
+        for (_id, qs) in enumerate(object_lists):
             pagination_key = self.get_pagination_key(qs)
             page = int(self.request.GET.get(pagination_key, 0))
             items_with_indexes.append((qs, page))
@@ -305,6 +364,37 @@ class MultipleTypesPaginatedView(TemplateView):
 
         return items
 
+    def get_cursor_pagination_objects(self, object_lists, cursor_fields):
+        lists = []
+        merge_keys = []
+        start_cursors = []
+        for (qs, (date_field, id_field)) in zip(object_lists, cursor_fields):
+            cursor = _parse_cursor(self.request.GET.get(self.get_pagination_key(qs)))
+            qs = qs.order_by('-%s' % date_field, '-%s' % id_field)
+            if cursor:
+                date, pk = cursor
+                qs = qs.filter(
+                    Q(**{'%s__lt' % date_field: date}) |
+                    Q(**{date_field: date, '%s__lt' % id_field: pk})
+                )
+            # Grab one more than we need so we know if there's more left.
+            lists.append(qs[:self.items_per_page + 1])
+            merge_keys.append(_cursor_merge_key(date_field, id_field))
+            start_cursors.append(cursor)
+
+        items, cursors, has_more_left = take_n_after(
+            lists, self.items_per_page, merge_keys)
+        self.has_more_left = has_more_left
+
+        self.current_indexes = {}
+        for (qs, start_cursor, cursor) in zip(object_lists, start_cursors, cursors):
+            cursor = cursor or start_cursor
+            # Lists we haven't taken anything from yet start at the top.
+            if cursor:
+                self.current_indexes[self.get_pagination_key(qs)] = _format_cursor(cursor)
+
+        return items
+
     def get_context_data(self, *args, **kwargs):
         c = super(MultipleTypesPaginatedView, self).get_context_data(*args, **kwargs)
 
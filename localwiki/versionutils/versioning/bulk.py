@@ -0,0 +1,264 @@
+"""
+Writing historical records in bulk.
+
+Normally each save of a versioned model writes its historical record
+right away, looking up the most recent version of each versioned
+ForeignKey and ManyToMany target as it goes.  Inside a bulk_history()
+block the records are collected instead and written when the block
+exits: one bulk_create() per historical model, with the versions of
+related objects looked up in one query per related model.
+
+    with bulk_history():
+        for page in pages:
+            page.save(comment="Imported")
+
+Other post_save handlers on the versioned models run as usual, but they
+won't find the new historical records until the block exits.
+"""
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+from django.db.models import signals
+
+from utils import get_versions, is_versioned
+from delta import encode_deltas
+
+_pending = threading.local()
+
+
+class PendingRecord(object):
+    """
+    A historical record waiting to be written.
+
+    Attributes:
+        tracker: The ChangesTracker of the instance's model.
+        instance: The instance that was saved.
+        attrs: The historical record's field values as of the save, minus
+            the versioned ForeignKeys.
+        versioned_fks: A list of (field, fk_hist_model, fk_id_name,
+            fk_id_val) for the versioned ForeignKeys still to be resolved.
+    """
+    def __init__(self, tracker, instance, attrs, versioned_fks):
+        self.tracker = tracker
+        self.instance = instance
+        self.attrs = attrs
+        self.versioned_fks = versioned_fks
+        self.hist_model = get_versions(instance).model
+
+
+def bulk_history_pending():
+    """
+    Returns:
+        The list of PendingRecords of the current bulk_history() block, or
+        None if we're not in one.
+    """
+    return getattr(_pending, 'records', None)
+
+
+@contextmanager
+def bulk_history():
+    """
+    Collects the historical records for versioned instances saved inside
+    the block and writes them in bulk when it exits.  Blocks can be
+    nested; the outermost one does the writing.
+    """
+    if bulk_history_pending() is not None:
+        yield
+        return
+
+    _pending.records = []
+    try:
+        yield
+    finally:
+        try:
+            # Writing records can lead to more saves, and so more records.
+            while bulk_history_pending():
+                flush_bulk_history()
+        finally:
+            _pending.records = None
+
+
+def bulk_save_with_history(instances, **kws):
+    """
+    Saves each of `instances`, passing `kws` (e.g. comment="Imported") on
+    to save(), and writes their historical records in bulk.
+    """
+    with bulk_history():
+        for instance in instances:
+            instance.save(**kws)
+
+
+def flush_bulk_history():
+    """
+    Writes out the historical records collected so far, if any.  Called
+    before anything that needs the records to be in place, e.g. changing
+    an instance's ManyToMany set or deleting it.
+    """
+    records = bulk_history_pending()
+    if not records:
+        return
+    _pending.records = []
+
+    # Records can't be bulk-created if they point at another record from
+    # this batch (we don't know its id yet) or if their historical model
+    # uses multi-table inheritance.  These are written one at a time,
+    # after the rest.
+    pending_keys = set((r.hist_model, r.instance.pk) for r in records)
+    bulk, one_by_one = [], []
+    for record in records:
+        depends_on_batch = any(
+            (fk_hist_model, fk_id_val) in pending_keys
+            for (field, fk_hist_model, fk_id_name, fk_id_val) in record.versioned_fks)
+        if depends_on_batch or record.hist_model._meta.parents:
+            one_by_one.append(record)
+        else:
+            bulk.append(record)
+
+    _resolve_versioned_fks(bulk)
+
+    by_model = defaultdict(list)
+    for record in bulk:
+        by_model[record.hist_model].append(record)
+    for hist_model, model_records in by_model.iteritems():
+        _write_records(hist_model, model_records)
+
+    for record in one_by_one:
+        hist_instance = record.tracker.write_historical_record(
+            record.instance, record.attrs, record.versioned_fks)
+        record.tracker.m2m_init(record.instance, hist_instance)
+
+
+def _most_recent_versions(fk_hist_model, fk_id_name, ids):
+    """
+    Returns:
+        A dictionary mapping each of `ids` that has a version to the
+        history_id of its most recent version.
+    """
+    most_recent = {}
+    versions = fk_hist_model.objects.filter(**{'%s__in' % fk_id_name: set(ids)})
+    for (fk_id, history_id) in versions.order_by('-history_date', '-history_id').\
+            values_list(fk_id_name, 'history_id'):
+        most_recent.setdefault(fk_id, history_id)
+    return most_recent
+
+
+def _resolve_versioned_fks(records):
+    wanted = defaultdict(set)
+    for record in records:
+        for (field, fk_hist_model, fk_id_name, fk_id_val) in record.versioned_fks:
+            if fk_id_val is not None:
+                wanted[(fk_hist_model, fk_id_name)].add(fk_id_val)
+
+    resolved = {}
+    for (fk_hist_model, fk_id_name), ids in wanted.iteritems():
+        resolved[(fk_hist_model, fk_id_name)] = _most_recent_versions(
+            fk_hist_model, fk_id_name, ids)
+
+    for record in records:
+        for (field, fk_hist_model, fk_id_name, fk_id_val) in record.versioned_fks:
+            versions = resolved.get((fk_hist_model, fk_id_name), {})
+            record.attrs[field.attname] = versions.get(fk_id_val)
+
+
+def _number_records(hist_model, records):
+    """
+    Sets the version number of each record, and stores its delta fields
+    as deltas where that's worthwhile.  Only the first record of each
+    instance needs a lookup, which is usually served from the
+    most-recent-version cache.
+    """
+    latest = {}
+    numbers = {}
+    for record in records:
+        key = get_versions(record.instance).most_recent_cache_key()
+        if key not in latest:
+            latest[key] = record.tracker.latest_version(record.instance)
+            numbers[key] = record.tracker.next_version_number(
+                record.instance, latest[key])
+        else:
+            numbers[key] += 1
+        record.attrs['history_version'] = numbers[key]
+        # The ids of the other records in the batch aren't known yet, so
+        # deltas are always against what's already written.
+        encode_deltas(hist_model, record.attrs, latest[key])
+
+
+def _write_records(hist_model, records):
+    _number_records(hist_model, records)
+    hist_instances = []
+    for record in records:
+        hist_instance = hist_model(**record.attrs)
+        # bulk_create() doesn't send pre_save, which fills in the
+        # automatically-set fields (user, IP).
+        signals.pre_save.send(sender=hist_model, instance=hist_instance,
+            raw=False, using=None, update_fields=None)
+        hist_instances.append(hist_instance)
+    hist_model.objects.bulk_create(hist_instances)
+
+    # bulk_create() doesn't give us the new ids, so we look them up by
+    # the instance's pk and the record's date.
+    pk_attname = records[0].instance._meta.pk.attname
+    ids = defaultdict(list)
+    written = hist_model.objects.filter(**{
+        '%s__in' % pk_attname: set(r.instance.pk for r in records),
+        'history_date__gte': min(h.history_date for h in hist_instances),
+    }).order_by('history_id')
+    for (pk, date, history_id) in written.values_list(
+            pk_attname, 'history_date', 'history_id'):
+        ids[(pk, date)].append(history_id)
+    for hist_instance in hist_instances:
+        key = (getattr(hist_instance, pk_attname), hist_instance.history_date)
+        if ids.get(key):
+            hist_instance.history_id = ids[key].pop(0)
+
+    written = [(r, h) for (r, h) in zip(records, hist_instances)
+               if h.history_id is not None]
+    _write_m2ms(written)
+    for (record, hist_instance) in written:
+        signals.post_save.send(sender=hist_model, instance=hist_instance,
+            created=True, raw=False, using=None, update_fields=None)
+
+
+def _write_m2ms(written):
+    """
+    Args:
+        written: A list of (PendingRecord, historical instance) for
+            records of a single model that have just been written.
+    """
+    if not written:
+        return
+    model = written[0][0].instance.__class__
+    hist_model = written[0][1].__class__
+    pk_attname = model._meta.pk.attname
+    tracked = [(r.instance, h) for (r, h) in written]
+
+    for field in model._meta.many_to_many:
+        if not is_versioned(field.rel.to):
+            continue
+        through = getattr(model, field.name).through
+        source = '%s_id' % field.m2m_field_name()
+        target = '%s_id' % field.m2m_reverse_field_name()
+
+        targets_by_source = defaultdict(list)
+        rows = through.objects.filter(**{
+            '%s__in' % source: set(i.pk for (i, h) in tracked)})
+        for (source_id, target_id) in rows.values_list(source, target):
+            targets_by_source[source_id].append(target_id)
+
+        target_model = field.rel.to
+        versions = _most_recent_versions(get_versions(target_model).model,
+            target_model._meta.pk.attname,
+            [t for ts in targets_by_source.values() for t in ts])
+
+        hist_field = hist_model._meta.get_field(field.name)
+        hist_through = hist_field.rel.through
+        hist_source = '%s_id' % hist_field.m2m_field_name()
+        hist_target = '%s_id' % hist_field.m2m_reverse_field_name()
+        hist_through.objects.bulk_create([
+            hist_through(**{hist_source: h.history_id,
+                            hist_target: versions[target_id]})
+            for (instance, h) in tracked
+            for target_id in targets_by_source[getattr(instance, pk_attname)]
+            if target_id in versions
+        ])
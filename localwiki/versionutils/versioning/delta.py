@@ -0,0 +1,190 @@
+"""
+Delta storage for large text fields of historical records.
+
+Normally each historical record holds a full copy of every field, so a
+page edited a thousand times has a thousand copies of its content.  The
+fields listed in the VERSIONUTILS_DELTA_FIELDS setting, e.g.
+
+    VERSIONUTILS_DELTA_FIELDS = {'pages.Page': ['content']}
+
+are instead stored as a diff against a recent full copy (a *snapshot*)
+of the same object.  A new snapshot is stored every
+VERSIONUTILS_DELTA_SNAPSHOT_INTERVAL versions, or sooner if the diff
+would be large.  Every delta is against a snapshot, never against
+another delta, so reading a field costs at most one extra query.
+
+Deltas are turned back into text when the field is read from a
+historical instance.  Only numbered history (see number_versions) is
+stored this way.
+
+Anything that reads the field without going through a historical
+instance -- values(), values_list(), extra() or raw SQL over the
+historical table, or filtering on the field -- sees the stored deltas
+rather than the text.  Such readers need to resolve() the values that
+is_delta(), or use delta_length() if they only want the length.
+"""
+import urllib
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+
+from utils import get_versions
+
+DELTA_MARKER = u'\x01delta:'
+DEFAULT_SNAPSHOT_INTERVAL = 20
+
+
+def delta_fields(model):
+    """
+    Returns:
+        The names of the fields of `model` to store as deltas.
+    """
+    label = '%s.%s' % (model._meta.app_label, model._meta.object_name)
+    fields = getattr(settings, 'VERSIONUTILS_DELTA_FIELDS', {})
+    return tuple(fields.get(label, ()))
+
+
+def snapshot_interval():
+    return getattr(settings, 'VERSIONUTILS_DELTA_SNAPSHOT_INTERVAL',
+                   DEFAULT_SNAPSHOT_INTERVAL)
+
+
+def is_delta(value):
+    return isinstance(value, basestring) and value.startswith(DELTA_MARKER)
+
+
+def delta_prefix(snapshot_id):
+    return u'%s%d:' % (DELTA_MARKER, snapshot_id)
+
+
+def _diff_match_patch():
+    from versionutils.diff.diff_match_patch import diff_match_patch
+    return diff_match_patch()
+
+
+def make_delta(snapshot_id, snapshot_text, text):
+    dmp = _diff_match_patch()
+    diffs = dmp.diff_main(snapshot_text, text)
+    dmp.diff_cleanupEfficiency(diffs)
+    return delta_prefix(snapshot_id) + unicode(dmp.diff_toDelta(diffs))
+
+
+def parse_delta(value):
+    """
+    Returns:
+        A tuple (snapshot_id, delta).
+    """
+    snapshot_id, delta = value[len(DELTA_MARKER):].split(u':', 1)
+    return (int(snapshot_id), delta)
+
+
+def apply_delta(snapshot_text, delta):
+    dmp = _diff_match_patch()
+    return dmp.diff_text2(dmp.diff_fromDelta(snapshot_text, delta))
+
+
+def delta_length(value):
+    """
+    Returns:
+        The length of the text that the delta `value` stands for.  Unlike
+        resolve(), this doesn't need the snapshot.
+    """
+    length = 0
+    for token in parse_delta(value)[1].encode('ascii').split('\t'):
+        if token.startswith('+'):
+            length += len(urllib.unquote(token[1:]).decode('utf-8'))
+        elif token.startswith('='):
+            length += int(token[1:])
+    return length
+
+
+def resolve(hist_model, name, value):
+    """
+    Returns:
+        The text that `value`, the stored value of the field `name` of a
+        `hist_model` record, stands for.
+    """
+    if not is_delta(value):
+        return value
+    snapshot_id, delta = parse_delta(value)
+    snapshot_text = hist_model.objects.filter(history_id=snapshot_id).\
+        values_list(name, flat=True)[0]
+    return apply_delta(snapshot_text, delta)
+
+
+def _snapshot_of(hist_model, name, latest):
+    """
+    Returns:
+        A tuple (snapshot_id, snapshot_version, snapshot_text) for the
+        snapshot that the field `name` of the record `latest` is stored
+        against, or is itself.
+    """
+    stored, version = hist_model.objects.filter(history_id=latest.pk).\
+        values_list(name, 'history_version')[0]
+    if not is_delta(stored):
+        return (latest.pk, version, stored)
+    snapshot_id, delta = parse_delta(stored)
+    text, version = hist_model.objects.filter(history_id=snapshot_id).\
+        values_list(name, 'history_version')[0]
+    return (snapshot_id, version, text)
+
+
+def encode_deltas(hist_model, attrs, latest):
+    """
+    Replaces the values of the delta fields in `attrs`, the field values
+    of a new `hist_model` record, with deltas where that's worthwhile.
+
+    Args:
+        latest: The object's most recent historical record before this
+            one, or None.
+    """
+    names = getattr(hist_model, '_delta_fields', ())
+    version = attrs.get('history_version')
+    if not names or latest is None or version is None:
+        return
+
+    for name in names:
+        text = attrs.get(name)
+        if not text or is_delta(text):
+            continue
+        snapshot_id, snapshot_version, snapshot_text = _snapshot_of(
+            hist_model, name, latest)
+        if snapshot_version is None:
+            continue
+        if version - snapshot_version >= snapshot_interval():
+            continue
+        value = make_delta(snapshot_id, snapshot_text, text)
+        # A large delta means the text has drifted far from the
+        # snapshot, so it's time for a new one.
+        if len(value) < len(text) / 2:
+            attrs[name] = value
+
+
+def expand_dependents(hist_instance):
+    """
+    Stores the full text in every record that has a delta against
+    `hist_instance`, so that `hist_instance` can be deleted.
+    """
+    from manager import HistoryManager
+
+    hist_model = hist_instance.__class__
+    names = getattr(hist_model, '_delta_fields', ())
+    if not names:
+        return
+    try:
+        versions = get_versions(hist_instance.version_info._object).all()
+    except (ObjectDoesNotExist, HistoryManager.NoUniqueValuesError):
+        versions = hist_model.objects.all()
+
+    for name in names:
+        snapshot_text = hist_instance.__dict__.get(name)
+        if not snapshot_text or is_delta(snapshot_text):
+            continue
+        dependents = versions.filter(**{
+            'history_id__gt': hist_instance.pk,
+            '%s__startswith' % name: delta_prefix(hist_instance.pk),
+        })
+        for (history_id, value) in dependents.values_list('history_id', name):
+            delta = parse_delta(value)[1]
+            hist_model.objects.filter(history_id=history_id).update(
+                **{name: apply_delta(snapshot_text, delta)})
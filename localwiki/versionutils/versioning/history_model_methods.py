@@ -16,6 +16,7 @@ from django.core.exceptions import ObjectDoesNotExist
 
 from constants import *
 from utils import *
+from delta import is_delta, resolve
 
 
 def get_history_methods(self, model):
@@ -53,6 +54,10 @@ def get_history_fields(self, model):
             model, populate_related=True),
         'history_date': models.DateTimeField(default=datetime.datetime.now, db_index=True),
         'history_version_number': version_number_of,
+        # Stored so that version lookups don't have to count.  Null on
+        # records written before it was added, until they're numbered
+        # with the number_versions command.
+        'history_version': models.PositiveIntegerField(null=True, db_index=True),
         'history_type': models.SmallIntegerField(choices=TYPE_CHOICES),
         'history_type_verbose': type_to_verbose,
         # If you want to display "Reverted to version N" in every change
@@ -265,7 +270,12 @@ def historical_record_getattribute(model, m, name):
             # model instance.
             return m.version_info._object_rel_populated.__getattribute__(name)
 
-    return model.__getattribute__(m, name)
+    value = model.__getattribute__(m, name)
+    if is_delta(value) and name in model.__getattribute__(m, '_delta_fields'):
+        # Stored as a delta.  Swap in the text, once.
+        value = resolve(type(m), name, value)
+        basedict[name] = value
+    return value
 
 
 def _cascade_revert(reverting_to_version, m, **kws):
@@ -434,6 +444,8 @@ def version_number_of(hm):
     Args:
         hm: Historical record instance.
     """
+    if hm.version_info.version is not None:
+        return hm.version_info.version
     if getattr(hm.version_info.instance, '_version_number', None) is None:
         date = hm.version_info.date
         obj = hm.version_info._object
@@ -0,0 +1,82 @@
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+
+from versionutils.versioning import delta
+from versionutils.versioning.manager import HistoryManager
+from versionutils.versioning.utils import get_versions, is_directly_versioned
+
+
+class Command(BaseCommand):
+    help = ('Stores the fields listed in VERSIONUTILS_DELTA_FIELDS as deltas '
+            'throughout the existing history.  Run number_versions first')
+
+    def handle(self, *args, **options):
+        for model in models.get_models():
+            if model._meta.proxy or not is_directly_versioned(model):
+                continue
+            if not get_versions(model).model._delta_fields:
+                continue
+            num_changed = self.compact(model)
+            self.stdout.write('Rewrote %d versions of %s\n'
+                              % (num_changed, model._meta.object_name))
+
+    def compact(self, model):
+        hist_model = get_versions(model).model
+        ids = hist_model.objects.filter(history_version__isnull=False).\
+            order_by('history_id').values_list('history_id', flat=True)
+
+        num_changed = 0
+        done = set()
+        for history_id in ids.iterator():
+            if history_id in done:
+                continue
+            try:
+                hm = hist_model.objects.get(history_id=history_id)
+                versions = get_versions(hm.version_info._object)
+            except (ObjectDoesNotExist, HistoryManager.NoUniqueValuesError):
+                continue
+
+            with transaction.commit_on_success():
+                for name in hist_model._delta_fields:
+                    history = versions.filter(history_version__isnull=False).\
+                        order_by('history_version', 'history_id').\
+                        values_list('history_id', 'history_version', name)
+                    num_changed += self.compact_field(hist_model, name, history)
+                done.update(versions.values_list('history_id', flat=True))
+        return num_changed
+
+    def compact_field(self, hist_model, name, history):
+        """
+        Rewrites one field of an object's history, in version order, the
+        way it would have been stored had deltas been on all along.
+        """
+        interval = delta.snapshot_interval()
+        full_texts = {}
+        snapshot = None
+        num_changed = 0
+        for (history_id, version, stored) in history:
+            if delta.is_delta(stored):
+                snapshot_id, d = delta.parse_delta(stored)
+                if snapshot_id in full_texts:
+                    text = delta.apply_delta(full_texts[snapshot_id], d)
+                else:
+                    text = delta.resolve(hist_model, name, stored)
+            else:
+                text = stored
+            full_texts[history_id] = text
+
+            value = text
+            if (text and snapshot is not None and
+                    version - snapshot[1] < interval):
+                candidate = delta.make_delta(snapshot[0], snapshot[2], text)
+                if len(candidate) < len(text) / 2:
+                    value = candidate
+            if not delta.is_delta(value):
+                snapshot = (history_id, version, text)
+
+            if value != stored:
+                hist_model.objects.filter(history_id=history_id).update(
+                    **{name: value})
+                num_changed += 1
+        return num_changed
@@ -0,0 +1,71 @@
+from itertools import chain
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models import Count
+
+from versionutils.versioning.manager import HistoryManager
+from versionutils.versioning.utils import get_versions, is_directly_versioned
+
+
+class Command(BaseCommand):
+    help = ('Stores the version number of each historical record that '
+            'doesn\'t have one yet, and renumbers the history of objects '
+            'where two records have the same number')
+
+    def handle(self, *args, **options):
+        for model in models.get_models():
+            if model._meta.proxy or not is_directly_versioned(model):
+                continue
+            num_numbered = self.number_versions(model)
+            self.stdout.write('Numbered %d versions of %s\n'
+                              % (num_numbered, model._meta.object_name))
+
+    def duplicate_ids(self, model, hist_model):
+        """
+        Returns:
+            The id of one record of each object whose history has two
+            records with the same version number.
+        """
+        pk_attname = model._meta.pk.attname
+        duplicates = hist_model.objects.filter(history_version__isnull=False).\
+            values(pk_attname, 'history_version').\
+            annotate(num=Count('history_id')).filter(num__gt=1)
+        ids = set()
+        for d in duplicates:
+            ids.add(hist_model.objects.filter(**{
+                pk_attname: d[pk_attname],
+                'history_version': d['history_version'],
+            }).values_list('history_id', flat=True)[0])
+        return ids
+
+    def number_versions(self, model):
+        hist_model = get_versions(model).model
+        unnumbered = hist_model.objects.filter(history_version__isnull=True)
+        ids = unnumbered.order_by('history_id').values_list(
+            'history_id', flat=True)
+        duplicate_ids = sorted(self.duplicate_ids(model, hist_model))
+
+        num_numbered = 0
+        done = set()
+        for history_id in chain(ids.iterator(), duplicate_ids):
+            if history_id in done:
+                continue
+            try:
+                hm = hist_model.objects.get(history_id=history_id)
+                versions = get_versions(hm.version_info._object)
+                history = list(versions.order_by('history_date', 'history_id').
+                    values_list('history_id', 'history_version'))
+            except (ObjectDoesNotExist, HistoryManager.NoUniqueValuesError):
+                continue
+
+            with transaction.commit_on_success():
+                # Numbered the same way version_number() counts them.
+                for (number, (h_id, version)) in enumerate(history, 1):
+                    done.add(h_id)
+                    if version != number:
+                        hist_model.objects.filter(history_id=h_id).update(
+                            history_version=number)
+                        num_numbered += 1
+        return num_numbered
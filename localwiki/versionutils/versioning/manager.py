@@ -1,9 +1,15 @@
+import hashlib
+
 from django.db import models
 from django.db.models.query import QuerySet
+from django.core.cache import cache
+from django.utils.encoding import smart_str
 
 from utils import *
 from decorators import *
 
+MOST_RECENT_CACHE_TIMEOUT = 60 * 60 * 24
+
 
 class HistoryDescriptor(object):
     def __init__(self, model):
@@ -108,6 +114,15 @@ class HistoryManager(models.Manager):
         if self.instance is None:
             return HistoricalMetaInfoQuerySet(model=self.model)
 
+        return HistoricalMetaInfoQuerySet(model=self.model).filter(
+            **self._lookup())
+
+    def _lookup(self):
+        """
+        Returns:
+            The filter() keywords that pick out the instance's historical
+            records.
+        """
         # TODO: Explore using natural_key() here if it exists on the
         # model. One idea: SHA-1 an escaped, string form of the
         # natural_key() and store it as an indexed field in the
@@ -151,23 +166,61 @@ class HistoryManager(models.Manager):
                     "Wasn't passed an active (existing) instance and model "
                     "has no unique fields or no unique_together defined!"
                 )
+        return filter
 
-        return HistoricalMetaInfoQuerySet(model=self.model).filter(**filter)
+    @require_instance
+    def most_recent_cache_key(self):
+        """
+        Returns:
+            The cache key holding the history_id of the instance's most
+            recent historical record.
+        """
+        lookup = sorted(
+            (k, smart_str(getattr(v, 'pk', v)))
+            for k, v in self._lookup().iteritems()
+        )
+        return 'versioning:most_recent:%s.%s:%s' % (
+            self.model._meta.app_label, self.model._meta.object_name,
+            hashlib.md5(repr(lookup)).hexdigest())
 
     def most_recent(self):
         """
         Returns:
-            The most recent historical record instance.
+            The most recent historical record instance.  The id of a
+            recent record is kept in the cache, so this usually only
+            looks at the records from that one on rather than the
+            instance's whole history.
 
         Raises:
             DoesNotExist: Instance has no historical record.
         """
+        key = None
+        if self.instance is not None:
+            key = self.most_recent_cache_key()
+            history_id = cache.get(key)
+            if history_id is not None:
+                # The cached id is only a lower bound: it may have been
+                # cached by a request that couldn't see a newer record
+                # yet, or pointers set by simultaneous saves may have
+                # landed out of order.  Newer records have larger ids, so
+                # we look at everything from the cached one on.  Still
+                # filtered by the instance, in case the record has since
+                # been changed to belong to something else.
+                recent = list(self.all().filter(pk__gte=history_id)[:1])
+                if recent:
+                    v = recent[0]
+                    if v.pk != history_id:
+                        cache.set(key, v.pk, MOST_RECENT_CACHE_TIMEOUT)
+                    return v
+
         try:
             v = self.all()[0]
-            return v
         except IndexError:
             raise self.instance.DoesNotExist("%s has no historical record." %
                                              self.instance._meta.object_name)
+        if key:
+            cache.set(key, v.pk, MOST_RECENT_CACHE_TIMEOUT)
+        return v
 
     @require_instance
     def as_of(self, date=None, version=None):
@@ -187,7 +240,12 @@ class HistoryManager(models.Manager):
         """
         try:
             if version and version > 0:
-                v = self.all().order_by('history_date')[version - 1]
+                try:
+                    v = self.get(history_version=version)
+                except (self.model.DoesNotExist,
+                        self.model.MultipleObjectsReturned):
+                    # Not numbered yet.
+                    v = self.all().order_by('history_date')[version - 1]
             elif date:
                 v = self.filter(history_date__lte=date)[0]
         except IndexError:
@@ -17,6 +17,42 @@ IGNORE_USER_INFO_METHODS = (
 # different threads, too.
 _threadlocal = threading.local()
 
+# Model class -> the AutoSetFields on it.
+_auto_set_fields = {}
+
+
+def _get_auto_set_fields(model):
+    fields = _auto_set_fields.get(model)
+    if fields is None:
+        fields = [f for f in model._meta.fields if isinstance(f, AutoSetField)]
+        _auto_set_fields[model] = fields
+    return fields
+
+
+def _lookup_field_value(request, field):
+    if isinstance(field, AutoUserField):
+        if hasattr(request, 'user') and request.user.is_authenticated():
+            return request.user
+    elif isinstance(field, AutoIPAddressField):
+        return request.META.get('REMOTE_ADDR', None)
+
+
+def update_fields(sender, instance, **kws):
+    """
+    Fills in the empty automatically-set-fields of `instance` from the
+    request currently being handled, if any.
+    """
+    request = getattr(_threadlocal, 'request', None)
+    if request is None:
+        return
+    for field in _get_auto_set_fields(sender):
+        # only set the field if it's currently empty
+        if getattr(instance, field.attname) is None:
+            val = _lookup_field_value(request, field)
+            setattr(instance, field.name, val)
+
+signals.pre_save.connect(update_fields, dispatch_uid='versioning.auto_track_user_info')
+
 
 class AutoTrackUserInfoMiddleware(object):
     """
@@ -30,21 +66,10 @@ class AutoTrackUserInfoMiddleware(object):
             pass
 
         _threadlocal.request = request
-        signals.pre_save.connect(self.update_fields, weak=False)
-
-    def _lookup_field_value(self, field):
-        request = _threadlocal.request
-        if isinstance(field, AutoUserField):
-            if hasattr(request, 'user') and request.user.is_authenticated():
-                return request.user
-        elif isinstance(field, AutoIPAddressField):
-            return request.META.get('REMOTE_ADDR', None)
-
-    def update_fields(self, sender, instance, **kws):
-        for field in instance._meta.fields:
-            # Find our automatically-set-fields.
-            if isinstance(field, AutoSetField):
-                # only set the field if it's currently empty
-                if getattr(instance, field.attname) is None:
-                    val = self._lookup_field_value(field)
-                    setattr(instance, field.name, val)
+
+    def process_response(self, request, response):
+        _threadlocal.request = None
+        return response
+
+    def process_exception(self, request, exception):
+        _threadlocal.request = None
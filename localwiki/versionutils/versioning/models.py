@@ -1,9 +1,11 @@
 import copy
+import datetime
 from functools import partial
 from collections import defaultdict
 
 from django.db import models
 from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
 from django.db.models.options import DEFAULT_NAMES as ALL_META_OPTIONS
 from django.utils.translation import string_concat
 
@@ -12,6 +14,9 @@ from storage import *
 from constants import *
 from history_model_methods import get_history_fields
 from history_model_methods import get_history_methods
+from delta import delta_fields, encode_deltas, expand_dependents
+from bulk import (PendingRecord, bulk_history_pending,
+    flush_bulk_history)
 import fields
 import manager
 
@@ -63,6 +68,13 @@ class ChangesTracker(object):
             models.signals.pre_delete.connect(_pre_delete, weak=False)
             models.signals.post_delete.connect(_post_delete, weak=False)
 
+            if not m._meta.proxy:
+                # Keep the pointer to the most recent version up to date.
+                models.signals.post_save.connect(self.history_post_save,
+                    sender=history_model, weak=False)
+                models.signals.post_delete.connect(self.history_post_delete,
+                    sender=history_model, weak=False)
+
             self.wrap_model_fields(m)
 
         descriptor = manager.HistoryDescriptor(history_model)
@@ -99,6 +111,7 @@ class ChangesTracker(object):
             # Though not strictly a field, this attribute
             # is required for a model to function properly.
             '__module__': model.__module__,
+            '_delta_fields': delta_fields(model),
         }
 
         attrs.update(get_history_methods(self, model))
@@ -434,8 +447,10 @@ class ChangesTracker(object):
                 history_type = TYPE_REVERTED_ADDED if is_revert else TYPE_ADDED
             else:
                 history_type = history_type or TYPE_UPDATED
-        hist_instance = self.create_historical_record(instance, history_type)
-        self.m2m_init(instance, hist_instance)
+        hist_instance = self.create_historical_record(instance, history_type,
+            bulk=True)
+        if hist_instance is not None:
+            self.m2m_init(instance, hist_instance)
 
     def pre_delete(self, parent, instance, **kws):
         if not getattr(settings, 'VERSIONUTILS_VERSIONING_ENABLED', True):
@@ -498,6 +513,8 @@ class ChangesTracker(object):
                 history_type = TYPE_DELETED
 
         if not is_pk_recycle_a_problem(instance) and instance._track_changes:
+            # The delete record has to come after any queued ones.
+            flush_bulk_history()
             hist_instance = self.create_historical_record(
                 instance, history_type)
             self.m2m_init(instance, hist_instance)
@@ -517,6 +534,33 @@ class ChangesTracker(object):
             for h in vs:
                 h.delete()
 
+    def _most_recent_cache_key(self, hist_instance):
+        try:
+            obj = hist_instance.version_info._object
+            return get_versions(obj).most_recent_cache_key()
+        except (ObjectDoesNotExist, manager.HistoryManager.NoUniqueValuesError):
+            return None
+
+    def history_post_save(self, sender, instance, created, **kws):
+        key = self._most_recent_cache_key(instance)
+        if key is None:
+            return
+        if created and not instance._meta.parents:
+            # New records are the most recent.  Should the save not
+            # commit, most_recent() treats the id as a lower bound
+            # anyway.
+            manager.cache.set(key, instance.pk,
+                manager.MOST_RECENT_CACHE_TIMEOUT)
+        else:
+            manager.cache.delete(key)
+
+    def history_post_delete(self, sender, instance, **kws):
+        # Records stored as deltas against this one need its text.
+        expand_dependents(instance)
+        key = self._most_recent_cache_key(instance)
+        if key is not None:
+            manager.cache.delete(key)
+
     def m2m_init(self, instance, hist_instance):
         """
         Initialize the ManyToMany sets on a historical instance.
@@ -547,6 +591,9 @@ class ChangesTracker(object):
             # Skip this signal when we have version tracking disabled.
             return
 
+        # The historical instances we're about to change must be written.
+        flush_bulk_history()
+
         if pk_set:
             changed_ms = [model.objects.get(pk=pk) for pk in pk_set]
             hist_changed_ms = []
@@ -564,13 +611,24 @@ class ChangesTracker(object):
         elif action == 'post_clear':
             hist_through.clear()
 
-    def create_historical_record(self, instance, type):
-        manager = getattr(instance, self.manager_name)
+    def create_historical_record(self, instance, type, bulk=False):
+        """
+        Args:
+            instance: The instance to record a version of.
+            type: The history type of the record, e.g. TYPE_UPDATED.
+            bulk: If True and we're inside a bulk_history() block, the
+                record is queued to be written in bulk and None is
+                returned.
+
+        Returns:
+            The new historical instance.
+        """
         # If they set track_changes to False
         # then we don't auto-create a revision here.
         if not instance._track_changes:
             return
-        attrs = {}
+        attrs = {'history_type': type}
+        versioned_fks = []
         for field in instance._meta.fields:
             if isinstance(field, models.fields.related.ForeignKey):
                 is_fk_to_self = (field.related.parent_model ==
@@ -583,27 +641,86 @@ class ChangesTracker(object):
                         # related field instead.
                         continue
 
-                    # If the FK field is versioned, set it to the most
-                    # recent version of that object.
-                    # The object the FK id refers to may have been
-                    # deleted so we can't simply do Model.objects.get().
+                    # If the FK field is versioned, it's set to the most
+                    # recent version of that object when the record is
+                    # written.
                     fk_hist_model = get_versions(field.rel.to).model
                     fk_id_name = field.rel.field_name
                     fk_id_val = getattr(instance, field.attname)
-                    fk_objs = fk_hist_model.objects.filter(
-                        **{fk_id_name: fk_id_val}
-                    )
-
-                    if fk_objs:
-                        attrs[field.name] = fk_objs[0]  # most recent version
-                    else:
-                        attrs[field.name] = None
+                    versioned_fks.append(
+                        (field, fk_hist_model, fk_id_name, fk_id_val))
                     continue
 
             attrs[field.attname] = getattr(instance, field.attname)
 
         attrs.update(self._get_save_with_attrs(instance))
-        return manager.create(history_type=type, **attrs)
+
+        pending = bulk_history_pending()
+        if bulk and pending is not None:
+            # Record the time of the save, not of the write.
+            attrs.setdefault('history_date', datetime.datetime.now())
+            pending.append(PendingRecord(self, instance, attrs, versioned_fks))
+            return None
+        return self.write_historical_record(instance, attrs, versioned_fks)
+
+    def write_historical_record(self, instance, attrs, versioned_fks):
+        manager = getattr(instance, self.manager_name)
+        for (field, fk_hist_model, fk_id_name, fk_id_val) in versioned_fks:
+            # The object the FK id refers to may have been
+            # deleted so we can't simply do Model.objects.get().
+            fk_objs = fk_hist_model.objects.filter(
+                **{fk_id_name: fk_id_val}
+            )
+
+            if fk_objs:
+                attrs[field.name] = fk_objs[0]  # most recent version
+            else:
+                attrs[field.name] = None
+        self.lock_for_numbering(instance)
+        latest = self.latest_version(instance)
+        attrs['history_version'] = self.next_version_number(instance, latest)
+        encode_deltas(manager.model, attrs, latest)
+        return manager.create(**attrs)
+
+    def latest_version(self, instance):
+        """
+        Returns:
+            The most recent historical record of `instance`, or None.
+        """
+        try:
+            return getattr(instance, self.manager_name).most_recent()
+        except ObjectDoesNotExist:
+            return None
+
+    def lock_for_numbering(self, instance):
+        """
+        Locks `instance`'s row until the end of the transaction, so that
+        simultaneous saves of it are numbered one after the other rather
+        than both getting the same number.  Saving the row normally locks
+        it already; this also covers history written without an update,
+        e.g. after a delete.
+        """
+        if instance.pk is None:
+            return
+        list(instance.__class__._default_manager.select_for_update().
+             filter(pk=instance.pk).values_list('pk', flat=True))
+
+    def next_version_number(self, instance, latest):
+        """
+        Args:
+            latest: The most recent historical record of `instance`, or
+                None.
+
+        Returns:
+            The version number the next historical record of `instance`
+            will have.
+        """
+        if latest is None:
+            return 1
+        if latest.version_info.version is not None:
+            return latest.version_info.version + 1
+        # The history hasn't been numbered yet.
+        return getattr(instance, self.manager_name).count() + 1
 
     def _get_save_with_attrs(self, instance):
         """
@@ -2,6 +2,7 @@ import os
 import copy
 import datetime
 from decimal import Decimal
+from StringIO import StringIO
 
 from django.test import TestCase
 from django.conf import settings
@@ -10,11 +11,23 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.core.files.base import ContentFile
 from django.utils.unittest import skipIf
 from django.test.utils import override_settings
+from django.test.client import RequestFactory
+from django.http import HttpResponse
+from django.db import connection
+from django.db.models import signals
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import get_cache
+from django.core.management import call_command
 
 from utils import TestSettingsManager
 from models import *
 from versionutils.versioning.constants import *
 from versionutils.versioning.utils import is_versioned
+from versionutils.versioning.middleware import AutoTrackUserInfoMiddleware
+from versionutils.versioning import middleware as versioning_middleware
+from versionutils.versioning.fields import AutoSetField
+from versionutils.versioning import bulk_history, bulk_save_with_history
+from versionutils.versioning import manager, delta
 
 mgr = TestSettingsManager()
 INSTALLED_APPS = list(settings.INSTALLED_APPS)
@@ -1356,3 +1369,293 @@ class ChangesTrackingTest(TestCase):
         self.assertEqual(len(m.versions.all()), 0)
         m.delete()
         self.assertEqual(len(m.versions.all()), 0)
+
+
+class AutoTrackUserInfoTest(TestCase):
+    def setUp(self):
+        self.middleware = AutoTrackUserInfoMiddleware()
+        self.request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.1')
+        self.request.user = AnonymousUser()
+
+    def test_tracks_request_info(self):
+        self.middleware.process_request(self.request)
+        m = M1(a="tracked", b="B!", c="C!", d="D!")
+        m.save()
+        self.middleware.process_response(self.request, HttpResponse())
+        self.assertEqual(m.versions.most_recent().version_info.user_ip, '10.0.0.1')
+
+        # Saves made after the request is done aren't attributed to it.
+        m.a = "untracked"
+        m.save()
+        self.assertEqual(m.versions.most_recent().version_info.user_ip, None)
+
+    def test_only_auto_set_fields_visited(self):
+        visited = []
+        lookup_field_value = versioning_middleware._lookup_field_value
+
+        def _record(request, field):
+            visited.append(field)
+            return lookup_field_value(request, field)
+
+        versioning_middleware._lookup_field_value = _record
+        try:
+            self.middleware.process_request(self.request)
+            m = M1(a="tracked", b="B!", c="C!", d="D!")
+            m.save()
+            self.middleware.process_response(self.request, HttpResponse())
+        finally:
+            versioning_middleware._lookup_field_value = lookup_field_value
+
+        self.assertTrue(all(isinstance(f, AutoSetField) for f in visited))
+        self.assertEqual(set(f.name for f in visited),
+                         set(['history_user', 'history_user_ip']))
+
+    def test_constant_cost_per_request(self):
+        # Each request gets the same receivers and saves run the same
+        # queries, however many middleware instances have been created.
+        num_receivers = len(signals.pre_save.receivers)
+
+        def _request(i):
+            middleware = AutoTrackUserInfoMiddleware()
+            middleware.process_request(self.request)
+            M1(a="request %d" % i, b="B!", c="C!", d="D!").save()
+            middleware.process_response(self.request, HttpResponse())
+
+        def _num_queries(i):
+            use_debug_cursor = connection.use_debug_cursor
+            connection.use_debug_cursor = True
+            try:
+                start = len(connection.queries)
+                _request(i)
+                return len(connection.queries) - start
+            finally:
+                connection.use_debug_cursor = use_debug_cursor
+
+        first = _num_queries(0)
+        for i in range(1, 20):
+            _request(i)
+        self.assertEqual(_num_queries(20), first)
+        self.assertEqual(len(signals.pre_save.receivers), num_receivers)
+
+
+class BulkHistoryTest(TestCase):
+    def test_records_written_on_exit(self):
+        with bulk_history():
+            m1 = M1(a="bulk", b="B!", c="C!", d="D!")
+            m1.save()
+            m2 = M1(a="bulk 2", b="B!", c="C!", d="D!")
+            m2.save()
+            m1.a = "bulk edited"
+            m1.save()
+            # Nothing is written until the block exits.
+            self.assertEqual(len(m1.versions.all()), 0)
+
+        self.assertEqual(len(m1.versions.all()), 2)
+        self.assertEqual(len(m2.versions.all()), 1)
+        self.assertEqual(m1.versions.most_recent().a, "bulk edited")
+        self.assertEqual(m1.versions.most_recent().history_type,
+                         TYPE_UPDATED)
+        self.assertEqual(m1.versions.all()[1].history_type, TYPE_ADDED)
+
+    def test_bulk_save_with_history(self):
+        instances = [M1(a="bulk %d" % i, b="B!", c="C!", d="D!")
+                     for i in range(10)]
+        bulk_save_with_history(instances, comment="Imported")
+        for m in instances:
+            self.assertEqual(len(m.versions.all()), 1)
+            m_h = m.versions.most_recent()
+            self.assertEqual(m_h.version_info.comment, "Imported")
+            self.assertEqual(m_h.a, m.a)
+
+    def test_foreign_key(self):
+        m2 = M2(a="target", b="b", c=1)
+        m2.save()
+        m2.a = "target edited"
+        m2.save()
+
+        children = [M12ForeignKey(a=m2, b="child %d" % i) for i in range(3)]
+        bulk_save_with_history(children)
+        for child in children:
+            child_h = child.versions.most_recent()
+            self.assertEqual(child_h.a, m2.versions.most_recent())
+
+    def test_foreign_key_in_batch(self):
+        # The parent's record is written before the child's, so the
+        # child's record points at it.
+        with bulk_history():
+            m2 = M2(a="target", b="b", c=1)
+            m2.save()
+            child = M12ForeignKey(a=m2, b="child")
+            child.save()
+        self.assertEqual(child.versions.most_recent().a,
+                         m2.versions.most_recent())
+
+    def test_many_to_many(self):
+        t1 = LameTag(name="T1")
+        t1.save()
+        t2 = LameTag(name="T2")
+        t2.save()
+        m19 = M19ManyToManyFieldVersioned(a="m19")
+        m19.save()
+        m19.tags.add(t1, t2)
+
+        m19.a = "m19 edited"
+        bulk_save_with_history([m19])
+        m19_h = m19.versions.most_recent()
+        self.assertEqual(m19_h.a, "m19 edited")
+        self.assertEqual(
+            set(m19_h.tags.all()),
+            set([t1.versions.most_recent(), t2.versions.most_recent()]))
+
+
+class MostRecentCacheTest(TestCase):
+    def setUp(self):
+        self.old_cache = manager.cache
+        manager.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+
+    def tearDown(self):
+        manager.cache = self.old_cache
+
+    def test_pointer_follows_saves(self):
+        m = M1(a="first", b="B!", c="C!", d="D!")
+        m.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(m.versions.most_recent().a, "first")
+
+        m.a = "second"
+        m.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(m.versions.most_recent().a, "second")
+
+        m.versions.most_recent().delete()
+        self.assertEqual(m.versions.most_recent().a, "first")
+
+    def test_falls_back_on_miss(self):
+        m = M1(a="first", b="B!", c="C!", d="D!")
+        m.save()
+        manager.cache.clear()
+        self.assertEqual(m.versions.most_recent().a, "first")
+        with self.assertNumQueries(1):
+            m.versions.most_recent()
+
+    def test_deleted(self):
+        m = M1(a="gone", b="B!", c="C!", d="D!")
+        m.save()
+        m.delete()
+        self.assertEqual(m.versions.most_recent().history_type, TYPE_DELETED)
+
+    def test_stale_pointer(self):
+        m = M1(a="first", b="B!", c="C!", d="D!")
+        m.save()
+        first_id = m.versions.most_recent().history_id
+        m.a = "second"
+        m.save()
+        # E.g. cached by a request that read before the save committed.
+        key = m.versions.most_recent_cache_key()
+        manager.cache.set(key, first_id)
+        self.assertEqual(m.versions.most_recent().a, "second")
+        self.assertNotEqual(manager.cache.get(key), first_id)
+
+        # A record whose save was rolled back.
+        manager.cache.set(key, m.versions.most_recent().history_id + 100)
+        self.assertEqual(m.versions.most_recent().a, "second")
+
+
+class VersionNumberTest(TestCase):
+    def test_numbers_stored(self):
+        m = M1(a="v1", b="B!", c="C!", d="D!")
+        m.save()
+        m.a = "v2"
+        m.save()
+        with bulk_history():
+            m.a = "v3"
+            m.save()
+            m.a = "v4"
+            m.save()
+
+        for i, letter in enumerate(["v1", "v2", "v3", "v4"], 1):
+            v = m.versions.as_of(version=i)
+            self.assertEqual(v.a, letter)
+            self.assertEqual(v.version_info.version, i)
+            self.assertEqual(v.version_info.version_number(), i)
+
+    def test_unnumbered_history(self):
+        m = M1(a="v1", b="B!", c="C!", d="D!")
+        m.save()
+        m.a = "v2"
+        m.save()
+        m.versions.all().update(history_version=None)
+
+        m.a = "v3"
+        m.save()
+        self.assertEqual(m.versions.most_recent().version_info.version, 3)
+        self.assertEqual(m.versions.as_of(version=2).a, "v2")
+        self.assertEqual(m.versions.as_of(version=2).version_info.version_number(), 2)
+
+    def test_renumber_duplicates(self):
+        m = M1(a="v1", b="B!", c="C!", d="D!")
+        m.save()
+        m.a = "v2"
+        m.save()
+        m.a = "v3"
+        m.save()
+        m.versions.filter(a="v3").update(history_version=2)
+
+        call_command('number_versions', stdout=StringIO())
+        for i, letter in enumerate(["v1", "v2", "v3"], 1):
+            self.assertEqual(m.versions.as_of(version=i).a, letter)
+            self.assertEqual(m.versions.as_of(version=i).version_info.version, i)
+
+
+class DeltaStorageTest(TestCase):
+    def setUp(self):
+        self.hist_model = M2.versions.model
+        self.old_delta_fields = self.hist_model._delta_fields
+        self.hist_model._delta_fields = ('b',)
+        self.text = u"\n".join([u"Line %d of a long text field." % i
+                                for i in range(100)])
+
+    def tearDown(self):
+        self.hist_model._delta_fields = self.old_delta_fields
+
+    def _stored(self, hm):
+        return self.hist_model.objects.filter(history_id=hm.pk).\
+            values_list('b', flat=True)[0]
+
+    def test_stored_as_delta(self):
+        m = M2(a="a", b=self.text, c=1)
+        m.save()
+        m.b = self.text.replace(u"Line 50", u"Row 50")
+        m.save()
+
+        v1 = m.versions.as_of(version=1)
+        v2 = m.versions.as_of(version=2)
+        self.assertFalse(delta.is_delta(self._stored(v1)))
+        self.assertTrue(delta.is_delta(self._stored(v2)))
+        self.assertTrue(len(self._stored(v2)) < len(self.text) / 2)
+
+        self.assertEqual(v1.b, self.text)
+        self.assertEqual(v2.b, self.text.replace(u"Line 50", u"Row 50"))
+        self.assertEqual(v2.version_info._object.b, m.b)
+        self.assertEqual(delta.delta_length(self._stored(v2)), len(v2.b))
+
+    def test_snapshot_interval(self):
+        m = M2(a="a", b=self.text, c=1)
+        m.save()
+        for i in range(delta.snapshot_interval()):
+            m.b = self.text + u"Edit %d" % i
+            m.save()
+        latest = m.versions.most_recent()
+        self.assertFalse(delta.is_delta(self._stored(latest)))
+        self.assertEqual(latest.b, m.b)
+
+    def test_delete_snapshot(self):
+        m = M2(a="a", b=self.text, c=1)
+        m.save()
+        m.b = self.text + u"Edited"
+        m.save()
+
+        m.versions.as_of(version=1).delete()
+        v2 = m.versions.as_of(version=2)
+        self.assertFalse(delta.is_delta(self._stored(v2)))
+        self.assertEqual(v2.b, self.text + u"Edited")